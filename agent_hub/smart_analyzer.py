@@ -15,6 +15,7 @@ import re
 import subprocess
 import shutil
 import os
+import threading
 from dataclasses import dataclass, field, asdict
 from typing import List, Dict, Any, Optional
 from enum import Enum
@@ -400,11 +401,14 @@ class SmartTaskAnalyzer:
 
 # Singleton instance
 _analyzer_instance = None
+_analyzer_instance_lock = threading.Lock()
 
 
 def get_smart_analyzer() -> SmartTaskAnalyzer:
     """Возвращает singleton экземпляр SmartTaskAnalyzer."""
     global _analyzer_instance
     if _analyzer_instance is None:
-        _analyzer_instance = SmartTaskAnalyzer()
+        with _analyzer_instance_lock:
+            if _analyzer_instance is None:
+                _analyzer_instance = SmartTaskAnalyzer()
     return _analyzer_instance
@@ -22,7 +22,7 @@ from django.db import transaction
 from django.db.models import Q
 from django.utils import timezone
 from django.conf import settings
-from asgiref.sync import async_to_sync
+from asgiref.sync import async_to_sync, sync_to_async
 from loguru import logger
 
 from .models import AgentProfile, AgentRun, AgentPreset, AgentWorkflow, AgentWorkflowRun, CustomAgent
@@ -657,6 +657,34 @@ def _start_agent_run(
     return run
 
 
+def _stream_internal_agent_run(run_obj: AgentRun, agent_name: str, task: str, config: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Выполнить internal-агента через AgentManager.stream_agent.
+    Фрагменты ответа пишутся в run_obj.output_text по мере генерации (сохранение пачками
+    по _LOG_SAVE_BATCH_SIZE), поэтому опрос статуса запуска видит ответ до завершения.
+    Возвращает итоговый результат агента (формат execute()).
+    """
+    agent_manager = get_agent_manager()
+
+    async def consume() -> Dict[str, Any]:
+        parts = []
+        result: Dict[str, Any] = {}
+        pending = 0
+        async for event in agent_manager.stream_agent(agent_name, task, config):
+            if event["type"] == "result":
+                result = event["data"]
+                continue
+            parts.append(event["data"])
+            pending += 1
+            if pending >= _LOG_SAVE_BATCH_SIZE:
+                run_obj.output_text = "".join(parts)
+                await sync_to_async(run_obj.save)(update_fields=["output_text"])
+                pending = 0
+        return result
+
+    return async_to_sync(consume)()
+
+
 def _execute_agent_run(run_id: int, agent_type: str, runtime: str, task: str, config: Dict[str, Any]):
     run_obj = AgentRun.objects.get(id=run_id)
     run_obj.status = "running"
@@ -760,10 +788,9 @@ def _execute_agent_run(run_id: int, agent_type: str, runtime: str, task: str, co
             )
             run_obj.save(update_fields=["logs", "log_events", "meta"])
         if runtime == "internal":
-            agent_manager = get_agent_manager()
             agent_name = _agent_name_from_type(agent_type)
             config["skill_context"] = config.get("skill_context") or (run_obj.meta or {}).get("skill_context")
-            result = async_to_sync(agent_manager.execute_agent)(agent_name, effective_task, config)
+            result = _stream_internal_agent_run(run_obj, agent_name, effective_task, config)
             run_obj.output_text = result.get("result") or ""
             run_obj.logs = json.dumps(result.get("metadata") or {}, ensure_ascii=False)
             run_obj.status = "succeeded" if result.get("success") else "failed"
@@ -1486,7 +1513,7 @@ def api_workflow_generate(request):
     file_path = workflows_dir / f"workflow-{workflow.id}.json"
     parsed["script_file"] = str(file_path)
     with open(file_path, "w", encoding="utf-8") as f:
-        json.dump(parsed, f, ensure_ascii=False, indent=2)
+        f.write(json.dumps(parsed, ensure_ascii=False, indent=2))
 
     if parsed.get("ralph_yml"):
         ralph_path = workflows_dir / f"workflow-{workflow.id}.ralph.yml"
@@ -3602,7 +3629,7 @@ def api_assist_auto(request):
     file_path = workflows_dir / f"workflow-{workflow.id}.json"
     script["script_file"] = str(file_path)
     with open(file_path, "w", encoding="utf-8") as f:
-        json.dump(script, f, ensure_ascii=False, indent=2)
+        f.write(json.dumps(script, ensure_ascii=False, indent=2))
 
     if script.get("ralph_yml"):
         ralph_path = workflows_dir / f"workflow-{workflow.id}.ralph.yml"
@@ -4027,7 +4054,7 @@ def api_workflow_create_manual(request):
     file_path = workflows_dir / f"workflow-{workflow.id}.json"
     script["script_file"] = str(file_path)
     with open(file_path, "w", encoding="utf-8") as f:
-        json.dump(script, f, ensure_ascii=False, indent=2)
+        f.write(json.dumps(script, ensure_ascii=False, indent=2))
     
     if script.get("ralph_yml"):
         ralph_path = workflows_dir / f"workflow-{workflow.id}.ralph.yml"
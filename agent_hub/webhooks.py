@@ -336,7 +336,7 @@ def api_webhook_receive(request, secret: str):
                     script["script_file"] = str(file_path)
 
                     with open(file_path, "w", encoding="utf-8") as f:
-                        json.dump(script, f, ensure_ascii=False, indent=2)
+                        f.write(json.dumps(script, ensure_ascii=False, indent=2))
 
                     if script.get("ralph_yml"):
                         ralph_path = workflows_dir / f"workflow-{workflow.id}.ralph.yml"
@@ -1,10 +1,28 @@
 """
 Base Agent class - foundation for all agents
 """
+import hashlib
+import time
+import types
 from abc import ABC, abstractmethod
-from typing import Dict, Any, Optional, List
+from collections import OrderedDict
+from typing import AsyncGenerator, Dict, Any, Mapping, Optional, List, Tuple
 from loguru import logger
 
+# TTL-кэш RAG-контекста агентов: sha1(task) -> (expires_at, rag_context)
+RAG_CACHE_TTL_SECONDS = 300
+RAG_CACHE_MAX_SIZE = 256
+_rag_context_cache: Dict[str, Tuple[float, str]] = {}
+
+# Отформатированный RAG-контекст по (sha1(task), k): (top-k документы, строка) — при том же
+# наборе документов после истечения TTL строка не собирается заново
+RAG_FORMAT_CACHE_MAX_SIZE = 256
+_rag_format_cache: "OrderedDict[Tuple[str, int], Tuple[Tuple[str, ...], str]]" = OrderedDict()
+
+
+def _rag_cache_key(task: str) -> str:
+    return hashlib.sha1(task.strip().lower().encode("utf-8")).hexdigest()
+
 
 class BaseAgent(ABC):
     """
@@ -12,6 +30,9 @@ class BaseAgent(ABC):
     All agents must implement the execute method.
     """
     
+    # Общий контекст по умолчанию (только чтение): execute без context не создаёт новый dict
+    _DEFAULT_CONTEXT: Mapping[str, Any] = types.MappingProxyType({'use_rag': True})
+    
     def __init__(self, name: str, description: str):
         self.name = name
         self.description = description
@@ -43,6 +64,45 @@ class BaseAgent(ABC):
             self._llm_provider = LLMProvider()
         return self._llm_provider
     
+    def _get_rag_context(self, task: str) -> str:
+        """
+        RAG-контекст для задачи; повторные и совпадающие задачи берутся из TTL-кэша.
+        Синхронный (поиск в векторной БД) — из async-кода вызывать через asyncio.to_thread.
+        """
+        key = _rag_cache_key(task)
+        now = time.monotonic()
+        cached = _rag_context_cache.get(key)
+        if cached and cached[0] > now:
+            return cached[1]
+
+        rag_context = ""
+        n_results = 3
+        try:
+            results = self.rag_engine.query(task, n_results=n_results)
+            if results.get('documents') and results['documents'][0]:
+                docs = tuple(results['documents'][0][:n_results])
+                if docs:
+                    format_key = (key, n_results)
+                    formatted = _rag_format_cache.get(format_key)
+                    if formatted is not None and formatted[0] == docs:
+                        _rag_format_cache.move_to_end(format_key)
+                        rag_context = formatted[1]
+                    else:
+                        rag_context = "📚 " + "\n📚 ".join(docs)
+                        _rag_format_cache[format_key] = (docs, rag_context)
+                        if len(_rag_format_cache) > RAG_FORMAT_CACHE_MAX_SIZE:
+                            _rag_format_cache.popitem(last=False)
+        except Exception as e:
+            logger.warning(f"RAG query failed: {e}")
+            return rag_context
+
+        _rag_context_cache.pop(key, None)
+        if len(_rag_context_cache) >= RAG_CACHE_MAX_SIZE:
+            # Вытесняем самую старую запись
+            _rag_context_cache.pop(next(iter(_rag_context_cache)))
+        _rag_context_cache[key] = (now + RAG_CACHE_TTL_SECONDS, rag_context)
+        return rag_context
+    
     @abstractmethod
     async def execute(self, task: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
@@ -61,6 +121,28 @@ class BaseAgent(ABC):
         """
         raise NotImplementedError("BaseAgent.execute must be implemented by subclasses.")
     
+    async def execute_stream(
+        self, task: str, context: Optional[Dict[str, Any]] = None
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        Execute the task as a stream of events.
+        
+        Yields:
+            {'type': 'chunk', 'data': str} — очередной фрагмент ответа (если агент умеет стримить)
+            {'type': 'result', 'data': Dict} — итоговый результат в формате execute(), всегда последним
+        
+        По умолчанию агент не стримит: один 'result' с результатом execute().
+        """
+        yield {'type': 'result', 'data': await self.execute(task, context)}
+    
+    async def collect_stream(self, task: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Буферизующая обёртка над execute_stream: вернуть итоговый результат"""
+        result = None
+        async for event in self.execute_stream(task, context):
+            if event['type'] == 'result':
+                result = event['data']
+        return result
+    
     def get_info(self) -> Dict[str, Any]:
         """Get agent information"""
         return {
@@ -69,8 +151,8 @@ class BaseAgent(ABC):
             'type': self.__class__.__name__
         }
     
-    def validate_context(self, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-        """Validate and normalize context"""
-        if context is None:
-            context = {}
+    def validate_context(self, context: Optional[Dict[str, Any]] = None) -> Mapping[str, Any]:
+        """Validate and normalize context (пустой контекст — общий read-only _DEFAULT_CONTEXT)"""
+        if not context:
+            return self._DEFAULT_CONTEXT
         return context
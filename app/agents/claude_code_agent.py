@@ -1,7 +1,7 @@
 """
 Claude Code CLI Agent - wrapper for Claude Code CLI
 """
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List
 from loguru import logger
 from app.agents.base_agent import BaseAgent
 from app.core.model_config import model_manager
@@ -79,6 +79,12 @@ class ClaudeCodeAgent(BaseAgent):
             if continue_session:
                 config['continue'] = True
             
+            # Стабильный контекст (workspace, директории, инструменты, агент) — в system prompt:
+            # Claude CLI кэширует этот префикс между вызовами, динамической остаётся только задача
+            stable_preamble = self._build_stable_preamble(workspace, additional_dirs, allowed_tools, custom_agent)
+            if stable_preamble:
+                config['append-system-prompt'] = stable_preamble
+            
             logger.info(f"Claude Code CLI: model={claude_model}, workspace={workspace}")
             
             # Execute via CLI Runtime Manager
@@ -88,28 +94,28 @@ class ClaudeCodeAgent(BaseAgent):
                 config=config
             )
             
-            if result['success']:
+            if result.success:
                 return {
                     'success': True,
-                    'result': result['output'],
+                    'result': result.output,
                     'error': None,
                     'metadata': {
                         'agent_type': 'claude_code',
                         'model': claude_model,
                         'runtime': 'claude_cli',
                         'context_tokens': '200K',
-                        'exit_code': result.get('meta', {}).get('exit_code', 0)
+                        'exit_code': result.meta.get('exit_code', 0)
                     }
                 }
             else:
                 return {
                     'success': False,
                     'result': None,
-                    'error': result.get('logs', 'Unknown error'),
+                    'error': result.logs or 'Unknown error',
                     'metadata': {
                         'agent_type': 'claude_code',
                         'runtime': 'claude_cli',
-                        'exit_code': result.get('meta', {}).get('exit_code', -1)
+                        'exit_code': result.meta.get('exit_code', -1)
                     }
                 }
         
@@ -131,3 +137,19 @@ class ClaudeCodeAgent(BaseAgent):
                 'error': str(e),
                 'metadata': {'agent_type': 'claude_code'}
             }
+
+    @staticmethod
+    def _build_stable_preamble(
+        workspace: str, additional_dirs: List[str], allowed_tools: List[str], custom_agent: Optional[str]
+    ) -> str:
+        """Собрать неизменный между итерациями контекст для --append-system-prompt"""
+        lines = []
+        if workspace:
+            lines.append(f"Workspace: {workspace}")
+        if additional_dirs:
+            lines.append(f"Additional directories: {', '.join(additional_dirs)}")
+        if allowed_tools:
+            lines.append(f"Allowed tools: {', '.join(allowed_tools)}")
+        if custom_agent:
+            lines.append(f"Custom agent: {custom_agent}")
+        return "\n".join(lines)
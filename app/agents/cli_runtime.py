@@ -2,20 +2,110 @@
 CLI runtime integration for Cursor, OpenCode, and Gemini CLI.
 """
 import asyncio
+import dataclasses
+import hashlib
+import io
+import json
+import re
 import shlex
-from dataclasses import dataclass
-from typing import Dict, Any, List
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, ClassVar, Optional, Tuple, Union
 import os
 from django.conf import settings
 from loguru import logger
 
+try:
+    # uvloop (Linux/macOS): быстрее обработка subprocess-пайпов в asyncio.run() CLI-вызовов
+    import uvloop
+except ImportError:
+    uvloop = None
 
-@dataclass
+# Кэш ответов одноразовых CLI-вызовов (opt-in: "response_cache": True в конфиге runtime):
+# sha1(cmd + task + env) -> (expires_at, result)
+RESPONSE_CACHE_TTL_SECONDS = 60
+RESPONSE_CACHE_MAX_SIZE = 128
+_response_cache: Dict[str, Tuple[float, "CliRunResult"]] = {}
+
+_PROMISE_RE = re.compile(r"<promise>(.*?)</promise>", re.DOTALL | re.IGNORECASE)
+_PROMISE_BYTES_RE = re.compile(rb"<promise>(.*?)</promise>", re.DOTALL | re.IGNORECASE)
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# Сколько ждать завершения CLI после SIGTERM перед SIGKILL (сек)
+TERMINATE_GRACE_SECONDS = 2.0
+
+
+async def _terminate_process(process: asyncio.subprocess.Process, grace: float = TERMINATE_GRACE_SECONDS):
+    """SIGTERM с коротким ожиданием, SIGKILL — только если процесс не завершился сам."""
+    if process.returncode is not None:
+        return
+    process.terminate()
+    try:
+        await asyncio.wait_for(process.wait(), timeout=grace)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+
+
+def install_uvloop_policy() -> bool:
+    """
+    Включить uvloop для всего процесса при USE_UVLOOP=True в settings.
+    Вызывается один раз на старте (web_ui/asgi.py, web_ui/wsgi.py), а не при импорте модуля:
+    политика event loop глобальна и действует на все loop'ы процесса, не только на CLI-вызовы.
+    """
+    if uvloop is None or not getattr(settings, "USE_UVLOOP", False):
+        return False
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    logger.info("uvloop event loop policy installed")
+    return True
+
+
+@dataclass(slots=True, frozen=True)
 class CliRunResult:
+    """
+    Результат запуска CLI. stdout/stderr хранятся в bytes и декодируются лениво —
+    при первом обращении к output/logs. Поддерживает dict-доступ: result["output"], result.get("meta").
+    """
     success: bool
-    output: str
-    logs: str
     meta: Dict[str, Any]
+    output_bytes: bytes = b""
+    logs_bytes: bytes = b""
+    # Кэш декодированного текста (slots: без __dict__, поэтому не cached_property)
+    _output: Optional[str] = field(default=None, init=False, repr=False, compare=False)
+    _logs: Optional[str] = field(default=None, init=False, repr=False, compare=False)
+
+    _KEYS: ClassVar[Tuple[str, ...]] = ("success", "output", "logs", "meta")
+
+    @classmethod
+    def from_text(cls, success: bool, meta: Dict[str, Any], output: str = "", logs: str = "") -> "CliRunResult":
+        """Результат из уже собранного текста (итоги Ralph-цикла) — без повторного кодирования в bytes."""
+        result = cls(success=success, meta=meta)
+        object.__setattr__(result, "_output", output)
+        object.__setattr__(result, "_logs", logs)
+        return result
+
+    @property
+    def output(self) -> str:
+        if self._output is None:
+            object.__setattr__(self, "_output", self.output_bytes.decode("utf-8", errors="ignore").strip())
+        return self._output
+
+    @property
+    def logs(self) -> str:
+        if self._logs is None:
+            object.__setattr__(self, "_logs", self.logs_bytes.decode("utf-8", errors="ignore").strip())
+        return self._logs
+
+    def keys(self):
+        return self._KEYS
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self._KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self[key] if key in self._KEYS else default
 
 
 class CliRuntimeManager:
@@ -23,11 +113,38 @@ class CliRuntimeManager:
 
     def __init__(self):
         self.config = getattr(settings, "CLI_RUNTIME_CONFIG", {})
+        self._runtime_cache: Dict[str, Dict[str, Any]] = {}
+        # Базовое окружение подпроцесса на runtime (см. _get_env)
+        self._runtime_envs: Dict[str, Dict[str, str]] = {}
 
     def _get_runtime(self, runtime: str) -> Dict[str, Any]:
-        return self.config.get(runtime, {})
+        """
+        Конфиг runtime, дополненный подготовленными полями (считаются один раз на runtime):
+        formatted_args, allowed_args_tuple, prompt_style, resolved_command, cmd_prefix.
+        """
+        prepared = self._runtime_cache.get(runtime)
+        if prepared is not None:
+            return prepared
+        runtime_cfg = self.config.get(runtime, {})
+        if not runtime_cfg:
+            return {}
+        command_template = runtime_cfg.get("command")
+        formatted_args = tuple(self._format_arg(runtime_cfg, arg) for arg in runtime_cfg.get("args", []))
+        resolved_command = self._resolve_command(runtime_cfg, command_template) if command_template else None
+        prepared = {
+            **runtime_cfg,
+            "formatted_args": formatted_args,
+            "allowed_args_tuple": tuple(runtime_cfg.get("allowed_args", [])),
+            "prompt_style": runtime_cfg.get("prompt_style", "flag"),
+            "resolved_command": resolved_command,
+            "cmd_prefix": (resolved_command, *formatted_args),
+        }
+        self._runtime_cache[runtime] = prepared
+        return prepared
 
-    async def run(self, runtime: str, task: str, config: Dict[str, Any], mcp_config: Dict[str, Any] = None) -> Dict[str, Any]:
+    async def run(
+        self, runtime: str, task: str, config: Dict[str, Any], mcp_config: Optional[Dict[str, Any]] = None
+    ) -> CliRunResult:
         """
         Run CLI command once or in a Ralph-like loop if enabled.
 
@@ -35,7 +152,7 @@ class CliRuntimeManager:
             runtime: CLI runtime (cursor, claude)
             task: Task description
             config: Runtime configuration
-            mcp_config: MCP servers configuration (per-agent)
+            mcp_config: MCP servers configuration (per-agent); None — без MCP
 
         Note: "ralph" is not a CLI runtime. It's an internal orchestration pattern.
               Use cursor/claude with use_ralph_loop=True instead.
@@ -60,60 +177,145 @@ class CliRuntimeManager:
             if max_iterations <= 0:
                 max_iterations = 20
 
-            combined_output = []
-            combined_logs = []
+            # CLI с продолжением сессии (--continue) сам хранит контекст: на итерациях 2..N
+            # отправляем только короткую дельту вместо задачи + предыдущего вывода
+            supports_continue = bool(self._get_runtime(runtime).get("supports_continue"))
+            continue_config = {**config, "continue": True}
+
+            # Итерации без предыдущего вывода независимы — запускаем их параллельно
+            if not include_previous and not supports_continue:
+                return await self._run_parallel_iterations(
+                    runtime, task, config, max_iterations, completion_promise, mcp_config
+                )
+
+            # Вывод итераций пишется сразу в буферы — без списка строк и итогового join
+            out_buf = io.StringIO()
+            logs_buf = io.StringIO()
             last_output = ""
             for i in range(1, max_iterations + 1):
                 iteration_task = task
-                if include_previous and i > 1:
+                iteration_config = config
+                if supports_continue and i > 1:
+                    iteration_config = continue_config
+                    iteration_task = (
+                        "Продолжай работу по задаче. Проверь предыдущий вывод и улучши результат.\n"
+                        f"Если все готово, выведи <promise>{completion_promise}</promise>."
+                    )
+                elif include_previous and i > 1:
                     iteration_task = (
                         "Продолжай работу по задаче. Проверь предыдущий вывод и улучши результат.\n\n"
                         f"Изначальная задача:\n{task}\n\n"
                         f"Предыдущий вывод:\n{last_output}\n\n"
                         f"Если все готово, выведи <promise>{completion_promise}</promise>."
                     )
-                result = await self._run_once(runtime, iteration_task, config)
-                combined_output.append(f"Iteration {i}:\n{result['output']}")
-                combined_logs.append(result.get("logs", ""))
-                last_output = result.get("output", "")
-
-                if completion_promise and self._has_completion_promise(result["output"], completion_promise):
-                    return {
-                        "success": True,
-                        "output": "\n\n".join(combined_output),
-                        "logs": "\n".join(combined_logs),
-                        "meta": {"iterations": i, "completed": True},
-                    }
-
-            return {
-                "success": True,
-                "output": "\n\n".join(combined_output),
-                "logs": "\n".join(combined_logs),
-                "meta": {"iterations": max_iterations, "completed": False},
-            }
-
-        return await self._run_once(runtime, task, config)
-
-    async def _run_once(self, runtime: str, task: str, config: Dict[str, Any], mcp_config: Dict[str, Any] = None) -> Dict[str, Any]:
+                result = await self._run_once(runtime, iteration_task, iteration_config, mcp_config)
+                if i > 1:
+                    out_buf.write("\n\n")
+                    logs_buf.write("\n")
+                out_buf.write(f"Iteration {i}:\n{result.output}")
+                logs_buf.write(result.logs)
+                last_output = result.output
+
+                if completion_promise and self._has_completion_promise(result.output_bytes, completion_promise):
+                    return CliRunResult.from_text(
+                        success=True,
+                        meta={"iterations": i, "completed": True},
+                        output=out_buf.getvalue(),
+                        logs=logs_buf.getvalue(),
+                    )
+
+            return CliRunResult.from_text(
+                success=True,
+                meta={"iterations": max_iterations, "completed": False},
+                output=out_buf.getvalue(),
+                logs=logs_buf.getvalue(),
+            )
+
+        return await self._run_once(runtime, task, config, mcp_config)
+
+    @staticmethod
+    def _get_mcp_config_file(mcp_config: Dict[str, Any]) -> Optional[str]:
+        """Путь к mcp_config.json; MCPManager переиспользует файл для того же конфига (итерации Ralph)."""
+        from app.core.mcp_manager import get_mcp_manager
+        return get_mcp_manager().create_mcp_config_file(mcp_config)
+
+    def _get_env(self, runtime: str, mcp_config_file: Optional[str] = None) -> Optional[Dict[str, str]]:
+        """
+        Окружение подпроцесса: копия os.environ собирается один раз на runtime,
+        MCP_CONFIG_PATH добавляется в поверхностную копию, чтобы не портить кэш.
+        """
+        if runtime not in ("cursor", "claude"):
+            return None
+        env = self._runtime_envs.get(runtime)
+        if env is None:
+            env = dict(os.environ)
+            if runtime == "cursor":
+                # Headless: CURSOR_API_KEY из .env — без входа по Google. Ключ: Cursor → Settings → API Access.
+                env.update(getattr(settings, "CURSOR_CLI_EXTRA_ENV", None) or {})
+            self._runtime_envs[runtime] = env
+        if mcp_config_file:
+            # MCP config file для Cursor/Claude
+            return {**env, "MCP_CONFIG_PATH": mcp_config_file}
+        return env
+
+    async def _run_parallel_iterations(
+        self,
+        runtime: str,
+        task: str,
+        config: Dict[str, Any],
+        max_iterations: int,
+        completion_promise: str,
+        mcp_config: Optional[Dict[str, Any]] = None,
+    ) -> CliRunResult:
+        """
+        Независимые итерации Ralph (loop_include_previous=False): до ralph_concurrency одновременно,
+        остальные отменяются после первого completion promise.
+        """
+        semaphore = asyncio.Semaphore(max(1, int(config.get("ralph_concurrency", 4))))
+
+        async def run_iteration(i: int):
+            async with semaphore:
+                return i, await self._run_once(runtime, task, config, mcp_config)
+
+        tasks = [asyncio.create_task(run_iteration(i)) for i in range(1, max_iterations + 1)]
+        results: Dict[int, CliRunResult] = {}
+        completed = False
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                i, result = await next_done
+                results[i] = result
+                if completion_promise and self._has_completion_promise(result.output_bytes, completion_promise):
+                    completed = True
+                    break
+        finally:
+            for task_ in tasks:
+                task_.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        ordered = sorted(results.items())
+        return CliRunResult.from_text(
+            success=True,
+            meta={"iterations": len(results), "completed": completed, "parallel": True},
+            output="\n\n".join(f"Iteration {i}:\n{result.output}" for i, result in ordered),
+            logs="\n".join(result.logs for _, result in ordered),
+        )
+
+    async def _run_once(
+        self, runtime: str, task: str, config: Dict[str, Any], mcp_config: Optional[Dict[str, Any]] = None
+    ) -> CliRunResult:
         runtime_cfg = self._get_runtime(runtime)
         if not runtime_cfg:
             raise ValueError(f"Runtime '{runtime}' is not configured")
 
-        command_template = runtime_cfg.get("command")
-        if not command_template:
+        if not runtime_cfg["resolved_command"]:
             raise ValueError(f"Runtime '{runtime}' missing command template")
 
-        args_template = runtime_cfg.get("args", [])
-        args_template = [self._format_arg(runtime_cfg, arg) for arg in args_template]
-        prompt_style = runtime_cfg.get("prompt_style", "flag")
-        allowed_args = runtime_cfg.get("allowed_args", [])
+        allowed_args = runtime_cfg["allowed_args_tuple"]
         
         # Setup MCP if provided
         mcp_config_file = None
         if mcp_config and runtime in ["cursor", "claude"]:
-            from app.core.mcp_manager import get_mcp_manager
-            mcp_manager = get_mcp_manager()
-            mcp_config_file = mcp_manager.create_mcp_config_file(mcp_config)
+            mcp_config_file = self._get_mcp_config_file(mcp_config)
 
         # Build args from config: only allow whitelisted keys
         cli_args = []
@@ -134,70 +336,157 @@ class CliRuntimeManager:
                 else:
                     cli_args.extend([f"--{arg_name}", str(value)])
 
-        # Append task as final prompt argument
-        full_args = list(args_template) + cli_args
-        if prompt_style == "positional":
-            full_args += [task]
-        else:
-            full_args += [task]
-
-        cmd = [self._resolve_command(runtime_cfg, command_template)] + full_args
+        # Append task as final prompt argument (prompt_style "positional" и "flag" передают его одинаково)
+        cmd = [*runtime_cfg["cmd_prefix"], *cli_args, task]
         logger.info(f"Running CLI runtime: {runtime} -> {' '.join(shlex.quote(c) for c in cmd)}")
 
-        subprocess_env = None
-        if runtime == "cursor":
-            # Headless: CURSOR_API_KEY из .env — без входа по Google. Ключ: Cursor → Settings → API Access.
-            subprocess_env = dict(os.environ)
-            extra = getattr(settings, "CURSOR_CLI_EXTRA_ENV", None) or {}
-            subprocess_env.update(extra)
-            
-            # MCP config file для Cursor
-            if mcp_config_file:
-                subprocess_env['MCP_CONFIG_PATH'] = mcp_config_file
-        
-        elif runtime == "claude":
-            subprocess_env = dict(os.environ)
-            
-            # MCP config file для Claude
-            if mcp_config_file:
-                # Claude использует переменную MCP_CONFIG или .cursor/mcp.json
-                subprocess_env['MCP_CONFIG_PATH'] = mcp_config_file
+        subprocess_env = self._get_env(runtime, mcp_config_file)
 
         create_kw = {"stdout": asyncio.subprocess.PIPE, "stderr": asyncio.subprocess.PIPE}
         if subprocess_env is not None:
             create_kw["env"] = subprocess_env
-        process = await asyncio.create_subprocess_exec(*cmd, **create_kw)
         timeout_seconds = runtime_cfg.get("timeout_seconds") or getattr(settings, "CLI_RUNTIME_TIMEOUT_SECONDS", 600)
+
+        # Кэш только по явному "response_cache": True — агенты меняют файлы и выполняют команды,
+        # повтор задачи из кэша ничего бы не сделал. Ralph-цикл и продолжение сессии не кэшируем
+        cache_key = None
+        if runtime_cfg.get("response_cache", False) and not config.get("use_ralph_loop") and not config.get("continue"):
+            cache_key = self._response_cache_key(cmd, task, subprocess_env)
+            cached = self._get_cached_response(cache_key)
+            if cached is not None:
+                logger.info(f"CLI runtime {runtime}: response served from cache")
+                return cached
+
+        # В Ralph-цикле следим за stdout: CLI останавливается сразу после <promise>, не дожидаясь выхода
+        completion_promise = (config.get("completion_promise") or "").strip() if config.get("use_ralph_loop") else ""
+        completed_early = False
+        process = await asyncio.create_subprocess_exec(*cmd, **create_kw)
         try:
-            stdout_bytes, stderr_bytes = await asyncio.wait_for(process.communicate(), timeout=timeout_seconds)
+            if completion_promise:
+                stdout_bytes, stderr_bytes, completed_early = await self._communicate_until_promise(
+                    process, completion_promise, timeout_seconds
+                )
+            else:
+                stdout_bytes, stderr_bytes = await asyncio.wait_for(process.communicate(), timeout=timeout_seconds)
+        except asyncio.CancelledError:
+            # Отмена (например, параллельная итерация уже нашла promise) — не оставляем процесс висеть
+            await _terminate_process(process)
+            raise
         except asyncio.TimeoutError:
-            process.kill()
-            await process.communicate()
-            return {
-                "success": False,
-                "output": "",
-                "logs": f"Timeout after {timeout_seconds} seconds",
-                "meta": {"exit_code": -1, "timeout": True, "pid": process.pid},
-            }
-        stdout = stdout_bytes.decode("utf-8", errors="ignore")
-        stderr = stderr_bytes.decode("utf-8", errors="ignore")
-
-        return {
-            "success": process.returncode == 0,
-            "output": stdout.strip(),
-            "logs": stderr.strip(),
-            "meta": {"exit_code": process.returncode, "pid": process.pid},
-        }
+            await _terminate_process(process)
+            return CliRunResult(
+                success=False,
+                meta={"exit_code": -1, "timeout": True, "pid": process.pid},
+                logs_bytes=f"Timeout after {timeout_seconds} seconds".encode("utf-8"),
+            )
+
+        # Декодирование stdout/stderr откладывается до первого обращения к output/logs
+        meta = {"exit_code": process.returncode, "pid": process.pid}
+        if completed_early:
+            meta["completed_early"] = True
+        result = CliRunResult(
+            success=completed_early or process.returncode == 0,
+            meta=meta,
+            output_bytes=stdout_bytes,
+            logs_bytes=stderr_bytes,
+        )
+        # Ненулевой код выхода и пустой вывод (ошибка CLI) не кэшируем
+        if cache_key and process.returncode == 0 and stdout_bytes.strip():
+            self._store_cached_response(cache_key, result, runtime_cfg.get("response_cache_ttl", RESPONSE_CACHE_TTL_SECONDS))
+        return result
+
+    async def _communicate_until_promise(
+        self, process: asyncio.subprocess.Process, promise: str, timeout_seconds: float
+    ) -> Tuple[bytes, bytes, bool]:
+        """
+        Читать stdout построчно; как только появляется completion promise, выставить
+        asyncio.Event и завершить процесс (SIGTERM). Возвращает (stdout, stderr, completed_early).
+        Raises asyncio.TimeoutError, если ни выход процесса, ни promise не наступили за timeout.
+        """
+        completion_event = asyncio.Event()
+        stdout_buf = bytearray()
+
+        async def read_stdout():
+            while True:
+                line = await process.stdout.readline()
+                if not line:
+                    return
+                stdout_buf.extend(line)
+                if b"</promise>" in line.lower() and self._has_completion_promise(bytes(stdout_buf), promise):
+                    completion_event.set()
+                    return
+
+        stdout_task = asyncio.create_task(read_stdout())
+        stderr_task = asyncio.create_task(process.stderr.read())
+        wait_task = asyncio.create_task(process.wait())
+        event_task = asyncio.create_task(completion_event.wait())
+        helper_tasks = (stdout_task, stderr_task, wait_task, event_task)
+        try:
+            done, _ = await asyncio.wait(
+                {wait_task, event_task}, timeout=timeout_seconds, return_when=asyncio.FIRST_COMPLETED
+            )
+        except asyncio.CancelledError:
+            for task in helper_tasks:
+                task.cancel()
+            raise
+        if not done:
+            for task in helper_tasks:
+                task.cancel()
+            raise asyncio.TimeoutError
+
+        completed_early = event_task in done
+        if completed_early:
+            wait_task.cancel()
+            await _terminate_process(process)
+        else:
+            event_task.cancel()
+        await stdout_task
+        try:
+            stderr_bytes = await asyncio.wait_for(stderr_task, timeout=TERMINATE_GRACE_SECONDS)
+        except asyncio.TimeoutError:
+            stderr_bytes = b""
+        return bytes(stdout_buf), stderr_bytes, completed_early
+
+    @staticmethod
+    def _response_cache_key(cmd: List[str], task: str, env: Optional[Dict[str, str]]) -> str:
+        env_items = json.dumps(sorted(env.items())) if env else "[]"
+        raw = "\x00".join(cmd) + "\x00" + task + "\x00" + env_items
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _get_cached_response(key: str) -> Optional[CliRunResult]:
+        cached = _response_cache.get(key)
+        if cached is None:
+            return None
+        expires_at, result = cached
+        if expires_at <= time.monotonic():
+            _response_cache.pop(key, None)
+            return None
+        return dataclasses.replace(result, meta={**result.meta, "cached": True})
+
+    @staticmethod
+    def _store_cached_response(key: str, result: CliRunResult, ttl: float):
+        _response_cache.pop(key, None)
+        if len(_response_cache) >= RESPONSE_CACHE_MAX_SIZE:
+            # Вытесняем самую старую запись
+            _response_cache.pop(next(iter(_response_cache)))
+        _response_cache[key] = (time.monotonic() + ttl, dataclasses.replace(result, meta=dict(result.meta)))
 
     @staticmethod
-    def _has_completion_promise(output: str, promise: str) -> bool:
-        import re
-
-        match = re.search(r"<promise>(.*?)</promise>", output, re.DOTALL | re.IGNORECASE)
-        if not match:
-            return False
-        extracted = re.sub(r"\s+", " ", match.group(1).strip())
-        target = re.sub(r"\s+", " ", promise.strip())
+    def _has_completion_promise(output: Union[str, bytes], promise: str) -> bool:
+        """Проверить тег <promise>TEXT</promise>; bytes сканируются без декодирования всего вывода."""
+        if isinstance(output, bytes):
+            match = _PROMISE_BYTES_RE.search(output)
+            if not match:
+                return False
+            extracted = match.group(1).decode("utf-8", errors="ignore")
+        else:
+            match = _PROMISE_RE.search(output)
+            if not match:
+                return False
+            extracted = match.group(1)
+        extracted = _WHITESPACE_RE.sub(" ", extracted.strip())
+        target = _WHITESPACE_RE.sub(" ", promise.strip())
         return extracted == target
 
     def _resolve_command(self, runtime_cfg: Dict[str, Any], command_template: str) -> str:
@@ -1,10 +1,13 @@
 """
 Complex Agent - for tasks requiring planning and tool usage
 """
+import asyncio
+import re
 from typing import Dict, Any, Optional, List
 from loguru import logger
 from app.agents.base_agent import BaseAgent
 from app.core.model_config import model_manager
+from app.utils import fast_json
 
 
 class ComplexAgent(BaseAgent):
@@ -29,12 +32,16 @@ class ComplexAgent(BaseAgent):
             model_preference = context.get('model', model_manager.config.default_provider)
             specific_model = context.get('specific_model')
             use_rag = context.get('use_rag', True)
+            # Волны независимых шагов — opt-in: определение зависимостей стоит отдельного запроса к LLM
+            parallel_steps = context.get('parallel_steps', False)
             
             # Step 1: Analyze and plan
             plan = await self._create_plan(task, model_preference, specific_model, use_rag)
             
             # Step 2: Execute plan
-            execution_result = await self._execute_plan(plan, task, model_preference, specific_model, use_rag)
+            execution_result = await self._execute_plan(
+                plan, task, model_preference, specific_model, use_rag, parallel_steps=parallel_steps
+            )
             
             return {
                 'success': True,
@@ -62,14 +69,7 @@ class ComplexAgent(BaseAgent):
         # Get RAG context if available
         rag_context = ""
         if use_rag and self.rag_engine.available:
-            try:
-                results = self.rag_engine.query(task, n_results=3)
-                if results.get('documents') and results['documents'][0]:
-                    docs = results['documents'][0]
-                    if docs:
-                        rag_context = "\n".join([f"📚 {doc}" for doc in docs[:3]])
-            except Exception as e:
-                logger.warning(f"RAG query failed: {e}")
+            rag_context = await asyncio.to_thread(self._get_rag_context, task)
         
         # Get available tools
         tools_description = self.tool_manager.get_tools_description()
@@ -88,23 +88,15 @@ Example: ["Step 1 description", "Step 2 description", ...]
 
 Plan:"""
         
-        response_text = ""
+        response_parts = []
         async for chunk in self.llm_provider.stream_chat(prompt, model=model, specific_model=specific_model):
-            response_text += chunk
+            response_parts.append(chunk)
+        response_text = "".join(response_parts)
         
         # Parse plan (try to extract JSON)
-        import json
-        import re
-        
-        # Try to find JSON array in response
-        json_match = re.search(r'\[.*?\]', response_text, re.DOTALL)
-        if json_match:
-            try:
-                plan = json.loads(json_match.group())
-                if isinstance(plan, list):
-                    return plan
-            except Exception:
-                logger.debug("Failed to parse JSON plan response.")
+        plan = self._extract_json_list(response_text)
+        if plan is not None:
+            return plan
         
         # Fallback: split by lines or numbers
         lines = [line.strip() for line in response_text.split('\n') if line.strip()]
@@ -117,26 +109,117 @@ Plan:"""
         
         return plan if plan else ["Analyze the task", "Execute the solution", "Verify the result"]
     
+    @staticmethod
+    def _extract_json_list(text: str) -> Optional[list]:
+        """
+        Найти JSON-массив в ответе LLM без regex-сканирования всего текста:
+        сначала от первой '[' до последней ']', затем от последней '[' до последней ']'.
+        """
+        end = text.rfind(']')
+        if end < 0:
+            return None
+        starts = (text.find('['), text.rfind('[', 0, end))
+        for start in dict.fromkeys(starts):
+            if not 0 <= start < end:
+                continue
+            try:
+                parsed = fast_json.loads(text[start:end + 1])
+            except ValueError:
+                continue
+            if isinstance(parsed, list):
+                return parsed
+        logger.debug("Failed to parse JSON list from LLM response.")
+        return None
+
+    async def _infer_dependencies(self, plan: List[str], model: str, specific_model: Optional[str]) -> List[List[int]]:
+        """
+        Определить зависимости шагов плана одним запросом к LLM.
+
+        Returns:
+            Для каждого шага — список индексов (0-based) более ранних шагов, от которых он зависит.
+            При ошибке разбора — последовательная цепочка (каждый шаг зависит от предыдущего).
+        """
+        sequential = [[i - 1] if i > 0 else [] for i in range(len(plan))]
+        steps_text = "\n".join(f"{i}. {step}" for i, step in enumerate(plan, 1))
+        prompt = f"""For each step of the plan below, list the numbers of earlier steps whose results it needs.
+
+Plan:
+{steps_text}
+
+Return ONLY a JSON list with one list of step numbers per step, e.g. [[], [1], [], [2, 3]].
+
+Dependencies:"""
+
+        response_parts = []
+        async for chunk in self.llm_provider.stream_chat(prompt, model=model, specific_model=specific_model):
+            response_parts.append(chunk)
+        response_text = "".join(response_parts)
+
+        raw = self._extract_json_list(response_text)
+        if raw is None or len(raw) != len(plan):
+            return sequential
+
+        dependencies = []
+        for i, deps in enumerate(raw):
+            if not isinstance(deps, list):
+                return sequential
+            # Только ссылки на более ранние шаги — циклы исключены
+            dependencies.append(sorted({d - 1 for d in deps if isinstance(d, int) and 1 <= d <= i}))
+        return dependencies
+
+    @staticmethod
+    def _build_waves(dependencies: List[List[int]]) -> List[List[int]]:
+        """Сгруппировать шаги в волны по алгоритму Кана: шаги одной волны независимы друг от друга."""
+        remaining = {i: set(deps) for i, deps in enumerate(dependencies)}
+        waves = []
+        while remaining:
+            wave = sorted(i for i, deps in remaining.items() if not deps)
+            if not wave:
+                # Цикл в зависимостях — выполняем оставшееся последовательно
+                waves.extend([i] for i in sorted(remaining))
+                break
+            waves.append(wave)
+            for i in wave:
+                del remaining[i]
+            for deps in remaining.values():
+                deps.difference_update(wave)
+        return waves
+
     async def _execute_plan(self, plan: List[str], original_task: str, model: str, 
-                           specific_model: Optional[str], use_rag: bool) -> str:
-        """Execute the plan step by step"""
-        results = []
-        
-        for i, step in enumerate(plan, 1):
-            logger.info(f"Executing step {i}/{len(plan)}: {step}")
-            
-            # For now, use ReAct agent for each step
-            # In future, this could be more sophisticated
-            step_prompt = f"""Step {i} of {len(plan)}: {step}
+                           specific_model: Optional[str], use_rag: bool, parallel_steps: bool = False) -> str:
+        """Execute the plan step by step; with parallel_steps, independent steps run concurrently in dependency waves"""
+        if parallel_steps and len(plan) > 1:
+            dependencies = await self._infer_dependencies(plan, model, specific_model)
+            waves = self._build_waves(dependencies)
+        else:
+            # По шагу за раз, без результатов других шагов в промпте
+            dependencies = [[] for _ in plan]
+            waves = [[i] for i in range(len(plan))]
+        step_results: Dict[int, str] = {}
 
-Original task: {original_task}
+        async def run_step(index: int) -> str:
+            step = plan[index]
+            logger.info(f"Executing step {index + 1}/{len(plan)}: {step}")
+
+            # Результаты шагов-зависимостей передаём как контекст
+            deps_context = "\n\n".join(
+                f"Result of step {d + 1}:\n{step_results[d]}" for d in dependencies[index] if d in step_results
+            )
+            deps_block = f"\n{deps_context}\n" if deps_context else ""
+            step_prompt = f"""Step {index + 1} of {len(plan)}: {step}
 
+Original task: {original_task}
+{deps_block}
 Execute this step. If you need to use tools, use them. Provide a clear result."""
             
-            step_result = ""
+            step_parts = []
             async for chunk in self.llm_provider.stream_chat(step_prompt, model=model, specific_model=specific_model):
-                step_result += chunk
-            
-            results.append(f"**Step {i}: {step}**\n{step_result}\n")
-        
+                step_parts.append(chunk)
+            return "".join(step_parts)
+
+        for wave in waves:
+            wave_results = await asyncio.gather(*(run_step(i) for i in wave))
+            step_results.update(zip(wave, wave_results, strict=True))
+
+        results = [f"**Step {i}: {step}**\n{step_results[i - 1]}\n" for i, step in enumerate(plan, 1)]
         return "\n\n".join(results)
@@ -1,7 +1,12 @@
 """
 Agent Manager - manages all available agents
 """
-from typing import Dict, List, Optional
+import asyncio
+import os
+import threading
+import weakref
+from contextlib import asynccontextmanager, nullcontext
+from typing import AsyncGenerator, Dict, List, Optional
 from loguru import logger
 from app.agents.base_agent import BaseAgent
 from app.agents.react_agent import ReActAgent
@@ -10,6 +15,10 @@ from app.agents.complex_agent import ComplexAgent
 from app.agents.ralph_agent import RalphWiggumAgent
 from app.agents.claude_code_agent import ClaudeCodeAgent
 
+# Лимиты одновременных запусков агентов (защита LLM API от 429 и лавины ретраев)
+MAX_CONCURRENT_AGENTS = int(os.getenv("WEU_MAX_CONCURRENT_AGENTS", "8"))
+AGENT_TYPE_CONCURRENCY = {"ralph": 2, "react": 4, "simple": 16}
+
 
 class AgentManager:
     """
@@ -19,6 +28,9 @@ class AgentManager:
     
     def __init__(self):
         self.agents: Dict[str, BaseAgent] = {}
+        # Набор агентов меняется только через register_agent — описания кэшируются до следующей регистрации
+        self._info_cache: Dict[str, Dict] = {}
+        self._list_cache: Optional[List[Dict]] = None
         self._register_builtin_agents()
         self._agent_type_map = {
             "simple": "Simple Agent",
@@ -27,6 +39,13 @@ class AgentManager:
             "ralph": "Ralph Wiggum Agent",
             "claude_code": "Claude Code Agent",
         }
+        self._agent_name_to_type = {name: agent_type for agent_type, name in self._agent_type_map.items()}
+        # Семафоры привязаны к event loop: execute_agent вызывается и из ASGI, и через async_to_sync в потоках
+        self._semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._active_count = 0
+        self._queued_count = 0
     
     def _register_builtin_agents(self):
         """Register all built-in agents"""
@@ -48,6 +67,8 @@ class AgentManager:
             logger.warning(f"Agent '{name}' already registered, overwriting")
         
         self.agents[name] = agent
+        self._info_cache.clear()
+        self._list_cache = None
         logger.info(f"Registered agent: {name}")
     
     def get_agent(self, name: str) -> Optional[BaseAgent]:
@@ -68,14 +89,69 @@ class AgentManager:
     
     def get_agent_info(self, name: str) -> Optional[Dict]:
         """Get agent information"""
-        agent = self.get_agent(name)
-        if agent:
-            return agent.get_info()
-        return None
+        info = self._get_cached_info(name)
+        return info.copy() if info is not None else None
     
     def list_agents(self) -> List[Dict]:
         """List all agents with their information"""
-        return [agent.get_info() for agent in self.agents.values()]
+        if self._list_cache is None:
+            self._list_cache = [self._get_cached_info(name) for name in self.agents]
+        # Копии — чтобы вызывающий код не испортил кэш
+        return [info.copy() for info in self._list_cache]
+    
+    def _get_cached_info(self, name: str) -> Optional[Dict]:
+        info = self._info_cache.get(name)
+        if info is None:
+            agent = self.get_agent(name)
+            if agent is None:
+                return None
+            info = self._info_cache[name] = agent.get_info()
+        return info
+    
+    def get_status(self) -> Dict:
+        """Счётчики пула: выполняются / ждут слота, и лимиты"""
+        return {
+            'active_count': self._active_count,
+            'queued_count': self._queued_count,
+            'max_concurrent': MAX_CONCURRENT_AGENTS,
+            'per_type_limits': dict(AGENT_TYPE_CONCURRENCY),
+        }
+    
+    def _get_semaphores(self) -> Dict[str, asyncio.Semaphore]:
+        loop = asyncio.get_running_loop()
+        semaphores = self._semaphores.get(loop)
+        if semaphores is None:
+            semaphores = {agent_type: asyncio.Semaphore(limit) for agent_type, limit in AGENT_TYPE_CONCURRENCY.items()}
+            semaphores["*"] = asyncio.Semaphore(MAX_CONCURRENT_AGENTS)
+            self._semaphores[loop] = semaphores
+        return semaphores
+    
+    @asynccontextmanager
+    async def _concurrency_slot(self, agent_name: str, context: Optional[Dict]):
+        """
+        Занять слот: сначала лимит типа агента, затем общий (чтобы не держать общий слот в очереди своего типа).
+        context['bypass_concurrency'] — критичные агенты идут без очереди.
+        """
+        if context and context.get('bypass_concurrency'):
+            yield
+            return
+        semaphores = self._get_semaphores()
+        type_semaphore = semaphores.get(self._agent_name_to_type.get(agent_name, ""))
+        self._queued_count += 1
+        queued = True
+        try:
+            async with type_semaphore or nullcontext():
+                async with semaphores["*"]:
+                    self._queued_count -= 1
+                    queued = False
+                    self._active_count += 1
+                    try:
+                        yield
+                    finally:
+                        self._active_count -= 1
+        finally:
+            if queued:
+                self._queued_count -= 1
     
     async def execute_agent(self, agent_name: str, task: str, context: Optional[Dict] = None) -> Dict:
         """
@@ -104,8 +180,9 @@ class AgentManager:
             }
         
         try:
-            logger.info(f"Executing agent '{agent_name}' with task: {task[:100]}...")
-            result = await agent.execute(task, context)
+            async with self._concurrency_slot(agent_name, context):
+                logger.opt(lazy=True).info("Executing agent '{}' with task: {}...", lambda: agent_name, lambda: task[:100])
+                result = await agent.execute(task, context)
             return result
         except Exception as e:
             logger.error(f"Error executing agent '{agent_name}': {e}")
@@ -116,13 +193,54 @@ class AgentManager:
                 'metadata': {'agent': agent_name}
             }
 
+    
+    async def stream_agent(
+        self, agent_name: str, task: str, context: Optional[Dict] = None
+    ) -> AsyncGenerator[Dict, None]:
+        """
+        Execute an agent and forward its stream events.
+        
+        Yields:
+            {'type': 'chunk', 'data': str} по мере генерации и {'type': 'result', 'data': Dict} последним
+        """
+        agent = self.get_agent(agent_name)
+        if not agent:
+            resolved = self.resolve_agent_name(agent_name)
+            if resolved != agent_name:
+                agent_name = resolved
+                agent = self.get_agent(agent_name)
+        if not agent:
+            yield {'type': 'result', 'data': {
+                'success': False,
+                'result': None,
+                'error': f"Agent '{agent_name}' not found",
+                'metadata': {}
+            }}
+            return
+        
+        try:
+            async with self._concurrency_slot(agent_name, context):
+                logger.opt(lazy=True).info("Streaming agent '{}' with task: {}...", lambda: agent_name, lambda: task[:100])
+                async for event in agent.execute_stream(task, context):
+                    yield event
+        except Exception as e:
+            logger.error(f"Error streaming agent '{agent_name}': {e}")
+            yield {'type': 'result', 'data': {
+                'success': False,
+                'result': None,
+                'error': str(e),
+                'metadata': {'agent': agent_name}
+            }}
 
 # Global agent manager instance
 _agent_manager = None
+_agent_manager_lock = threading.Lock()
 
 def get_agent_manager() -> AgentManager:
     """Get or create global agent manager instance"""
     global _agent_manager
     if _agent_manager is None:
-        _agent_manager = AgentManager()
+        with _agent_manager_lock:
+            if _agent_manager is None:
+                _agent_manager = AgentManager()
     return _agent_manager
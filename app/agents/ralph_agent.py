@@ -2,11 +2,20 @@
 Ralph Wiggum Agent - iterative self-improving agent
 Based on the Ralph Wiggum technique from https://github.com/anthropics/claude-code/tree/main/plugins/ralph-wiggum
 """
+import asyncio
+import re
 from typing import Dict, Any, Optional
 from loguru import logger
 from app.agents.base_agent import BaseAgent
 from app.core.model_config import model_manager
 
+_PROMISE_RE = re.compile(r"<promise>(.*?)</promise>", re.DOTALL | re.IGNORECASE)
+_WS_RE = re.compile(r"\s+")
+# Тег <promise> выводится в конце ответа: regex проверяет только хвост вывода
+PROMISE_TAIL_CHARS = 2048
+# Скользящее окно потока для дешёвого поиска закрывающего тега
+PROMISE_STREAM_WINDOW = 256
+
 
 class RalphWiggumAgent(BaseAgent):
     """
@@ -26,6 +35,27 @@ class RalphWiggumAgent(BaseAgent):
         )
         self.default_max_iterations = 10
     
+    # Раскладка промпта под prefix-кэш провайдеров: сначала статический блок
+    # (RAG, инструкции, правила promise), затем задача, изменяемое состояние — в самом конце.
+    # Статические части собираются через join, без f-string на каждой итерации.
+    _STUCK_GUIDANCE = (
+        "Если задача заблокирована, явно опиши блокеры и что нужно для прогресса. "
+        "Не выводи completion promise, если работа не завершена."
+    )
+    _PROMPT_STATIC = (
+        "You are working on the task below iteratively. Work on it step by step.\n"
+        "On later iterations you get your previous result: review it, identify what needs improvement, and continue.\n"
+        "When you complete the task, output exactly: <promise>{promise}</promise>\n"
+        "CRITICAL RULE: Do NOT output the promise unless it is completely and unequivocally TRUE.\n"
+        "If requirements are unclear, list 1-3 clarifying questions before proceeding and state your assumptions.\n"
+        "{stuck}\n"
+        "---\n"
+        "ORIGINAL_TASK:\n"
+    )
+    _PROMPT_FIRST_TAIL = "\n---\nBegin working:"
+    _PROMPT_PREVIOUS = "\n---\nPREVIOUS_ITERATION ({n} completed):\n"
+    _PROMPT_CONT_TAIL = "\n---\nContinue:"
+    
     async def execute(self, task: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
         Execute task with iterative improvement loop.
@@ -48,82 +78,70 @@ class RalphWiggumAgent(BaseAgent):
             specific_model = context.get('specific_model')
             use_rag = context.get('use_rag', True)
             
-            logger.info(f"Ralph Agent starting: max_iterations={max_iterations}, completion_promise='{completion_promise}'")
+            logger.info("Ralph Agent starting: max_iterations={}, completion_promise='{}'", max_iterations, completion_promise)
             
             # Build initial prompt
             initial_prompt = context.get('initial_prompt', task)
-            stuck_guidance = (
-                "Если задача заблокирована, явно опиши блокеры и что нужно для прогресса. "
-                "Не выводи completion promise, если работа не завершена."
-            )
-            
             # Iterative loop
             iteration = 0
             all_results = []
             last_result = ""
             completion_promise = (completion_promise or "").strip()
+            # Нормализованный promise считается один раз на задачу, а не на каждой итерации
+            promise_target = _WS_RE.sub(" ", completion_promise)
+            # Статический префикс одинаков для всех итераций — форматируется один раз
+            static_block = self._PROMPT_STATIC.format(promise=completion_promise, stuck=self._STUCK_GUIDANCE)
+            
+            # RAG-контекст не меняется между итерациями: один запрос вне event loop
+            rag_context = ""
+            if use_rag and self.rag_engine.available:
+                rag_context = await asyncio.to_thread(self._get_rag_context, task)
             
             while iteration < max_iterations:
                 iteration += 1
-                logger.info(f"Ralph iteration {iteration}/{max_iterations}")
+                # Строка на каждую итерацию — DEBUG, форматируется только при включённом уровне
+                logger.debug("Ralph iteration {}/{}", iteration, max_iterations)
                 
-                # Build prompt for this iteration
+                # Build prompt for this iteration: RAG + static block + task, then mutable state
+                prompt_parts = [rag_context, "\n\n"] if rag_context else []
+                prompt_parts += [static_block, initial_prompt]
                 if iteration == 1:
-                    prompt = f"""You are working on the following task. Work on it step by step.
-
-Task: {initial_prompt}
-
-When you complete the task, output exactly: <promise>{completion_promise}</promise>
-CRITICAL RULE: Do NOT output the promise unless it is completely and unequivocally TRUE.
-If requirements are unclear, list 1-3 clarifying questions before proceeding and state your assumptions.
-{stuck_guidance}
-
-Begin working:"""
+                    prompt_parts.append(self._PROMPT_FIRST_TAIL)
                 else:
                     # Include previous results for context
-                    prompt = f"""Continue working on this task. You've completed {iteration - 1} iteration(s).
-
-Original Task: {initial_prompt}
-
-Previous Results:
-{last_result}
-
-Review your previous work, identify what needs improvement, and continue.
-When you complete the task, output exactly: <promise>{completion_promise}</promise>
-CRITICAL RULE: Do NOT output the promise unless it is completely and unequivocally TRUE.
-If requirements are unclear, list 1-3 clarifying questions before proceeding and state your assumptions.
-{stuck_guidance}
-
-Continue:"""
-                
-                # Get RAG context if available
-                rag_context = ""
-                if use_rag and self.rag_engine.available:
-                    try:
-                        results = self.rag_engine.query(task, n_results=3)
-                        if results.get('documents') and results['documents'][0]:
-                            docs = results['documents'][0]
-                            if docs:
-                                rag_context = "\n".join([f"📚 {doc}" for doc in docs[:3]])
-                                if iteration == 1:
-                                    prompt = f"{rag_context}\n\n{prompt}"
-                    except Exception as e:
-                        logger.warning(f"RAG query failed: {e}")
+                    prompt_parts += [self._PROMPT_PREVIOUS.format(n=iteration - 1), last_result, self._PROMPT_CONT_TAIL]
+                prompt = "".join(prompt_parts)
                 
                 # Execute iteration
-                iteration_result = ""
-                async for chunk in self.llm_provider.stream_chat(
+                iteration_parts = []
+                window = ""
+                stream = self.llm_provider.stream_chat(
                     prompt, 
                     model=model_preference, 
                     specific_model=specific_model
-                ):
-                    iteration_result += chunk
+                )
+                try:
+                    async for chunk in stream:
+                        iteration_parts.append(chunk)
+                        if not completion_promise:
+                            continue
+                        # Promise уже выведен — прекращаем чтение, остаток генерации не нужен
+                        window = (window + chunk)[-PROMISE_STREAM_WINDOW:]
+                        if "</promise>" in window.lower() and self._matches_promise(
+                            "".join(iteration_parts), promise_target
+                        ):
+                            break
+                finally:
+                    aclose = getattr(stream, "aclose", None)
+                    if aclose is not None:
+                        await aclose()
+                iteration_result = "".join(iteration_parts)
                 
                 last_result = iteration_result
                 all_results.append(f"**Iteration {iteration}:**\n{iteration_result}\n")
                 
                 # Check for completion
-                if completion_promise and self._has_completion_promise(iteration_result, completion_promise):
+                if completion_promise and self._matches_promise(iteration_result, promise_target):
                     logger.success(f"Ralph Agent completed at iteration {iteration}")
                     return {
                         'success': True,
@@ -182,11 +200,14 @@ Continue:"""
         Detect completion promise tag: <promise>TEXT</promise>.
         Must match exactly after whitespace normalization.
         """
-        import re
+        return RalphWiggumAgent._matches_promise(output, _WS_RE.sub(" ", promise.strip()))
 
-        match = re.search(r"<promise>(.*?)</promise>", output, re.DOTALL | re.IGNORECASE)
+    @staticmethod
+    def _matches_promise(output: str, target: str, tail_chars: int = PROMISE_TAIL_CHARS) -> bool:
+        """Сравнить тег <promise> в хвосте вывода (tail_chars) с уже нормализованным target."""
+        if len(output) > tail_chars:
+            output = output[-tail_chars:]
+        match = _PROMISE_RE.search(output)
         if not match:
             return False
-        extracted = re.sub(r"\s+", " ", match.group(1).strip())
-        target = re.sub(r"\s+", " ", promise.strip())
-        return extracted == target
+        return _WS_RE.sub(" ", match.group(1).strip()) == target
@@ -1,12 +1,20 @@
 """
 ReAct Agent - wrapper for UnifiedOrchestrator with ReAct mode
 """
-from typing import Dict, Any, Optional
+import asyncio
+import hashlib
+import weakref
+from collections import OrderedDict
+from typing import AsyncGenerator, Dict, Any, Optional
 from loguru import logger
 from app.agents.base_agent import BaseAgent
 from app.core.unified_orchestrator import UnifiedOrchestrator
 from app.core.model_config import model_manager
 
+# LRU-кэш ответов (только при context['use_cache']): sha1(model|specific_model|use_rag|task) -> result_text
+REACT_CACHE_MAX_SIZE = 128
+_react_cache: "OrderedDict[str, str]" = OrderedDict()
+
 
 class ReActAgent(BaseAgent):
     """
@@ -20,20 +28,50 @@ class ReActAgent(BaseAgent):
             description="Advanced agent with ReAct (Reason + Act) loop. Uses tools, RAG, and iterative reasoning."
         )
         self._orchestrator = None
+        self._initialized = False
+        # Lock на event loop: агент вызывается и из ASGI, и через async_to_sync в потоках
+        self._init_locks: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Lock]" = (
+            weakref.WeakKeyDictionary()
+        )
 
     @property
     def orchestrator(self):
         """Lazy load orchestrator"""
         if self._orchestrator is None:
             self._orchestrator = UnifiedOrchestrator()
-            # Mark as not initialized yet
-            self._orchestrator.initialized = False
         return self._orchestrator
     
+    async def _ensure_initialized(self):
+        """Однократная инициализация оркестратора; параллельные вызовы ждут первую"""
+        if self._initialized:
+            return
+        loop = asyncio.get_running_loop()
+        lock = self._init_locks.get(loop)
+        if lock is None:
+            lock = self._init_locks[loop] = asyncio.Lock()
+        async with lock:
+            if self._initialized:
+                return
+            await self.orchestrator.initialize()
+            self._initialized = True
+    
+    @staticmethod
+    def clear_cache():
+        """Очистить LRU-кэш ответов"""
+        _react_cache.clear()
+    
     async def execute(self, task: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
         Execute task using ReAct loop via Orchestrator.
         """
+        return await self.collect_stream(task, context)
+    
+    async def execute_stream(
+        self, task: str, context: Optional[Dict[str, Any]] = None
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        Stream orchestrator output: {'type': 'chunk', 'data': str} per chunk, then {'type': 'result', 'data': {...}}.
+        """
         context = self.validate_context(context)
         
         try:
@@ -42,10 +80,7 @@ class ReActAgent(BaseAgent):
             use_rag = context.get('use_rag', True)
             specific_model = context.get('specific_model')
             
-            # Initialize orchestrator if needed
-            if not hasattr(self._orchestrator, 'initialized') or not self._orchestrator.initialized:
-                await self.orchestrator.initialize()
-                self.orchestrator.initialized = True
+            await self._ensure_initialized()
             
             # Build execution_context for delegated tasks (connection_id, server, allowed_actions)
             execution_context = None
@@ -58,6 +93,30 @@ class ReActAgent(BaseAgent):
                     'task_id': context.get('task_id'),
                 }
 
+            # Трассы с инструментами плохо воспроизводимы — кэш только по явному use_cache
+            # и не для делегированных задач на серверах
+            cache_key = None
+            if context.get('use_cache', False) and execution_context is None:
+                cache_key = hashlib.sha1(
+                    f"{model_preference}|{specific_model}|{use_rag}|{task}".encode("utf-8")
+                ).hexdigest()
+                cached_text = _react_cache.get(cache_key)
+                if cached_text is not None:
+                    _react_cache.move_to_end(cache_key)
+                    yield {'type': 'chunk', 'data': cached_text}
+                    yield {'type': 'result', 'data': {
+                        'success': True,
+                        'result': cached_text,
+                        'error': None,
+                        'metadata': {
+                            'model': model_preference,
+                            'used_rag': use_rag,
+                            'agent_type': 'react',
+                            'cache': 'hit'
+                        }
+                    }}
+                    return
+
             # Collect response from orchestrator (using ReAct mode)
             result_parts = []
             async for chunk in self.orchestrator.process_user_message(
@@ -69,10 +128,16 @@ class ReActAgent(BaseAgent):
                 mode="react",  # Explicitly use ReAct mode
             ):
                 result_parts.append(chunk)
+                yield {'type': 'chunk', 'data': chunk}
             
             result_text = ''.join(result_parts)
             
-            return {
+            if cache_key and result_text:
+                _react_cache[cache_key] = result_text
+                if len(_react_cache) > REACT_CACHE_MAX_SIZE:
+                    _react_cache.popitem(last=False)
+            
+            result = {
                 'success': True,
                 'result': result_text,
                 'error': None,
@@ -85,9 +150,11 @@ class ReActAgent(BaseAgent):
             
         except Exception as e:
             logger.error(f"ReAct Agent execution failed: {e}")
-            return {
+            result = {
                 'success': False,
                 'result': None,
                 'error': str(e),
                 'metadata': {'agent_type': 'react'}
             }
+        
+        yield {'type': 'result', 'data': result}
@@ -0,0 +1,116 @@
+"""
+Semantic Cache - response cache with embedding-similarity lookup
+
+Перефразированные, но равнозначные запросы отдаются из кэша: эмбеддинг задачи сравнивается
+косинусом со всеми сохранёнными (одно умножение матрицы [N, D] на вектор).
+Требует энкодер RAG (sentence_transformers) и numpy; в мини-сборке available=False и кэш — no-op.
+"""
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from loguru import logger
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class SemanticCache:
+    """
+    Кэш ответов по смыслу запроса.
+
+    Слоты — кольцевой буфер фиксированной ёмкости; при заполнении вытесняется
+    давно не использованная запись (LRU). Записи разделены по bucket_key (модель),
+    чтобы ответ одной модели не отдавался на запрос к другой.
+    """
+
+    def __init__(self, capacity: int = 1024, threshold: float = 0.93, ttl_seconds: float = 3600, encoder: Any = None):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self._encoder = encoder
+        self._encoder_resolved = encoder is not None
+        # Хранилище создаётся при первой записи (размерность берётся из эмбеддинга)
+        self._embeddings = None  # np.ndarray [capacity, D], строки нормированы
+        self._bucket_ids = None  # np.ndarray [capacity] int32
+        self._expires_at = None  # np.ndarray [capacity] float64
+        self._last_used = None  # np.ndarray [capacity] float64
+        self._results: List[Optional[str]] = [None] * capacity
+        self._bucket_index: Dict[str, int] = {}
+        self._size = 0
+
+    @property
+    def encoder(self):
+        """Энкодер RAG; недоступность запоминается, чтобы не повторять импорт на каждый запрос"""
+        if not self._encoder_resolved:
+            from app.rag.engine import get_encoder
+            self._encoder = get_encoder()
+            self._encoder_resolved = True
+        return self._encoder
+
+    @property
+    def available(self) -> bool:
+        return np is not None and self.encoder is not None
+
+    def embed(self, text: str):
+        """Нормированный эмбеддинг текста (float32) или None, если кэш недоступен"""
+        if not self.available:
+            return None
+        try:
+            vector = np.asarray(self.encoder.encode(text), dtype=np.float32)
+        except Exception as e:
+            logger.warning(f"Semantic cache embedding failed: {e}")
+            return None
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm else None
+
+    def lookup(self, vector, bucket_key: str = "") -> Optional[Tuple[str, float, int]]:
+        """
+        Найти ближайший сохранённый запрос.
+
+        Returns:
+            (result, similarity, slot) при сходстве не ниже threshold, иначе None
+        """
+        bucket_id = self._bucket_index.get(bucket_key)
+        if vector is None or bucket_id is None or not self._size:
+            return None
+        now = time.monotonic()
+        n = self._size
+        valid = (self._bucket_ids[:n] == bucket_id) & (self._expires_at[:n] > now)
+        sims = np.where(valid, self._embeddings[:n] @ vector, -1.0)
+        slot = int(sims.argmax())
+        similarity = float(sims[slot])
+        if similarity < self.threshold:
+            return None
+        self._last_used[slot] = now
+        return self._results[slot], similarity, slot
+
+    def store(self, vector, result: str, bucket_key: str = ""):
+        """Сохранить ответ; при полном буфере вытесняется LRU-слот"""
+        if vector is None or not result:
+            return
+        if self._embeddings is None:
+            self._embeddings = np.zeros((self.capacity, vector.shape[0]), dtype=np.float32)
+            self._bucket_ids = np.full(self.capacity, -1, dtype=np.int32)
+            self._expires_at = np.zeros(self.capacity)
+            self._last_used = np.zeros(self.capacity)
+        if self._size < self.capacity:
+            slot = self._size
+            self._size += 1
+        else:
+            slot = int(self._last_used.argmin())
+        now = time.monotonic()
+        self._embeddings[slot] = vector
+        self._results[slot] = result
+        self._bucket_ids[slot] = self._bucket_index.setdefault(bucket_key, len(self._bucket_index))
+        self._expires_at[slot] = now + self.ttl_seconds
+        self._last_used[slot] = now
+
+    def clear(self):
+        self._embeddings = None
+        self._bucket_ids = None
+        self._expires_at = None
+        self._last_used = None
+        self._results = [None] * self.capacity
+        self._bucket_index.clear()
+        self._size = 0
@@ -1,11 +1,33 @@
 """
 Simple Agent - for straightforward tasks that don't require tools
 """
-from typing import Dict, Any, Optional
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import AsyncGenerator, Dict, Any, Optional
 from loguru import logger
 from app.agents.base_agent import BaseAgent
+from app.agents.semantic_cache import SemanticCache
+from app.core.llm import is_error_chunk
 from app.core.model_config import model_manager
 
+# LRU-кэш ответов: sha1(model|specific_model|task) -> result_text
+SIMPLE_CACHE_MAX_SIZE = 256
+_simple_cache: "OrderedDict[str, str]" = OrderedDict()
+
+# Семантический кэш: перефразированные запросы (cosine >= threshold) — тоже без LLM
+_semantic_cache = SemanticCache(capacity=1024, threshold=0.93, ttl_seconds=3600)
+
+SIMPLE_PROMPT_PREFIX = (
+    "You are a helpful AI assistant. Answer the following question or complete the task directly and concisely.\n"
+    "Provide a clear, helpful response.\n\n"
+    "Task: "
+)
+
+
+def _simple_cache_key(model: Optional[str], specific_model: Optional[str], task: str) -> str:
+    return hashlib.sha1(f"{model}|{specific_model}|{task}".encode("utf-8")).hexdigest()
+
 
 class SimpleAgent(BaseAgent):
     """
@@ -19,51 +41,115 @@ class SimpleAgent(BaseAgent):
             description="Fast agent for simple questions and tasks. Provides direct answers without using tools."
         )
     
+    @staticmethod
+    def clear_cache():
+        """Очистить LRU-кэш и семантический кэш ответов"""
+        _simple_cache.clear()
+        _semantic_cache.clear()
+    
     async def execute(self, task: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
         Execute simple task - just get LLM response.
         """
+        return await self.collect_stream(task, context)
+    
+    async def _build_prompt(self, task: str, context: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Before the LLM call: prompt and LLM parameters for the task.
+        Если ответ уже в кэше — в состоянии сразу есть 'result_text', LLM-вызов пропускается.
+        """
+        model_preference = context.get('model', model_manager.config.default_provider)
+        specific_model = context.get('specific_model')
+        state = {
+            'model': model_preference,
+            'specific_model': specific_model,
+            'cache_key': _simple_cache_key(model_preference, specific_model, task),
+        }
+        
+        # Повторный идентичный запрос — без обращения к LLM
+        cached_text = _simple_cache.get(state['cache_key'])
+        if cached_text is not None:
+            _simple_cache.move_to_end(state['cache_key'])
+            state['result_text'] = cached_text
+            state['cache_hit'] = True
+            return state
+        
+        # Перефразированный запрос — поиск по эмбеддингу (context['semantic_cache']=False отключает)
+        if context.get('semantic_cache', True):
+            state['bucket'] = f"{model_preference}|{specific_model}"
+            # Эмбеддинг (и первая загрузка модели) — в потоке, чтобы не блокировать event loop
+            state['embedding'] = await asyncio.to_thread(_semantic_cache.embed, task)
+            hit = _semantic_cache.lookup(state['embedding'], state['bucket'])
+            if hit is not None:
+                state['result_text'], similarity, slot = hit
+                state['cache_hit'] = True
+                state['cache_meta'] = {'hit': True, 'sim': round(similarity, 4), 'bucket': slot}
+                return state
+        
+        # Статическая инструкция — префиксом, задача — в конце (prefix-кэш провайдера)
+        state['prompt'] = SIMPLE_PROMPT_PREFIX + task
+        return state
+    
+    def _finalize(self, result_text: str, state: Dict[str, Any]) -> Dict[str, Any]:
+        """After the LLM call: store in cache and build the result dict."""
+        metadata = {
+            'model': state['model'],
+            'agent_type': 'simple',
+            'used_tools': False
+        }
+        if state.get('cache_hit'):
+            metadata['cache'] = state.get('cache_meta', 'hit')
+        elif result_text and not state.get('llm_failed'):
+            # Сбой провайдера (текст ошибки, таймаут, повтор) не кэшируется — следующий запрос пойдёт в LLM
+            _simple_cache[state['cache_key']] = result_text
+            if len(_simple_cache) > SIMPLE_CACHE_MAX_SIZE:
+                _simple_cache.popitem(last=False)
+            _semantic_cache.store(state.get('embedding'), result_text, state.get('bucket', ''))
+        
+        return {
+            'success': True,
+            'result': result_text,
+            'error': None,
+            'metadata': metadata
+        }
+    
+    async def execute_stream(
+        self, task: str, context: Optional[Dict[str, Any]] = None
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        Stream LLM response: {'type': 'chunk', 'data': str} per chunk, then {'type': 'result', 'data': {...}}.
+        """
         context = self.validate_context(context)
         
         try:
-            # Get model preference
-            model_preference = context.get('model', model_manager.config.default_provider)
-            specific_model = context.get('specific_model')
+            state = await self._build_prompt(task, context)
             
-            # Build simple prompt
-            prompt = f"""You are a helpful AI assistant. Answer the following question or complete the task directly and concisely.
-
-Task: {task}
-
-Provide a clear, helpful response."""
-            
-            # Get LLM response
-            result_parts = []
-            async for chunk in self.llm_provider.stream_chat(
-                prompt,
-                model=model_preference,
-                specific_model=specific_model
-            ):
-                result_parts.append(chunk)
+            if state.get('cache_hit'):
+                result_text = state['result_text']
+                yield {'type': 'chunk', 'data': result_text}
+            else:
+                # Get LLM response
+                result_parts = []
+                async for chunk in self.llm_provider.stream_chat(
+                    state['prompt'],
+                    model=state['model'],
+                    specific_model=state['specific_model']
+                ):
+                    result_parts.append(chunk)
+                    if is_error_chunk(chunk):
+                        state['llm_failed'] = True
+                    yield {'type': 'chunk', 'data': chunk}
+                result_text = ''.join(result_parts)
             
-            result_text = ''.join(result_parts)
-            
-            return {
-                'success': True,
-                'result': result_text,
-                'error': None,
-                'metadata': {
-                    'model': model_preference,
-                    'agent_type': 'simple',
-                    'used_tools': False
-                }
-            }
+            result = self._finalize(result_text, state)
             
         except Exception as e:
             logger.error(f"Simple Agent execution failed: {e}")
-            return {
+            result = {
                 'success': False,
                 'result': None,
                 'error': str(e),
                 'metadata': {'agent_type': 'simple'}
             }
+        
+        yield {'type': 'result', 'data': result}
@@ -1,35 +1,165 @@
 import os
 import asyncio
+import functools
+import random
+import re
+import threading
+import time
 from google import genai
 from loguru import logger
-from typing import AsyncGenerator, Optional
+from typing import TYPE_CHECKING, AsyncGenerator, Callable, Dict, Optional, Tuple
 from app.core.model_config import model_manager
+from app.utils import fast_json
+from app.utils.loop_resources import on_loop_shutdown
 
-# Таймаут для стрима Gemini (сек), экспоненциальная задержка при retry
-GEMINI_STREAM_TIMEOUT = 90  # в диапазоне 60–120 сек
-RETRY_BACKOFF = [1, 2, 4]
+if TYPE_CHECKING:
+    import aiohttp
+
+# Максимальная пауза между чанками стрима Gemini (сек): зависший стрим обнаруживается по ней,
+# а медленный, но идущий ответ не обрывается
+GEMINI_IDLE_TIMEOUT = 20
+# Retry: экспоненциальный потолок с jitter (разносит повторы параллельных вызовов во времени)
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 8.0
+RETRY_AFTER_MAX = 60.0
+_RETRYABLE_RE = re.compile(r"429|50[023]|resource exhausted|rate|internal", re.IGNORECASE)
+# Сбои провайдеров отдаются в поток отдельными чанками-текстами (см. _stream_*)
+RETRY_NOTICE = "[Повтор попытки...]"
+_ERROR_CHUNK_PREFIXES = ("Error: ", "Error from ", "Error calling ", "Unknown model: ")
+
+GROK_API_URL = "https://api.x.ai/v1/chat/completions"
+# Минимальный размер порции текста Grok на один yield (меньше переключений event loop)
+GROK_YIELD_MIN_CHARS = 64
+# Общая aiohttp-сессия Grok (keep-alive + DNS-кэш) на каждый event loop:
+# LLMProvider создаётся в каждом агенте, а вызовы идут и из ASGI, и из asyncio.run в потоках.
+# Закрываются при остановке своего loop (on_loop_shutdown) или явно через LLMProvider.aclose()
+_grok_sessions: Dict[asyncio.AbstractEventLoop, "aiohttp.ClientSession"] = {}
+
+
+def _get_grok_session() -> "aiohttp.ClientSession":
+    """Вернуть сессию текущего event loop, создав её при первом обращении."""
+    import aiohttp
+
+    for stale_loop in [loop for loop in _grok_sessions if loop.is_closed()]:
+        # Обычно сессия уже закрыта сторожем loop; если loop закрыли без shutdown_asyncgens,
+        # закрыть её корректно нельзя (транспорты принадлежат закрытому loop) — только отпустить
+        del _grok_sessions[stale_loop]
+    loop = asyncio.get_running_loop()
+    session = _grok_sessions.get(loop)
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=60.0),
+            connector=aiohttp.TCPConnector(limit=32, limit_per_host=16, ttl_dns_cache=300, keepalive_timeout=75),
+        )
+        _grok_sessions[loop] = session
+        on_loop_shutdown("llm_clients", functools.partial(_close_loop_clients, loop))
+    return session
+
+
+async def _close_loop_clients(loop: asyncio.AbstractEventLoop) -> None:
+    """Закрыть общие клиенты провайдеров, созданные на loop (вызывается на этом же loop)."""
+    session = _grok_sessions.pop(loop, None)
+    if session is not None and not session.closed:
+        await session.close()
+    for key in [key for key in _gemini_clients if key[0] is loop]:
+        await _gemini_clients.pop(key).aio.aclose()
+
+
+# Клиенты google-genai по (event loop, API key): как и Grok-сессия, общие для всех LLMProvider,
+# чтобы повторные вызовы (итерации Ralph, запросы views) шли по уже открытым соединениям;
+# закрываются вместе с ней (_close_loop_clients)
+_gemini_clients: Dict[Tuple[asyncio.AbstractEventLoop, str], "genai.Client"] = {}
+
+
+def _get_gemini_client_for_loop(api_key: str) -> "genai.Client":
+    """Вернуть клиент текущего event loop для api_key, создав его при первом обращении."""
+    for stale_key in [key for key in _gemini_clients if key[0].is_closed()]:
+        # Как и для Grok: клиенты закрываются сторожем loop, здесь — только остатки закрытых вручную loop
+        del _gemini_clients[stale_key]
+    loop = asyncio.get_running_loop()
+    key = (loop, api_key)
+    client = _gemini_clients.get(key)
+    if client is None:
+        client = _gemini_clients[key] = genai.Client(api_key=api_key)
+        on_loop_shutdown("llm_clients", functools.partial(_close_loop_clients, loop))
+        logger.info("Configured Gemini client")
+    return client
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты запросов к провайдеру (rate запросов/сек, всплеск до capacity).
+
+    Токены считаются по времени, без фоновой задачи и asyncio-примитивов — поэтому один
+    bucket общий для всех event loop'ов процесса. Каждый acquire резервирует токен,
+    при нехватке ждёт своей очереди. rate <= 0 — без ограничения.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Забрать токен; вернуть, сколько секунд ждать до его появления."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        delay = self._reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+# Общие для всех LLMProvider лимиты провайдеров (запросов/сек из env; 0 — без лимита)
+_rate_limiters: Dict[str, TokenBucket] = {
+    "gemini": TokenBucket(float(os.getenv("GEMINI_RPS", "0"))),
+    "grok": TokenBucket(float(os.getenv("GROK_RPS", "0"))),
+}
+
+
+def is_error_chunk(chunk: str) -> bool:
+    """Чанк stream_chat — сообщение о сбое/повторе провайдера, а не текст модели (такие ответы не кэшируются)"""
+    return chunk == RETRY_NOTICE or chunk.startswith(_ERROR_CHUNK_PREFIXES)
+
+
+def _retry_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """
+    Задержка перед повтором: Retry-After от сервера, если он есть,
+    иначе случайная в [0.5, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2^attempt)].
+    """
+    if retry_after:
+        try:
+            return min(max(float(retry_after), 0.0), RETRY_AFTER_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0.5, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
 
 
 def _is_retryable_error(e: Exception) -> bool:
     """Проверка на 429 (rate limit) или 5xx — повторять с backoff."""
-    s = str(e).lower()
-    code = getattr(e, "status_code", None) or getattr(e, "code", None)
-    if code is not None:
-        if code == 429:
-            return True
-        if isinstance(code, int) and 500 <= code < 600:
-            return True
-    if "429" in s or "resource exhausted" in s or "rate" in s:
-        return True
-    if "503" in s or "502" in s or "500" in s or "internal" in s:
+    code = getattr(e, "status_code", None)
+    if code is None:
+        code = getattr(e, "code", None)
+    if isinstance(code, int) and (code == 429 or 500 <= code < 600):
         return True
-    return False
+    # Один проход regex по исходному сообщению, без str.lower()
+    s = str(e)
+    return bool(s) and _RETRYABLE_RE.search(s) is not None
 
 
 async def with_retry(coro, max_attempts: int = 3):
     """
     Обёртка с retry при 429/5xx.
-    Экспоненциальная задержка: 1с, 2с, 4с.
+    Экспоненциальная задержка с jitter (см. _retry_delay).
     После max_attempts — пробрасывает ошибку.
     coro: корутина или callable, возвращающий корутину.
     """
@@ -42,12 +172,46 @@ async def with_retry(coro, max_attempts: int = 3):
             last_err = e
             if not _is_retryable_error(e) or attempt >= max_attempts - 1:
                 raise
-            delay = RETRY_BACKOFF[min(attempt, len(RETRY_BACKOFF) - 1)]
-            logger.warning(f"Retryable error (attempt {attempt + 1}/{max_attempts}): {e}, sleep {delay}s")
+            delay = _retry_delay(attempt)
+            logger.warning(f"Retryable error (attempt {attempt + 1}/{max_attempts}): {e}, sleep {delay:.1f}s")
             await asyncio.sleep(delay)
     if last_err is not None:
         raise last_err
 
+async def _iter_with_idle(agen, idle: float) -> AsyncGenerator:
+    """Элементы async-итератора; asyncio.TimeoutError, если следующий не пришёл за idle секунд."""
+    iterator = agen.__aiter__()
+    while True:
+        try:
+            item = await asyncio.wait_for(iterator.__anext__(), timeout=idle)
+        except StopAsyncIteration:
+            return
+        yield item
+
+
+async def _iter_sse_data(content) -> AsyncGenerator[bytes, None]:
+    """
+    Payload'ы строк "data: ..." из SSE-потока aiohttp.
+    Читает поток порциями (iter_any) и режет строки через bytes.find вместо построчной итерации.
+    """
+    buf = b""
+    async for data in content.iter_any():
+        buf += data
+        start = 0
+        while True:
+            newline = buf.find(b"\n", start)
+            if newline < 0:
+                break
+            line = buf[start:newline].strip()
+            start = newline + 1
+            if line.startswith(b"data: "):
+                yield line[6:]
+        buf = buf[start:]
+    line = buf.strip()
+    if line.startswith(b"data: "):
+        yield line[6:]
+
+
 class LLMProvider:
     def __init__(self):
         self.gemini_api_key = os.getenv("GEMINI_API_KEY")
@@ -56,37 +220,55 @@ class LLMProvider:
         # Set keys in model manager
         model_manager.set_api_keys(self.gemini_api_key, self.grok_api_key)
         
-        # Lazy initialization of Gemini client (only when enabled)
-        self._gemini_client = None
+        # Кэш chat-модели по провайдеру; сбрасывается при смене model_manager.config_version
+        self._chat_model_cache: Dict[str, str] = {}
+        self._chat_model_version = model_manager.config_version
+        
+        # Таблица провайдеров stream_chat: имя -> async-генератор (prompt, specific_model)
+        self._providers: Dict[str, Callable[[str, Optional[str]], AsyncGenerator[str, None]]] = {
+            "gemini": self._stream_gemini,
+            "grok": self._stream_grok,
+        }
 
     def _get_gemini_client(self):
-        """Lazy load Gemini client only when enabled"""
-        if not model_manager.config.gemini_enabled:
+        """Lazy load Gemini client only when enabled (общий на event loop, вызывать из async-кода)"""
+        if not model_manager.config.gemini_enabled or not self.gemini_api_key:
             return None
         
-        if self._gemini_client is None and self.gemini_api_key:
-            try:
-                self._gemini_client = genai.Client(api_key=self.gemini_api_key)
-                logger.info("Configured Gemini client")
-            except Exception as e:
-                logger.error(f"Failed to configure Gemini: {e}")
-                self._gemini_client = None
-        
-        return self._gemini_client
+        try:
+            return _get_gemini_client_for_loop(self.gemini_api_key)
+        except Exception as e:
+            logger.error(f"Failed to configure Gemini: {e}")
+            return None
     
+    async def aclose(self):
+        """Закрыть общие Grok-сессию и Gemini-клиенты текущего event loop раньше его остановки."""
+        await _close_loop_clients(asyncio.get_running_loop())
+
     @property
     def gemini_client(self):
         """Property for backward compatibility"""
         return self._get_gemini_client()
 
+    def _get_chat_model(self, provider: str) -> str:
+        """Chat-модель провайдера из model_manager с кэшем до изменения конфигурации"""
+        if self._chat_model_version != model_manager.config_version:
+            self._chat_model_cache.clear()
+            self._chat_model_version = model_manager.config_version
+        chat_model = self._chat_model_cache.get(provider)
+        if chat_model is None:
+            chat_model = self._chat_model_cache[provider] = model_manager.get_chat_model(provider)
+        return chat_model
+
     def set_api_key(self, model: str, key: str):
         if model == "gemini":
             self.gemini_api_key = key
             model_manager.set_api_keys(gemini_key=key)
-            self._gemini_client = None  # Reset client to reinitialize
+            self._chat_model_cache.clear()
         elif model == "grok":
             self.grok_api_key = key
             model_manager.set_api_keys(grok_key=key)
+            self._chat_model_cache.clear()
 
     async def stream_chat(self, prompt: str, model: str = "gemini", specific_model: str = None) -> AsyncGenerator[str, None]:
         """
@@ -100,124 +282,140 @@ class LLMProvider:
         # «auto» = Cursor CLI для чата, но для внутренних вызовов используем internal_llm_provider
         if model == "auto" or not model:
             model = model_manager.config.internal_llm_provider or "grok"
-            logger.info(f"Using internal_llm_provider: {model}")
-        logger.info(f"Streaming chat from {model} with prompt: {prompt[:50]}...")
+            logger.info("Using internal_llm_provider: {}", model)
+        # Аргументы форматируются только если INFO не отфильтрован
+        logger.opt(lazy=True).info("Streaming chat from {} with prompt: {}...", lambda: model, lambda: prompt[:50])
         
-        if model == "gemini":
-            # Check if Gemini is enabled
-            if not model_manager.config.gemini_enabled:
-                yield "Error: Gemini API disabled. Enable in settings or use CLI agent (ralph/cursor/claude)."
-                return
-            
-            if not self.gemini_client:
-                yield "Error: Gemini API Key not configured."
-                return
+        handler = self._providers.get(model)
+        if handler is None:
+            yield f"Unknown model: {model}"
+            return
+        async for chunk in handler(prompt, specific_model):
+            yield chunk
 
-            target_model = specific_model or model_manager.get_chat_model("gemini")
-            logger.info(f"Using Gemini model: {target_model}")
-            max_attempts = 3
-
-            for attempt in range(max_attempts):
-                try:
-                    async def consume():
-                        out = []
-                        # generate_content_stream возвращает корутину; нужен await перед async for
-                        stream = await self.gemini_client.aio.models.generate_content_stream(
-                            model=target_model,
-                            contents=prompt
-                        )
-                        async for chunk in stream:
-                            if chunk.text:
-                                out.append(chunk.text)
-                        return out
-
-                    chunks = await asyncio.wait_for(consume(), timeout=GEMINI_STREAM_TIMEOUT)
-                    for c in chunks:
-                        yield c
-                    return
-                except asyncio.TimeoutError:
-                    logger.error("Gemini stream timeout")
-                    yield "Error: Timeout (Gemini stream)."
-                    return
-                except Exception as e:
-                    if _is_retryable_error(e) and attempt < max_attempts - 1:
-                        yield "[Повтор попытки...]"
-                        delay = RETRY_BACKOFF[min(attempt, len(RETRY_BACKOFF) - 1)]
-                        await asyncio.sleep(delay)
-                    else:
-                        logger.error(f"Gemini Error: {e}")
-                        yield f"Error calling Gemini: {str(e)}"
-                        return
+    def register_provider(self, name: str, handler: Callable[[str, Optional[str]], AsyncGenerator[str, None]]):
+        """Зарегистрировать провайдера: handler(prompt, specific_model) — async-генератор текста"""
+        self._providers[name] = handler
 
-        elif model == "grok":
-            # Check if Grok is enabled
-            if not model_manager.config.grok_enabled:
-                yield "Error: Grok API disabled. Enable in settings or use CLI agent (ralph/cursor/claude)."
+    async def _stream_gemini(self, prompt: str, specific_model: Optional[str] = None) -> AsyncGenerator[str, None]:
+        """Gemini через google-genai (aio stream)"""
+        # Check if Gemini is enabled
+        if not model_manager.config.gemini_enabled:
+            yield "Error: Gemini API disabled. Enable in settings or use CLI agent (ralph/cursor/claude)."
+            return
+        
+        gemini_client = self.gemini_client
+        if not gemini_client:
+            yield "Error: Gemini API Key not configured."
+            return
+
+        target_model = specific_model or self._get_chat_model("gemini")
+        logger.info("Using Gemini model: {}", target_model)
+        max_attempts = 3
+
+        for attempt in range(max_attempts):
+            # Чанки отдаются по мере прихода; повтор — только пока ничего не отдано
+            yielded = False
+            try:
+                await _rate_limiters["gemini"].acquire()
+                # generate_content_stream возвращает корутину; нужен await перед async for
+                stream = await asyncio.wait_for(
+                    gemini_client.aio.models.generate_content_stream(
+                        model=target_model,
+                        contents=prompt
+                    ),
+                    timeout=GEMINI_IDLE_TIMEOUT,
+                )
+                async for chunk in _iter_with_idle(stream, GEMINI_IDLE_TIMEOUT):
+                    if chunk.text:
+                        yielded = True
+                        yield chunk.text
                 return
-            
-            if not self.grok_api_key:
-                yield "Error: Grok API Key not configured."
+            except asyncio.TimeoutError:
+                logger.error(f"Gemini stream stalled for {GEMINI_IDLE_TIMEOUT}s")
+                yield "Error: Timeout (Gemini stream)."
                 return
+            except Exception as e:
+                if _is_retryable_error(e) and attempt < max_attempts - 1 and not yielded:
+                    yield RETRY_NOTICE
+                    await asyncio.sleep(_retry_delay(attempt))
+                else:
+                    logger.error(f"Gemini Error: {e}")
+                    yield f"Error calling Gemini: {str(e)}"
+                    return
+
+    async def _stream_grok(self, prompt: str, specific_model: Optional[str] = None) -> AsyncGenerator[str, None]:
+        """Grok через xAI chat completions (SSE)"""
+        # Check if Grok is enabled
+        if not model_manager.config.grok_enabled:
+            yield "Error: Grok API disabled. Enable in settings or use CLI agent (ralph/cursor/claude)."
+            return
+        
+        if not self.grok_api_key:
+            yield "Error: Grok API Key not configured."
+            return
 
-            import aiohttp
-            import json
-
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {self.grok_api_key}"
-            }
-            grok_model = specific_model or model_manager.get_chat_model("grok")
-            data = {
-                "messages": [
-                    {"role": "system", "content": "You are a helpful assistant."},
-                    {"role": "user", "content": prompt}
-                ],
-                "model": grok_model,
-                "stream": True,
-                "temperature": 0.7
-            }
-            # ClientTimeout(total=60) — уже используется для Grok
-            timeout = aiohttp.ClientTimeout(total=60.0)
-            max_attempts = 3
-
-            for attempt in range(max_attempts):
-                try:
-                    async with aiohttp.ClientSession(timeout=timeout) as session:
-                        async with session.post("https://api.x.ai/v1/chat/completions", headers=headers, json=data) as response:
-                            if response.status == 200:
-                                async for line_bytes in response.content:
-                                    line = line_bytes.decode('utf-8').strip()
-                                    if line.startswith("data: "):
-                                        chunk_str = line[6:]
-                                        if chunk_str == "[DONE]":
-                                            break
-                                        try:
-                                            chunk_json = json.loads(chunk_str)
-                                            content = chunk_json.get("choices", [{}])[0].get("delta", {}).get("content", "")
-                                            if content:
-                                                yield content
-                                        except json.JSONDecodeError:
-                                            continue
-                                return
-                            error_text = await response.text()
-                            is_retryable = response.status == 429 or (500 <= response.status < 600)
-                            if is_retryable and attempt < max_attempts - 1:
-                                yield "[Повтор попытки...]"
-                                delay = RETRY_BACKOFF[min(attempt, len(RETRY_BACKOFF) - 1)]
-                                await asyncio.sleep(delay)
-                            else:
-                                yield f"Error from Grok API: {response.status} - {error_text}"
-                                return
-                except Exception as e:
-                    err_retryable = _is_retryable_error(e) and attempt < max_attempts - 1
-                    if err_retryable:
-                        yield "[Повтор попытки...]"
-                        delay = RETRY_BACKOFF[min(attempt, len(RETRY_BACKOFF) - 1)]
-                        await asyncio.sleep(delay)
+        import json
+
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.grok_api_key}"
+        }
+        grok_model = specific_model or self._get_chat_model("grok")
+        data = {
+            "messages": [
+                {"role": "system", "content": "You are a helpful assistant."},
+                {"role": "user", "content": prompt}
+            ],
+            "model": grok_model,
+            "stream": True,
+            "temperature": 0.7
+        }
+        max_attempts = 3
+
+        for attempt in range(max_attempts):
+            try:
+                # Сессия переиспользуется между вызовами (ClientTimeout(total=60) задан в ней)
+                session = _get_grok_session()
+                await _rate_limiters["grok"].acquire()
+                async with session.post(GROK_API_URL, headers=headers, json=data) as response:
+                    if response.status == 200:
+                        # Соседние фрагменты склеиваются до GROK_YIELD_MIN_CHARS перед yield
+                        pending = []
+                        pending_len = 0
+                        async for payload in _iter_sse_data(response.content):
+                            if payload == b"[DONE]":
+                                break
+                            try:
+                                chunk_json = fast_json.loads(payload)
+                            except json.JSONDecodeError:
+                                continue
+                            content = chunk_json.get("choices", [{}])[0].get("delta", {}).get("content", "")
+                            if content:
+                                pending.append(content)
+                                pending_len += len(content)
+                                if pending_len >= GROK_YIELD_MIN_CHARS:
+                                    yield "".join(pending)
+                                    pending.clear()
+                                    pending_len = 0
+                        if pending:
+                            yield "".join(pending)
+                        return
+                    error_text = await response.text()
+                    is_retryable = response.status == 429 or (500 <= response.status < 600)
+                    if is_retryable and attempt < max_attempts - 1:
+                        yield RETRY_NOTICE
+                        await asyncio.sleep(_retry_delay(attempt, response.headers.get("retry-after")))
                     else:
-                        logger.error(f"Grok Error: {e}")
-                        yield f"Error calling Grok: {str(e)}"
+                        yield f"Error from Grok API: {response.status} - {error_text}"
                         return
-        
-        else:
-            yield f"Unknown model: {model}"
+            except Exception as e:
+                err_retryable = _is_retryable_error(e) and attempt < max_attempts - 1
+                if err_retryable:
+                    yield RETRY_NOTICE
+                    await asyncio.sleep(_retry_delay(attempt))
+                else:
+                    logger.error(f"Grok Error: {e}")
+                    yield f"Error calling Grok: {str(e)}"
+                    return
+
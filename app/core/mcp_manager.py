@@ -1,12 +1,68 @@
 """
 MCP Manager - управление MCP конфигурацией per-agent
 """
+import atexit
+import copy
+import hashlib
 import os
-import json
 import tempfile
+import threading
+import types
+from collections import OrderedDict
 from pathlib import Path
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Iterator, List, Mapping, Optional, Tuple
 from loguru import logger
+from app.utils import fast_json
+
+# mcp_config.json читает CLI, а не человек — компактный JSON; WEU_MCP_CONFIG_PRETTY=1 для отладки
+MCP_CONFIG_PRETTY = os.getenv("WEU_MCP_CONFIG_PRETTY", "").lower() in ("1", "true", "yes")
+# LRU-кэш разбора конфигураций: sha1(JSON конфигурации) -> (команды, allowed tools, валидация)
+MCP_PARSE_CACHE_MAX_SIZE = 32
+_VALID_MCP_TYPES = frozenset({'stdio', 'sse'})
+# Необязательные поля сервера, попадающие в mcp_config.json
+_OPTIONAL_SERVER_KEYS = ('env', 'description')
+# Файлы mcp_config.json переиспользуются для одинаковых наборов enabled серверов
+MCP_CONFIG_FILE_CACHE_MAX_SIZE = 16
+# Все созданные файлы удаляются при выходе (вытесненные из кэша — тоже: их может читать запущенный CLI)
+_created_config_files: set = set()
+
+
+@atexit.register
+def _cleanup_mcp_config_files():
+    for path in _created_config_files:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+    _created_config_files.clear()
+
+
+# Шаблон MCP серверов для новых агентов (см. MCPManager.get_default_mcp_servers)
+_DEFAULT_MCP_SERVERS: Dict[str, Any] = {
+    "filesystem": {
+        "enabled": False,
+        "command": "npx",
+        "args": ["-y", "@modelcontextprotocol/server-filesystem", "/workspace"],
+        "description": "File system operations",
+        "allowed_tools": ["read_file", "write_file", "list_directory"]
+    },
+    "github": {
+        "enabled": False,
+        "command": "npx",
+        "args": ["-y", "@modelcontextprotocol/server-github"],
+        "env": {"GITHUB_PERSONAL_ACCESS_TOKEN": ""},
+        "description": "GitHub repository operations",
+        "allowed_tools": ["create_repository", "search_repositories"]
+    },
+    "postgres": {
+        "enabled": False,
+        "command": "npx",
+        "args": ["-y", "@modelcontextprotocol/server-postgres", "postgresql://localhost/db"],
+        "description": "PostgreSQL database operations",
+        "allowed_tools": ["query", "list_tables"]
+    }
+}
+_DEFAULT_MCP_SERVERS_VIEW: Mapping[str, Any] = types.MappingProxyType(_DEFAULT_MCP_SERVERS)
 
 
 class MCPManager:
@@ -20,7 +76,8 @@ class MCPManager:
     """
     
     def __init__(self):
-        pass
+        self._parse_cache: "OrderedDict[str, Tuple[List[str], List[str], Dict[str, Any]]]" = OrderedDict()
+        self._config_files: "OrderedDict[str, str]" = OrderedDict()
     
     def create_mcp_config_file(self, mcp_servers: Dict[str, Any]) -> Optional[str]:
         """
@@ -36,36 +93,40 @@ class MCPManager:
             return None
         
         try:
-            # Фильтруем только enabled серверы
-            enabled_servers = {}
-            for name, config in mcp_servers.items():
-                if config.get('enabled', True):
-                    server_config = {
-                        "command": config.get('command'),
-                        "args": config.get('args', []),
-                    }
-                    
-                    # Env variables
-                    if config.get('env'):
-                        server_config['env'] = config['env']
-                    
-                    # Description
-                    if config.get('description'):
-                        server_config['description'] = config['description']
-                    
-                    enabled_servers[name] = server_config
+            # Только enabled серверы; env и description — если заданы
+            enabled_servers = {
+                name: {
+                    "command": config.get('command'),
+                    "args": config.get('args', []),
+                    **{key: config[key] for key in _OPTIONAL_SERVER_KEYS if config.get(key)},
+                }
+                for name, config in self._iter_enabled(mcp_servers)
+            }
             
             if not enabled_servers:
                 return None
             
-            # Создаём временный файл
             config_data = {"mcpServers": enabled_servers}
+            data = fast_json.dumps_bytes(config_data, indent=MCP_CONFIG_PRETTY)
             
-            fd, path = tempfile.mkstemp(suffix='.json', prefix='mcp_config_')
-            os.close(fd)
+            # Тот же набор серверов — отдаём уже записанный файл, если он на месте
+            key = hashlib.sha1(data).hexdigest()
+            path = self._config_files.get(key)
+            if path is not None:
+                if os.path.exists(path):
+                    self._config_files.move_to_end(key)
+                    return path
+                del self._config_files[key]
             
-            with open(path, 'w', encoding='utf-8') as f:
-                json.dump(config_data, f, indent=2)
+            # Создаём временный файл
+            # Сериализация целиком в память и одна запись (orjson, если установлен)
+            with tempfile.NamedTemporaryFile(mode='wb', suffix='.json', prefix='mcp_config_', delete=False) as f:
+                f.write(data)
+                path = f.name
+            _created_config_files.add(path)
+            self._config_files[key] = path
+            if len(self._config_files) > MCP_CONFIG_FILE_CACHE_MAX_SIZE:
+                self._config_files.popitem(last=False)
             
             logger.info(f"Created MCP config file: {path}")
             return path
@@ -84,12 +145,69 @@ class MCPManager:
         Returns:
             List[str]: Список команд для настройки MCP
         """
+        return list(self._analyze(mcp_servers)[0])
+    
+    def get_allowed_tools(self, mcp_servers: Dict[str, Any]) -> List[str]:
+        """
+        Получить список разрешённых инструментов из MCP конфигурации
+        
+        Returns:
+            List[str]: Список tool names
+        """
+        return list(self._analyze(mcp_servers)[1])
+    
+    def validate_mcp_config(self, mcp_servers: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Валидация MCP конфигурации
+        
+        Returns:
+            Dict with 'valid' bool and 'errors' list
+        """
+        validation = self._analyze(mcp_servers)[2]
+        return {'valid': validation['valid'], 'errors': list(validation['errors'])}
+    
+    def invalidate_cache(self):
+        """Сбросить кэш разбора конфигураций (после правки MCP серверов)"""
+        self._parse_cache.clear()
+    
+    def _analyze(self, mcp_servers: Dict[str, Any]) -> Tuple[List[str], List[str], Dict[str, Any]]:
+        """
+        (команды, allowed tools, результат валидации) для конфигурации.
+        Кэшируется по отпечатку содержимого; наружу отдаются копии.
+        """
+        # Порядок ключей значим: от него зависит порядок команд и инструментов
+        try:
+            key = hashlib.sha1(fast_json.dumps_bytes(mcp_servers)).hexdigest()
+        except TypeError:
+            # Несериализуемые значения — считаем без кэша
+            key = None
+        if key is not None:
+            cached = self._parse_cache.get(key)
+            if cached is not None:
+                self._parse_cache.move_to_end(key)
+                return cached
+        result = (
+            self._build_commands(mcp_servers),
+            self._build_allowed_tools(mcp_servers),
+            self._build_validation(mcp_servers),
+        )
+        if key is not None:
+            self._parse_cache[key] = result
+            if len(self._parse_cache) > MCP_PARSE_CACHE_MAX_SIZE:
+                self._parse_cache.popitem(last=False)
+        return result
+    
+    @staticmethod
+    def _iter_enabled(mcp_servers: Dict[str, Any]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """(name, config) включённых серверов (enabled по умолчанию True)"""
+        return ((name, config) for name, config in mcp_servers.items() if config.get('enabled', True))
+    
+    @staticmethod
+    def _build_commands(mcp_servers: Dict[str, Any]) -> List[str]:
+        """Команды `claude mcp add ...` для enabled серверов с command и args"""
         commands = []
         
-        for name, config in mcp_servers.items():
-            if not config.get('enabled', True):
-                continue
-            
+        for name, config in MCPManager._iter_enabled(mcp_servers):
             command = config.get('command')
             args = config.get('args', [])
             
@@ -100,19 +218,12 @@ class MCPManager:
         
         return commands
     
-    def get_allowed_tools(self, mcp_servers: Dict[str, Any]) -> List[str]:
-        """
-        Получить список разрешённых инструментов из MCP конфигурации
-        
-        Returns:
-            List[str]: Список tool names
-        """
+    @staticmethod
+    def _build_allowed_tools(mcp_servers: Dict[str, Any]) -> List[str]:
+        """Имена инструментов enabled серверов с префиксом сервера"""
         allowed_tools = []
         
-        for name, config in mcp_servers.items():
-            if not config.get('enabled', True):
-                continue
-            
+        for name, config in MCPManager._iter_enabled(mcp_servers):
             tools = config.get('allowed_tools', [])
             if tools:
                 # Добавляем prefix сервера к tool names
@@ -121,13 +232,9 @@ class MCPManager:
         
         return allowed_tools
     
-    def validate_mcp_config(self, mcp_servers: Dict[str, Any]) -> Dict[str, Any]:
-        """
-        Валидация MCP конфигурации
-        
-        Returns:
-            Dict with 'valid' bool and 'errors' list
-        """
+    @staticmethod
+    def _build_validation(mcp_servers: Dict[str, Any]) -> Dict[str, Any]:
+        """Проверка обязательных полей и типа каждого сервера"""
         errors = []
         
         for name, config in mcp_servers.items():
@@ -136,54 +243,42 @@ class MCPManager:
                 errors.append(f"Server '{name}': missing 'command'")
             
             # Проверка типа
-            if config.get('type') and config['type'] not in ['stdio', 'sse']:
-                errors.append(f"Server '{name}': invalid type '{config['type']}'")
+            server_type = config.get('type')
+            if server_type and server_type not in _VALID_MCP_TYPES:
+                errors.append(f"Server '{name}': invalid type '{server_type}'")
         
         return {
             'valid': len(errors) == 0,
             'errors': errors
         }
     
-    def get_default_mcp_servers(self) -> Dict[str, Any]:
+    def get_default_mcp_servers(self, mutable: bool = True) -> Mapping[str, Any]:
         """
         Получить базовую конфигурацию MCP серверов
         
+        Args:
+            mutable: True — независимая копия для правки; False — общий read-only вид
+                (только верхний уровень, вложенные словари менять нельзя)
+        
         Returns:
             Dict: Базовая конфигурация для новых агентов
         """
-        return {
-            "filesystem": {
-                "enabled": False,
-                "command": "npx",
-                "args": ["-y", "@modelcontextprotocol/server-filesystem", "/workspace"],
-                "description": "File system operations",
-                "allowed_tools": ["read_file", "write_file", "list_directory"]
-            },
-            "github": {
-                "enabled": False,
-                "command": "npx",
-                "args": ["-y", "@modelcontextprotocol/server-github"],
-                "env": {"GITHUB_PERSONAL_ACCESS_TOKEN": ""},
-                "description": "GitHub repository operations",
-                "allowed_tools": ["create_repository", "search_repositories"]
-            },
-            "postgres": {
-                "enabled": False,
-                "command": "npx",
-                "args": ["-y", "@modelcontextprotocol/server-postgres", "postgresql://localhost/db"],
-                "description": "PostgreSQL database operations",
-                "allowed_tools": ["query", "list_tables"]
-            }
-        }
+        if mutable:
+            return copy.deepcopy(_DEFAULT_MCP_SERVERS)
+        return _DEFAULT_MCP_SERVERS_VIEW
 
 
 # Global MCP manager instance
 _mcp_manager = None
+_mcp_manager_lock = threading.Lock()
 
 
 def get_mcp_manager() -> MCPManager:
     """Get or create global MCP manager instance"""
     global _mcp_manager
     if _mcp_manager is None:
-        _mcp_manager = MCPManager()
+        # Double-checked locking: после создания — только чтение глобала, без блокировки
+        with _mcp_manager_lock:
+            if _mcp_manager is None:
+                _mcp_manager = MCPManager()
     return _mcp_manager
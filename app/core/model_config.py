@@ -2,13 +2,15 @@
 Model Configuration Manager
 Manages model selection for different purposes (chat, RAG, agent)
 """
+import asyncio
 import os
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from pydantic import BaseModel
 from loguru import logger
 from google import genai
 import httpx
-import json
+from app.utils import fast_json
+from app.utils.loop_resources import on_loop_shutdown
 
 
 class ModelConfig(BaseModel):
@@ -61,11 +63,46 @@ class ModelManager:
     """Manages available models and configurations"""
     
     def __init__(self):
+        # Версия конфигурации: растёт при каждом изменении, по ней сбрасываются кэши (LLMProvider)
+        self.config_version = 0
         self.config = ModelConfig()
         self.available_gemini_models: List[str] = []
         self.available_grok_models: List[str] = []
         self.gemini_api_key: Optional[str] = None
         self.grok_api_key: Optional[str] = None
+        # HTTP-клиент (пул соединений + TLS-сессия) на каждый event loop: refresh_models
+        # вызывается и из ASGI, и через async_to_sync в потоках; закрывается при остановке своего loop
+        self._http_clients: Dict[asyncio.AbstractEventLoop, httpx.AsyncClient] = {}
+        # Клиент google.genai для листинга моделей, пересоздаётся при смене ключа
+        self._gemini_client = None
+        self._gemini_client_key: Optional[str] = None
+    
+    @property
+    def config(self) -> ModelConfig:
+        return self._config
+    
+    @config.setter
+    def config(self, value: ModelConfig):
+        self._config = value
+        self.config_version += 1
+    
+    def _get_http(self) -> httpx.AsyncClient:
+        """Клиент текущего event loop, создаётся при первом обращении"""
+        for stale_loop in [loop for loop in self._http_clients if loop.is_closed()]:
+            # Клиент уже закрыт сторожем loop; остаются только loop, закрытые без shutdown_asyncgens
+            del self._http_clients[stale_loop]
+        loop = asyncio.get_running_loop()
+        client = self._http_clients.get(loop)
+        if client is None or client.is_closed:
+            client = self._http_clients[loop] = httpx.AsyncClient(timeout=10.0)
+            on_loop_shutdown(f"model_manager_http:{id(self)}", self.aclose)
+        return client
+    
+    async def aclose(self):
+        """Закрыть HTTP-клиент текущего event loop (вызывается и автоматически при его остановке)"""
+        client = self._http_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None and not client.is_closed:
+            await client.aclose()
     
     def set_api_keys(self, gemini_key: Optional[str] = None, grok_key: Optional[str] = None):
         """Set API keys"""
@@ -83,26 +120,8 @@ class ModelManager:
             return self._get_default_gemini_models()
         
         try:
-            # Create client with API key
-            client = genai.Client(api_key=self.gemini_api_key)
-            
-            # List all models
-            models = client.models.list()
-            
-            # Filter for generative models (chat/text)
-            generative_models = []
-            embedding_models = []
-            
-            for model in models:
-                model_name = model.name
-                
-                # Check if it supports text generation
-                if hasattr(model, 'supported_actions') and 'generateContent' in model.supported_actions:
-                    generative_models.append(model_name)
-                
-                # Check if it supports embeddings
-                if hasattr(model, 'supported_actions') and 'embedContent' in model.supported_actions:
-                    embedding_models.append(model_name)
+            # google.genai синхронный: листинг (и ленивая пагинация) — в потоке, не в event loop
+            generative_models, embedding_models = await asyncio.to_thread(self._list_gemini_models)
             
             self.available_gemini_models = generative_models
             
@@ -115,6 +134,28 @@ class ModelManager:
             logger.error(f"Failed to fetch Gemini models: {e}")
             return self._get_default_gemini_models()
     
+    def _list_gemini_models(self) -> Tuple[List[str], List[str]]:
+        """(generative, embedding) модели Gemini; синхронный вызов API"""
+        if self._gemini_client is None or self._gemini_client_key != self.gemini_api_key:
+            self._gemini_client = genai.Client(api_key=self.gemini_api_key)
+            self._gemini_client_key = self.gemini_api_key
+        
+        # Filter for generative models (chat/text)
+        generative_models = []
+        embedding_models = []
+        
+        for model in self._gemini_client.models.list():
+            # supported_actions читается один раз; может отсутствовать или быть None
+            actions = getattr(model, 'supported_actions', None) or ()
+            
+            # Text generation / embeddings
+            if 'generateContent' in actions:
+                generative_models.append(model.name)
+            if 'embedContent' in actions:
+                embedding_models.append(model.name)
+        
+        return generative_models, embedding_models
+    
     async def fetch_available_grok_models(self) -> List[str]:
         """
         Fetch available Grok models from xAI API
@@ -124,24 +165,23 @@ class ModelManager:
             return self._get_default_grok_models()
         
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    "https://api.x.ai/v1/models",
-                    headers={"Authorization": f"Bearer {self.grok_api_key}"},
-                    timeout=10.0
-                )
+            response = await self._get_http().get(
+                "https://api.x.ai/v1/models",
+                headers={"Authorization": f"Bearer {self.grok_api_key}"},
+                timeout=10.0
+            )
+            
+            if response.status_code == 200:
+                data = response.json()
+                models = [model['id'] for model in data.get('data', [])]
+                
+                self.available_grok_models = models
+                logger.success(f"Fetched {len(models)} Grok models")
+                return models
+            else:
+                logger.error(f"Grok API returned status {response.status_code}")
+                return self._get_default_grok_models()
                 
-                if response.status_code == 200:
-                    data = response.json()
-                    models = [model['id'] for model in data.get('data', [])]
-                    
-                    self.available_grok_models = models
-                    logger.success(f"Fetched {len(models)} Grok models")
-                    return models
-                else:
-                    logger.error(f"Grok API returned status {response.status_code}")
-                    return self._get_default_grok_models()
-                    
         except Exception as e:
             logger.error(f"Failed to fetch Grok models: {e}")
             return self._get_default_grok_models()
@@ -164,11 +204,14 @@ class ModelManager:
         """Refresh available models from both providers"""
         logger.info("Refreshing available models...")
         
+        # Провайдеры независимы — запросы идут параллельно
+        fetches = []
         if self.gemini_api_key:
-            await self.fetch_available_gemini_models()
-        
+            fetches.append(self.fetch_available_gemini_models())
         if self.grok_api_key:
-            await self.fetch_available_grok_models()
+            fetches.append(self.fetch_available_grok_models())
+        if fetches:
+            await asyncio.gather(*fetches, return_exceptions=True)
     
     def get_chat_model(self, provider: Optional[str] = None) -> str:
         """Get configured chat model for provider. «auto» даёт chat_model_gemini (fallback для внутренних вызовов)."""
@@ -197,13 +240,14 @@ class ModelManager:
         for key, value in kwargs.items():
             if hasattr(self.config, key):
                 setattr(self.config, key, value)
+                self.config_version += 1
                 logger.info(f"Updated {key} to {value}")
     
     def save_config(self, filepath: str = ".model_config.json"):
         """Save configuration to file"""
         try:
-            with open(filepath, 'w') as f:
-                json.dump(self.config.model_dump(), f, indent=2)
+            with open(filepath, 'wb') as f:
+                f.write(fast_json.dumps_bytes(self.config.model_dump(), indent=True))
             logger.success(f"Model configuration saved to {filepath}")
         except Exception as e:
             logger.error(f"Failed to save config: {e}")
@@ -212,8 +256,8 @@ class ModelManager:
         """Load configuration from file"""
         try:
             if os.path.exists(filepath):
-                with open(filepath, 'r') as f:
-                    data = json.load(f)
+                with open(filepath, 'rb') as f:
+                    data = fast_json.loads(f.read())
                 self.config = ModelConfig(**data)
                 logger.success(f"Model configuration loaded from {filepath}")
                 return True
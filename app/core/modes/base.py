@@ -1,8 +1,21 @@
 """
 Base Mode class for Unified Orchestrator
 """
+import asyncio
+import contextvars
+import functools
 from abc import ABC, abstractmethod
-from typing import Dict, Any, AsyncGenerator, Optional, List
+from itertools import islice
+from typing import Callable, Dict, Any, AsyncGenerator, Optional, List, Sequence, TypeVar
+
+T = TypeVar("T")
+
+# Сколько сообщений хранит общая история оркестратора (deque с maxlen) и видит режим за ход
+HISTORY_MAX_MESSAGES = 10
+# Маркер вызова инструмента в ответе LLM (см. UnifiedOrchestrator._parse_action).
+# При стриминге хвост короче маркера придерживается — маркер может быть разрезан между чанками
+ACTION_MARKER = "ACTION:"
+ACTION_HOLDBACK = len(ACTION_MARKER) - 1
 
 
 class BaseMode(ABC):
@@ -47,6 +60,23 @@ class BaseMode(ABC):
         """
         raise NotImplementedError("BaseMode.execute must be implemented by subclasses")
     
+    @staticmethod
+    def _recent_history(history: Sequence[Dict[str, str]], n: int) -> List[Dict[str, str]]:
+        """Последние n сообщений списком; работает и для list, и для deque (без копии всей истории)"""
+        return list(islice(history, max(0, len(history) - n), None))
+    
+    @staticmethod
+    async def _run_blocking(fn: Callable[..., T], *args: Any) -> T:
+        """
+        Блокирующий вызов (RAG query/add_text) в default executor.
+        Как asyncio.to_thread, но без обёртки ctx.run, когда контекст пуст.
+        """
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()
+        if len(ctx):
+            return await loop.run_in_executor(None, functools.partial(ctx.run, fn, *args))
+        return await loop.run_in_executor(None, fn, *args)
+    
     @property
     def name(self) -> str:
         """Имя режима"""
@@ -7,10 +7,12 @@ Chat Mode - простой режим для чата без ReAct loop
 import asyncio
 import json
 import re
-from typing import AsyncGenerator, List, Dict, Any
+import types
+from typing import AsyncGenerator, List, Dict, Any, Mapping
 from loguru import logger
-from app.core.modes.base import BaseMode
+from app.core.modes.base import ACTION_HOLDBACK, ACTION_MARKER, HISTORY_MAX_MESSAGES, BaseMode
 from app.core.task_board import build_task_board_payload
+from app.utils import fast_json
 
 
 # Системные правила для чата (профессиональный стиль)
@@ -26,6 +28,52 @@ CHAT_SYSTEM_RULES = """
 8. Удаляй задачу через task_delete только при явном запросе пользователя и с confirm=true.
 """
 
+# Статические части промпта чата (см. ChatMode._build_chat_prompt).
+# Всё неизменное идёт до пользовательского контекста: префикс промпта совпадает между ходами
+# (дешевле собирать и переиспользуется prefix cache на стороне LLM)
+_CHAT_PROMPT_HEAD = f"Ты WEU Assistant — умный помощник в чате.\n{CHAT_SYSTEM_RULES}\n\nДОСТУПНЫЕ ИНСТРУМЕНТЫ:\n"
+_CHAT_PROMPT_FORMAT = """ФОРМАТ ОТВЕТА:
+- Если нужны данные, напиши ОДНУ строку:
+ACTION: tool_name {"param": "value"}
+- Если данные не нужны, сразу отвечай пользователю.
+
+"""
+
+# Инструкции финального промпта по данным инструмента (см. ChatMode._build_final_prompt)
+_FINAL_TASKS_SUMMARY = """Сделай краткую сводку:
+1. Первая строка: «Сводка: всего N задач (активных: X, завершённых: Y)».
+2. Затем блоки по статусам (TODO, IN_PROGRESS, BLOCKED, DONE, CANCELLED) только если там есть задачи.
+3. В каждой строке задачи: название, приоритет, исполнитель, срок.
+4. Русский язык, без emoji, без выдумок.
+"""
+_FINAL_TASKS_ANSWER = """Ответь по сути вопроса пользователя, используя данные задач.
+Если задач несколько и запрос про одну задачу неочевиден — выбери самую релевантную (обычно IN_PROGRESS, иначе ближайший срок) и явно укажи, какую выбрал.
+Дай практический ответ, а не сводку списком.
+Русский язык, без emoji.
+"""
+_FINAL_TASK_DETAIL = """Дай конкретный ответ по этой задаче:
+1. Если пользователь спрашивает «как выполнить» — дай пошаговый план.
+2. Учитывай статус, приоритет, срок и описание.
+3. Если данных мало — сформулируй короткие уточняющие вопросы.
+4. Не делай общую сводку всех задач.
+Русский язык, без emoji.
+"""
+
+# execution_context только читается — общий пустой read-only вместо копии на каждый ход
+_EMPTY_CONTEXT: Mapping[str, Any] = types.MappingProxyType({})
+
+# Префикс детерминированного JSON task board в ответах ассистента (парсится UI)
+_TASK_PAYLOAD_MARKER = "WEU_TASKS_JSON:"
+
+# Метки ролей в компактной истории промпта
+_ROLE_UPPER = {"user": "USER", "assistant": "ASSISTANT", "system": "SYSTEM", "tool": "TOOL"}
+
+# Распознавание запросов к списку задач (компилируются один раз)
+_MORE_TASKS_RE = re.compile(r"\b(еще|ещё|дальше|следующ|another|more)\b")
+_TASK_LIST_RE = re.compile(
+    r"сводк|\bкакие\b|покажи|список|активн(ые|ых)?|просроч|срок(и|ах)?|дедлайн|есть задачи|что по задачам"
+)
+
 
 class ChatMode(BaseMode):
     """
@@ -37,6 +85,10 @@ class ChatMode(BaseMode):
     - Оптимизирован для простых запросов
     """
 
+    # Склеенные правила + инструменты + формат ответа; пересобираются, когда ToolManager отдаёт новую строку
+    _preamble_tools: str = None
+    _preamble: str = ""
+
     @property
     def description(self) -> str:
         return "Простой чат с инструментами (без ReAct loop)"
@@ -54,19 +106,29 @@ class ChatMode(BaseMode):
         """
         Выполнение в простом режиме чата
         """
-        effective_history = list(initial_history) if initial_history else list(self.orchestrator.history)
+        # RAG запускается сразу и идёт параллельно с разбором истории; ждём его перед промптом
+        rag_task = None
+        if use_rag and self.orchestrator.rag.available and user_id is not None:
+            rag_task = asyncio.create_task(
+                self._run_blocking(self.orchestrator.rag.query, message, 2, user_id)
+            )
+            # Если результат так и не понадобится (ранний выход, ошибка) — без "exception was never retrieved"
+            rag_task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+        # Limit history: последние сообщения источника + текущее; общая история — deque(maxlen)
+        effective_history = self._recent_history(
+            initial_history or self.orchestrator.history, HISTORY_MAX_MESSAGES - 1
+        )
         effective_history.append({"role": "user", "content": message})
         if not initial_history:
             self.orchestrator.history.append({"role": "user", "content": message})
 
-        # Limit history
-        if len(effective_history) > 10:
-            effective_history = effective_history[-10:]
-        if not initial_history and len(self.orchestrator.history) > 10:
-            self.orchestrator.history = self.orchestrator.history[-10:]
-
         # Follow-up "покажи ещё задачи" — детерминированная пагинация из последнего task payload
-        followup_payload = self._extract_last_task_payload(effective_history[:-1])
+        # Своя история — payload запомнен при записи; переданная извне (из БД) — ищем в ней
+        if initial_history:
+            followup_payload = self._extract_last_task_payload(effective_history[:-1])
+        else:
+            followup_payload = self.orchestrator.last_task_payload
         if self._is_more_tasks_request(message) and followup_payload:
             summary = followup_payload.get("summary") or {}
             source_tool = followup_payload.get("source_tool")
@@ -85,33 +147,29 @@ class ChatMode(BaseMode):
                     query_params["limit"] = int(summary.get("limit") or 20)
                 except (TypeError, ValueError):
                     query_params["limit"] = 20
-                ctx = (execution_context or {}).copy()
-                tool_context = {"user_id": ctx.get("user_id")} if ctx.get("user_id") else None
+                ctx_user_id = (execution_context or _EMPTY_CONTEXT).get("user_id")
+                tool_context = {"user_id": ctx_user_id} if ctx_user_id else None
                 if tool_context:
                     result = await self.orchestrator.tool_manager.execute_tool(
                         "tasks_list", _context=tool_context, **query_params
                     )
-                    result_str = self.orchestrator._format_tool_result(result)
-                    task_payload = build_task_board_payload("tasks_list", result_str, query=message)
+                    task_payload = build_task_board_payload("tasks_list", result, query=message)
                     if task_payload:
-                        final_response = "WEU_TASKS_JSON:" + json.dumps(
-                            task_payload,
-                            ensure_ascii=False,
-                            separators=(",", ":"),
-                        )
+                        if rag_task is not None:
+                            rag_task.cancel()
+                        final_response = _TASK_PAYLOAD_MARKER + fast_json.dumps(task_payload)
                         yield final_response
                         effective_history.append({"role": "assistant", "content": final_response})
                         if not initial_history:
                             self.orchestrator.history.append({"role": "assistant", "content": final_response})
+                            self.orchestrator.last_task_payload = task_payload
                         return
 
         # RAG context (опционально)
         rag_context = ""
-        if use_rag and self.orchestrator.rag.available and user_id is not None:
+        if rag_task is not None:
             try:
-                results = await asyncio.to_thread(
-                    self.orchestrator.rag.query, message, 2, user_id
-                )
+                results = await rag_task
                 if results.get('documents') and results['documents'][0]:
                     docs = results['documents'][0]
                     if docs:
@@ -127,77 +185,99 @@ class ChatMode(BaseMode):
             execution_context=execution_context,
         )
 
-        # Первый запрос к LLM
-        llm_response = ""
+        # Первый запрос к LLM: текст стримится сразу, пока в нём не встретился маркер ACTION:.
+        # Хвост короче маркера придерживается — маркер может быть разрезан между чанками;
+        # текст перед найденным маркером отдаётся целиком.
+        llm_response_parts = []
+        pending = ""
+        emitted = 0
+        action_seen = False
         async for chunk in self.orchestrator.llm.stream_chat(
             system_prompt,
             model=model_preference,
             specific_model=specific_model
         ):
-            llm_response += chunk
+            llm_response_parts.append(chunk)
+            if action_seen:
+                continue
+            pending += chunk
+            marker_pos = pending.find(ACTION_MARKER)
+            if marker_pos >= 0:
+                action_seen = True
+                if marker_pos:
+                    emitted += marker_pos
+                    yield pending[:marker_pos]
+            elif len(pending) > ACTION_HOLDBACK:
+                emitted += len(pending) - ACTION_HOLDBACK
+                yield pending[:-ACTION_HOLDBACK]
+                pending = pending[-ACTION_HOLDBACK:]
+        llm_response = "".join(llm_response_parts)
 
         # Проверяем нужен ли вызов инструмента
-        action_match = self.orchestrator._parse_action(llm_response)
+        action_match = self.orchestrator._parse_action(llm_response) if action_seen else None
 
         if action_match:
+            # Уже показанный текст перед ACTION: — отделяем от вывода инструмента и сохраняем в истории
+            preamble = llm_response[:emitted] + "\n\n" if emitted else ""
+            if preamble:
+                yield "\n\n"
             # Выполняем инструмент
             tool_name = action_match['tool']
             tool_args = action_match['args']
 
             try:
-                ctx = (execution_context or {}).copy()
-                tool_context = {"user_id": ctx.get("user_id")} if ctx.get("user_id") else None
-                if ctx.get("master_password") and tool_context:
-                    tool_context["master_password"] = ctx.get("master_password")
+                ctx = execution_context or _EMPTY_CONTEXT
+                ctx_user_id = ctx.get("user_id")
+                tool_context = {"user_id": ctx_user_id} if ctx_user_id else None
+                master_password = ctx.get("master_password")
+                if master_password and tool_context:
+                    tool_context["master_password"] = master_password
 
                 result = await self.orchestrator.tool_manager.execute_tool(
                     tool_name, _context=tool_context, **tool_args
                 )
 
-                result_str = self.orchestrator._format_tool_result(result)
-
                 # Для запросов-списков отдаём детерминированный JSON payload (для UI-парсинга карточек)
                 if tool_name == "tasks_list" and self._is_task_list_request(message):
-                    task_payload = build_task_board_payload(tool_name, result_str, query=message)
+                    task_payload = build_task_board_payload(tool_name, result, query=message)
                     if task_payload:
-                        final_response = "WEU_TASKS_JSON:" + json.dumps(
-                            task_payload,
-                            ensure_ascii=False,
-                            separators=(",", ":"),
-                        )
-                        yield final_response
+                        payload_line = _TASK_PAYLOAD_MARKER + fast_json.dumps(task_payload)
+                        yield payload_line
+                        final_response = preamble + payload_line
                         effective_history.append({"role": "assistant", "content": final_response})
                         if not initial_history:
                             self.orchestrator.history.append({"role": "assistant", "content": final_response})
+                            self.orchestrator.last_task_payload = task_payload
                         return
 
-                # Формируем финальный ответ с данными инструмента
+                # Формируем финальный ответ с данными инструмента (форматируем только здесь)
                 final_prompt = self._build_final_prompt(
                     user_message=message,
                     tool_name=tool_name,
-                    tool_result=result_str,
+                    tool_result=self.orchestrator._format_tool_result(result),
                     execution_context=execution_context,
                 )
 
-                final_response = ""
+                final_response_parts = []
                 async for chunk in self.orchestrator.llm.stream_chat(
                     final_prompt,
                     model=model_preference,
                     specific_model=specific_model
                 ):
-                    final_response += chunk
-
-                yield final_response
+                    final_response_parts.append(chunk)
+                    yield chunk
+                final_response = preamble + "".join(final_response_parts)
 
             except Exception as e:
                 error_msg = f"❌ Ошибка: {str(e)}"
                 yield error_msg
                 logger.error(f"Tool execution failed: {e}")
-                final_response = error_msg
+                final_response = preamble + error_msg
         else:
-            # Нет действия - просто отдаём ответ
+            # Нет действия (или ACTION не разобран) - ответ уже отдан потоком, дописываем остаток
             final_response = llm_response
-            yield final_response
+            if emitted < len(llm_response):
+                yield llm_response[emitted:]
 
         # Add to history
         effective_history.append({"role": "assistant", "content": final_response})
@@ -209,28 +289,14 @@ class ChatMode(BaseMode):
         text = (message or "").strip().lower()
         if not text:
             return False
-        return bool(
-            re.search(r"\b(еще|ещё|дальше|следующ|another|more)\b", text)
-        )
+        return _MORE_TASKS_RE.search(text) is not None
 
     @staticmethod
     def _is_task_list_request(message: str) -> bool:
         text = (message or "").strip().lower()
         if not text:
             return False
-        patterns = [
-            r"сводк",
-            r"\bкакие\b",
-            r"покажи",
-            r"список",
-            r"активн(ые|ых)?",
-            r"просроч",
-            r"срок(и|ах)?",
-            r"дедлайн",
-            r"есть задачи",
-            r"что по задачам",
-        ]
-        return any(re.search(p, text) for p in patterns)
+        return _TASK_LIST_RE.search(text) is not None
 
     @staticmethod
     def _extract_last_task_payload(history: List[Dict[str, str]]) -> Dict[str, Any]:
@@ -238,21 +304,22 @@ class ChatMode(BaseMode):
             if msg.get("role") != "assistant":
                 continue
             content = msg.get("content") or ""
-            if "WEU_TASKS_JSON:" not in content:
-                continue
-            for line in reversed(content.splitlines()):
-                line = line.strip()
-                if not line.startswith("WEU_TASKS_JSON:"):
-                    continue
-                raw = line[len("WEU_TASKS_JSON:"):].strip()
-                if not raw:
-                    continue
-                try:
-                    payload = json.loads(raw)
-                except json.JSONDecodeError:
-                    continue
-                if isinstance(payload, dict) and payload.get("type") == "task_board":
-                    return payload
+            # Маркер ищется с конца прямо в строке, без splitlines() всего сообщения
+            idx = content.rfind(_TASK_PAYLOAD_MARKER)
+            while idx != -1:
+                line_start = content.rfind("\n", 0, idx) + 1
+                # Маркер должен начинать строку (допускаются пробелы перед ним)
+                if not content[line_start:idx].strip():
+                    end = content.find("\n", idx)
+                    raw = content[idx + len(_TASK_PAYLOAD_MARKER):end if end != -1 else None].strip()
+                    if raw:
+                        try:
+                            payload = fast_json.loads(raw)
+                        except json.JSONDecodeError:
+                            payload = None
+                        if isinstance(payload, dict) and payload.get("type") == "task_board":
+                            return payload
+                idx = content.rfind(_TASK_PAYLOAD_MARKER, 0, idx)
         return {}
 
     def _build_chat_prompt(
@@ -267,14 +334,17 @@ class ChatMode(BaseMode):
         # История (компактная)
         history_text = ""
         if len(history) > 1:
-            recent = history[-4:]  # Последние 4 сообщения
+            # Последние 4 сообщения без текущего — одним срезом
             history_text = "\n".join([
-                f"{msg['role'].upper()}: {msg['content'][:150]}"
-                for msg in recent[:-1]
+                f"{_ROLE_UPPER.get(msg['role']) or msg['role'].upper()}: {msg['content'][:150]}"
+                for msg in history[-4:-1]
             ])
 
-        # Инструменты
+        # Инструменты: ToolManager кэширует строку, поэтому сравнение по identity
         tools_description = self.orchestrator.tool_manager.get_tools_description()
+        if tools_description is not self._preamble_tools:
+            self._preamble = f"{_CHAT_PROMPT_HEAD}{tools_description}\n\n{_CHAT_PROMPT_FORMAT}"
+            self._preamble_tools = tools_description
 
         # Контекст пользователя
         user_ctx = ""
@@ -296,27 +366,19 @@ class ChatMode(BaseMode):
                     "Не делай сводку всех задач, если не просили список."
                 )
 
-        prompt = f"""Ты WEU Assistant — умный помощник в чате.
-{CHAT_SYSTEM_RULES}
-
-ДОСТУПНЫЕ ИНСТРУМЕНТЫ:
-{tools_description}
-
-{f"КОНТЕКСТ: {user_ctx}" if user_ctx else ""}
-{f"КОНТЕКСТ ЗАДАЧИ: {task_ctx}" if task_ctx else ""}
-{f"SKILLS КОНТЕКСТ: {skill_ctx}" if skill_ctx else ""}
-{f"ИСТОРИЯ: {history_text}" if history_text else ""}
-{f"БАЗА ЗНАНИЙ: {rag_context}" if rag_context else ""}
-
-ФОРМАТ ОТВЕТА:
-- Если нужны данные, напиши ОДНУ строку:
-ACTION: tool_name {{"param": "value"}}
-- Если данные не нужны, сразу отвечай пользователю.
-
-ЗАПРОС: {user_message}
-
-Твой ответ:"""
-        return prompt
+        # Части собираются одним join; пустые секции контекста пропускаются
+        parts = [self._preamble]
+        for label, value in (
+            ("КОНТЕКСТ: ", user_ctx),
+            ("КОНТЕКСТ ЗАДАЧИ: ", task_ctx),
+            ("SKILLS КОНТЕКСТ: ", skill_ctx),
+            ("ИСТОРИЯ: ", history_text),
+            ("БАЗА ЗНАНИЙ: ", rag_context),
+        ):
+            if value:
+                parts += [label, value, "\n"]
+        parts += ["\nЗАПРОС: ", user_message, "\n\nТвой ответ:"]
+        return "".join(parts)
 
     def _build_final_prompt(
         self,
@@ -327,50 +389,21 @@ ACTION: tool_name {{"param": "value"}}
     ) -> str:
         """Построить финальный промпт с данными инструмента"""
 
+        # Шапка и инструкции (константы) — до запроса и данных, чтобы префикс не менялся
         if tool_name == "tasks_list":
             if self._is_task_list_request(user_message):
-                return f"""Ты получил данные от инструмента tasks_list.
-
-ЗАПРОС: {user_message}
-JSON:
-{tool_result}
-
-Сделай краткую сводку:
-1. Первая строка: «Сводка: всего N задач (активных: X, завершённых: Y)».
-2. Затем блоки по статусам (TODO, IN_PROGRESS, BLOCKED, DONE, CANCELLED) только если там есть задачи.
-3. В каждой строке задачи: название, приоритет, исполнитель, срок.
-4. Русский язык, без emoji, без выдумок.
-"""
-            return f"""Ты получил данные от инструмента tasks_list.
-
-ЗАПРОС: {user_message}
-JSON:
-{tool_result}
-
-Ответь по сути вопроса пользователя, используя данные задач.
-Если задач несколько и запрос про одну задачу неочевиден — выбери самую релевантную (обычно IN_PROGRESS, иначе ближайший срок) и явно укажи, какую выбрал.
-Дай практический ответ, а не сводку списком.
-Русский язык, без emoji.
-"""
-
-        if tool_name == "task_detail":
-            return f"""Ты получил данные от инструмента task_detail.
-
-ЗАПРОС: {user_message}
-JSON:
-{tool_result}
-
-Дай конкретный ответ по этой задаче:
-1. Если пользователь спрашивает «как выполнить» — дай пошаговый план.
-2. Учитывай статус, приоритет, срок и описание.
-3. Если данных мало — сформулируй короткие уточняющие вопросы.
-4. Не делай общую сводку всех задач.
-Русский язык, без emoji.
-"""
-
-        return f"""Ты получил данные от инструмента {tool_name}. Отформатируй их для пользователя на русском.
-
-ЗАПРОС: {user_message}
-ДАННЫЕ:
-{tool_result}
-"""
+                instructions = _FINAL_TASKS_SUMMARY
+            else:
+                instructions = _FINAL_TASKS_ANSWER
+        elif tool_name == "task_detail":
+            instructions = _FINAL_TASK_DETAIL
+        else:
+            return "".join((
+                "Ты получил данные от инструмента ", tool_name,
+                ". Отформатируй их для пользователя на русском.\n\nЗАПРОС: ", user_message,
+                "\nДАННЫЕ:\n", tool_result, "\n",
+            ))
+        return "".join((
+            "Ты получил данные от инструмента ", tool_name, ".\n\n", instructions,
+            "\nЗАПРОС: ", user_message, "\nJSON:\n", tool_result, "\n",
+        ))
@@ -1,13 +1,18 @@
 """
 Ralph Internal Mode - итеративный самосовершенствующийся агент (внутри Python)
 """
-import asyncio
 import re
-from typing import AsyncGenerator, List, Dict, Any, Optional
+from collections import deque
+from typing import AsyncGenerator, Deque, List, Dict, Any, Optional
 from loguru import logger
 from app.core.modes.base import BaseMode
 from app.core.model_config import model_manager
 
+_PROMISE_RE = re.compile(r"<promise>(.*?)</promise>", re.DOTALL | re.IGNORECASE)
+_WS_RE = re.compile(r"\s+")
+# Сколько последних итераций попадает в итоговый ответ (промпт использует только последнюю)
+RALPH_KEEP_ITERATIONS = 3
+
 
 class RalphInternalMode(BaseMode):
     """
@@ -49,21 +54,22 @@ class RalphInternalMode(BaseMode):
         rag_context = ""
         if use_rag and self.orchestrator.rag.available and user_id is not None:
             try:
-                results = await asyncio.to_thread(
+                results = await self._run_blocking(
                     self.orchestrator.rag.query, message, 3, user_id
                 )
                 if results.get('documents') and results['documents'][0]:
                     docs = results['documents'][0]
                     if docs:
-                        rag_context = "\n".join([f"📚 {doc}" for doc in docs])
+                        rag_context = "📚 " + "\n📚 ".join(docs)
             except Exception as e:
                 logger.warning(f"RAG query failed: {e}")
         
         # Iterative loop
         iteration = 0
-        all_results = []
+        all_results: Deque[str] = deque(maxlen=RALPH_KEEP_ITERATIONS)
         last_result = ""
         completion_promise = (completion_promise or "").strip()
+        promise_target = _WS_RE.sub(" ", completion_promise)
         stuck_guidance = (
             "Если задача заблокирована, явно опиши блокеры и что нужно для прогресса. "
             "Не выводи completion promise, если работа не завершена."
@@ -75,61 +81,57 @@ class RalphInternalMode(BaseMode):
             if skill_context
             else ""
         )
+        # Инварианты цикла: правила promise и обрамление continue-промпта
+        promise_rules = (
+            f"When you complete the task, output exactly: <promise>{completion_promise}</promise>\n"
+            "CRITICAL RULE: Do NOT output the promise unless it is completely and unequivocally TRUE.\n"
+            "If requirements are unclear, list 1-3 clarifying questions before proceeding and state your assumptions.\n"
+            f"{stuck_guidance}\n\n"
+        )
+        continue_head = f"\n\nOriginal Task: {message}\n\nPrevious Results:\n"
+        continue_tail = (
+            f"\n{skill_block}\n\n"
+            "Review your previous work, identify what needs improvement, and continue.\n"
+            f"{promise_rules}Continue:"
+        )
         
         while iteration < max_iterations:
             iteration += 1
             logger.info(f"Ralph iteration {iteration}/{max_iterations}")
             
-            # Build prompt for this iteration
+            # Build prompt for this iteration (неизменные части собраны до цикла)
             if iteration == 1:
-                prompt = f"""You are working on the following task. Work on it step by step.
-
-Task: {message}
-
-{rag_context if rag_context else ""}
-{skill_block}
-
-When you complete the task, output exactly: <promise>{completion_promise}</promise>
-CRITICAL RULE: Do NOT output the promise unless it is completely and unequivocally TRUE.
-If requirements are unclear, list 1-3 clarifying questions before proceeding and state your assumptions.
-{stuck_guidance}
-
-Begin working:"""
+                prompt = (
+                    "You are working on the following task. Work on it step by step.\n\n"
+                    f"Task: {message}\n\n{rag_context}\n{skill_block}\n\n{promise_rules}Begin working:"
+                )
             else:
                 # Include previous results for context
-                prompt = f"""Continue working on this task. You've completed {iteration - 1} iteration(s).
-
-Original Task: {message}
-
-Previous Results:
-{last_result}
-{skill_block}
-
-Review your previous work, identify what needs improvement, and continue.
-When you complete the task, output exactly: <promise>{completion_promise}</promise>
-CRITICAL RULE: Do NOT output the promise unless it is completely and unequivocally TRUE.
-If requirements are unclear, list 1-3 clarifying questions before proceeding and state your assumptions.
-{stuck_guidance}
-
-Continue:"""
+                prompt = "".join((
+                    f"Continue working on this task. You've completed {iteration - 1} iteration(s).",
+                    continue_head,
+                    last_result,
+                    continue_tail,
+                ))
             
             # Execute iteration
-            iteration_result = ""
+            iteration_result_parts = []
             async for chunk in self.orchestrator.llm.stream_chat(
                 prompt, 
                 model=model_preference, 
                 specific_model=specific_model
             ):
-                iteration_result += chunk
+                iteration_result_parts.append(chunk)
                 # Stream to user
                 if iteration == 1:
                     yield chunk
+            iteration_result = "".join(iteration_result_parts)
             
             last_result = iteration_result
             all_results.append(f"**Iteration {iteration}:**\n{iteration_result}\n")
             
             # Check for completion
-            if completion_promise and self._has_completion_promise(iteration_result, completion_promise):
+            if completion_promise and self._matches_promise(iteration_result, promise_target):
                 logger.success(f"Ralph Internal completed at iteration {iteration}")
                 
                 # Add to history and RAG
@@ -139,7 +141,7 @@ Continue:"""
                 
                 if user_id is not None:
                     try:
-                        await asyncio.to_thread(
+                        await self._run_blocking(
                             self.orchestrator.rag.add_text,
                             f"Q: {message}\nA: {final_answer}",
                             "conversation",
@@ -175,9 +177,14 @@ Continue:"""
         Detect completion promise tag: <promise>TEXT</promise>.
         Must match exactly after whitespace normalization.
         """
-        match = re.search(r"<promise>(.*?)</promise>", output, re.DOTALL | re.IGNORECASE)
+        return RalphInternalMode._matches_promise(output, _WS_RE.sub(" ", promise.strip()))
+    
+    @staticmethod
+    def _matches_promise(output: str, target: str) -> bool:
+        """Сравнить тег <promise> с уже нормализованным target; без тега regex не запускается."""
+        if "<promise" not in output.lower():
+            return False
+        match = _PROMISE_RE.search(output)
         if not match:
             return False
-        extracted = re.sub(r"\s+", " ", match.group(1).strip())
-        target = re.sub(r"\s+", " ", promise.strip())
-        return extracted == target
+        return _WS_RE.sub(" ", match.group(1).strip()) == target
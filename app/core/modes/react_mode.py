@@ -1,14 +1,86 @@
 """
 ReAct Mode - текущий Orchestrator с ReAct loop
 """
-import os
 import asyncio
+import hashlib
+import os
 import re
-import json
-from typing import AsyncGenerator, List, Dict, Any, Optional
+import types
+from typing import AsyncGenerator, List, Dict, Any, Mapping, Optional
 from loguru import logger
-from app.core.modes.base import BaseMode
+from app.core.modes.base import ACTION_HOLDBACK, ACTION_MARKER, HISTORY_MAX_MESSAGES, BaseMode
 from app.core.task_board import build_task_board_payload
+from app.utils import fast_json
+
+# Номера задач #ID (не внутри уже готовой ссылки [#ID]) в ответах после инструментов задач
+_TASK_ID_RE = re.compile(r'(?<!\[)#(\d+)(?!\])')
+_TASK_LINK_TOOLS = frozenset({'tasks_list', 'task_detail'})
+# Незавершённый #ID в конце стримящегося текста — придерживается до следующего чанка
+_PARTIAL_TASK_ID_RE = re.compile(r'#\d*$')
+_ITERATION_LIMIT_NOTICE = "Достигнут лимит итераций. Вот что удалось выяснить:\n\n"
+# Последний ответ к этому моменту уже отстримлен — в поток уходит замыкающая пометка
+_ITERATION_LIMIT_STREAM_NOTE = "\n\n⚠️ Достигнут лимит итераций — ответ выше может быть неполным."
+# Самопроверка ответа (отдельный запрос к LLM) — только после изменяющих инструментов
+# и для развёрнутых ответов; для чтения/поиска риск ошибки не стоит лишнего round-trip
+_WRITE_TOOLS = frozenset({
+    'write_file', 'create_directory', 'delete_file',
+    'server_execute', 'ssh_execute',
+    'task_create', 'task_update', 'task_delete',
+})
+_VERIFY_MIN_ANSWER_LEN = 200
+_VERIFIED_OK = "VERIFIED: OK"
+
+_EMPTY_CONTEXT: Mapping[str, Any] = types.MappingProxyType({})
+# Ключи execution_context, которые передаются инструментам (master_password — только вместе с user_id)
+_TOOL_CONTEXT_KEYS = ("user_id", "workspace_path", "allowed_tools")
+
+# Ответы без вызова инструментов на перефразированные запросы (context['semantic_cache']=False отключает).
+# Ответы по данным инструментов не кэшируются: они отражают текущее состояние задач/серверов
+_answer_cache = None
+# Ход кэшируем, только если контекст не добавляет в промпт ничего, кроме RAG пользователя
+_CACHEABLE_CONTEXT_KEYS = frozenset({"user_id", "rag_enabled", "semantic_cache"})
+
+
+def _get_answer_cache():
+    """Кэш создаётся лениво: app.agents импортирует оркестратор, а тот — режимы"""
+    global _answer_cache
+    if _answer_cache is None:
+        from app.agents.semantic_cache import SemanticCache
+        _answer_cache = SemanticCache(capacity=1024, threshold=0.93, ttl_seconds=3600)
+    return _answer_cache
+
+
+def _workspace_relative_path(file_path: str, workspace_path: str) -> str:
+    """Путь для IDE_FILE_CHANGED: относительно workspace и с '/'; путь вне workspace — как есть"""
+    if os.path.isabs(file_path):
+        normalized = os.path.normpath(file_path)
+        prefix = os.path.normpath(workspace_path)
+        if not prefix.endswith(os.sep):
+            prefix += os.sep
+        if normalized.startswith(prefix):
+            file_path = normalized[len(prefix):]
+    return file_path.replace("\\", "/")
+
+
+def _make_task_link(m: re.Match) -> str:
+    task_id = m.group(1)
+    return f"**[#{task_id}](task:{task_id})**"
+
+
+def _stream_cut(pending: str) -> int:
+    """Сколько символов pending можно отдать: без хвоста под ACTION: и без незавершённого #ID"""
+    cut = len(pending) - ACTION_HOLDBACK
+    if cut <= 0:
+        return 0
+    partial = _PARTIAL_TASK_ID_RE.search(pending, 0, cut)
+    return partial.start() if partial else cut
+
+
+def _render_piece(piece: str, prev_char: str, link_ids: bool) -> str:
+    """Кусок стрима с #ID -> ссылками; prev_char — последний отданный символ (для проверки '[')"""
+    if not link_ids or "#" not in piece:
+        return piece
+    return _TASK_ID_RE.sub(_make_task_link, prev_char + piece)[len(prev_char):]
 
 
 class ReActMode(BaseMode):
@@ -39,28 +111,62 @@ class ReActMode(BaseMode):
         """
         Выполнение в ReAct режиме - копия логики из Orchestrator.process_user_message
         """
-        effective_history = list(initial_history) if initial_history else list(self.orchestrator.history)
-        effective_history.append({"role": "user", "content": message})
+        # RAG запускается сразу и идёт параллельно с эмбеддингом для кэша и разбором истории
+        rag_task = None
+        if use_rag and self.orchestrator.rag.available and user_id is not None:
+            rag_task = asyncio.create_task(
+                self._run_blocking(self.orchestrator.rag.query, message, 3, user_id)
+            )
+            # Если результат так и не понадобится (попадание в кэш) — без "exception was never retrieved"
+            rag_task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        
+        # Limit history: последние сообщения источника + текущее; общая история — deque(maxlen)
+        effective_history = self._recent_history(
+            initial_history or self.orchestrator.history, HISTORY_MAX_MESSAGES - 1
+        )
+        user_msg = {"role": "user", "content": message}
+        effective_history.append(user_msg)
         if not initial_history:
-            self.orchestrator.history.append({"role": "user", "content": message})
+            self.orchestrator.history.append(user_msg)
         
-        # Limit history
-        if len(effective_history) > 10:
-            effective_history = effective_history[-10:]
-        if not initial_history and len(self.orchestrator.history) > 10:
-            self.orchestrator.history = self.orchestrator.history[-10:]
+        # Семантический кэш: только ходы без переданной истории диалога и особого контекста
+        # (IDE, сервер, skills); на попадании не нужны ни RAG, ни LLM.
+        # Промпт зависит и от предыдущих сообщений — их отпечаток входит в bucket, иначе уточнение
+        # ("а для второго?") получило бы ответ из чужого разговора
+        ctx = execution_context or _EMPTY_CONTEXT  # только чтение
+        answer_cache = _get_answer_cache()
+        cache_bucket = None
+        cache_vector = None
+        if (
+            not initial_history
+            and ctx.get("semantic_cache", True)
+            and ctx.keys() <= _CACHEABLE_CONTEXT_KEYS
+            and answer_cache.available
+        ):
+            history_fingerprint = hashlib.sha1(
+                fast_json.dumps(effective_history[:-1]).encode("utf-8")
+            ).hexdigest() if len(effective_history) > 1 else ""
+            cache_bucket = f"{user_id}|{model_preference}|{specific_model}|{use_rag}|{history_fingerprint}"
+            cache_vector = await self._run_blocking(answer_cache.embed, message)
+            hit = answer_cache.lookup(cache_vector, cache_bucket)
+            if hit is not None:
+                cached_answer, similarity, _ = hit
+                logger.info(f"ReAct semantic cache hit (sim={similarity:.3f})")
+                if rag_task is not None:
+                    rag_task.cancel()
+                self.orchestrator.history.append({"role": "assistant", "content": cached_answer})
+                yield cached_answer
+                return
         
         # RAG context
         rag_context = ""
-        if use_rag and self.orchestrator.rag.available and user_id is not None:
+        if rag_task is not None:
             try:
-                results = await asyncio.to_thread(
-                    self.orchestrator.rag.query, message, 3, user_id
-                )
+                results = await rag_task
                 if results.get('documents') and results['documents'][0]:
                     docs = results['documents'][0]
                     if docs:
-                        rag_context = "\n".join([f"📚 {doc}" for doc in docs])
+                        rag_context = "📚 " + "\n📚 ".join(docs)
                         logger.info(f"Retrieved {len(docs)} documents from RAG")
             except Exception as e:
                 logger.warning(f"RAG query failed: {e}")
@@ -71,6 +177,13 @@ class ReActMode(BaseMode):
         max_iterations = 7  # Increased for better reasoning
         tool_calls_made = []  # Track tool usage
         task_board_payload: Optional[Dict[str, Any]] = None
+        link_ids = False  # после tasks_list/task_detail #ID в ответе превращаются в ссылки
+        
+        # Контекст инструментов одинаков для всех итераций
+        tool_context = {key: ctx[key] for key in _TOOL_CONTEXT_KEYS if ctx.get(key)}
+        if ctx.get("master_password") and "user_id" in tool_context:
+            tool_context["master_password"] = ctx["master_password"]
+        tool_context = tool_context or None
         
         while iteration < max_iterations:
             iteration += 1
@@ -85,45 +198,68 @@ class ReActMode(BaseMode):
                 execution_context=execution_context,
             )
             
-            # Get LLM response
-            llm_response = ""
-            async for chunk in self.orchestrator.llm.stream_chat(
+            # Get LLM response: текст до ACTION: стримится сразу (на каждой итерации),
+            # после маркера — только буфер; как только ACTION разобран, генерация закрывается
+            llm_response_parts = []
+            pending = ""
+            emitted = 0
+            prev_char = ""
+            action_seen = False
+            action_match = None
+            stream = self.orchestrator.llm.stream_chat(
                 system_prompt, 
                 model=model_preference,
                 specific_model=specific_model
-            ):
-                llm_response += chunk
+            )
+            try:
+                async for chunk in stream:
+                    llm_response_parts.append(chunk)
+                    if not action_seen:
+                        pending += chunk
+                        marker_pos = pending.find(ACTION_MARKER)
+                        if marker_pos < 0:
+                            cut = _stream_cut(pending)
+                            if cut:
+                                yield _render_piece(pending[:cut], prev_char, link_ids)
+                                emitted += cut
+                                prev_char = pending[cut - 1]
+                                pending = pending[cut:]
+                            continue
+                        action_seen = True
+                        if marker_pos:
+                            yield _render_piece(pending[:marker_pos], prev_char, link_ids)
+                            emitted += marker_pos
+                            prev_char = pending[marker_pos - 1]
+                    # JSON аргументов закрылся — дальнейшие токены не нужны
+                    if "}" in chunk:
+                        action_match = self.orchestrator._parse_action("".join(llm_response_parts))
+                        if action_match:
+                            break
+            finally:
+                await stream.aclose()
+            llm_response = "".join(llm_response_parts)
             
             # Parse response for actions
-            action_match = self.orchestrator._parse_action(llm_response)
+            if action_seen and action_match is None:
+                action_match = self.orchestrator._parse_action(llm_response)
             
             if action_match:
+                if emitted:
+                    yield "\n\n"
                 # Agent wants to use a tool
                 tool_name = action_match['tool']
                 tool_args = action_match['args']
                 
                 try:
-                    ctx = (execution_context or {}).copy()
-                    tool_context = {"user_id": ctx.get("user_id")} if ctx.get("user_id") else None
-                    if ctx.get("master_password") and tool_context:
-                        tool_context["master_password"] = ctx.get("master_password")
-                    if ctx.get("workspace_path") and tool_context:
-                        tool_context["workspace_path"] = ctx.get("workspace_path")
-                    elif ctx.get("workspace_path"):
-                        tool_context = {"workspace_path": ctx.get("workspace_path")}
-                    if ctx.get("allowed_tools"):
-                        if tool_context is None:
-                            tool_context = {}
-                        tool_context["allowed_tools"] = ctx.get("allowed_tools")
-                    
                     result = await self.orchestrator.tool_manager.execute_tool(
                         tool_name, _context=tool_context, **tool_args
                     )
 
                     result_str = self.orchestrator._format_tool_result(result)
 
-                    if tool_name in ("tasks_list", "task_detail"):
-                        payload = build_task_board_payload(tool_name, result_str, query=message)
+                    if tool_name in _TASK_LINK_TOOLS:
+                        link_ids = True
+                        payload = build_task_board_payload(tool_name, result, query=message)
                         if payload:
                             task_board_payload = payload
 
@@ -139,42 +275,19 @@ class ReActMode(BaseMode):
                         file_path = tool_args.get("path", "")
                         if file_path:
                             try:
-                                from pathlib import Path
-                                workspace_path_obj = Path(ctx.get("workspace_path"))
-                                if os.path.isabs(file_path):
-                                    try:
-                                        file_path_obj = Path(file_path)
-                                        if str(file_path_obj).startswith(str(workspace_path_obj)):
-                                            rel_path = str(file_path_obj.relative_to(workspace_path_obj))
-                                        else:
-                                            rel_path = file_path
-                                    except (ValueError, AttributeError):
-                                        rel_path = file_path
-                                else:
-                                    rel_path = file_path
-                                rel_path = rel_path.replace("\\", "/")
+                                rel_path = _workspace_relative_path(file_path, ctx["workspace_path"])
                                 yield f"IDE_FILE_CHANGED:{rel_path}\n"
                             except Exception as e:
                                 logger.debug(f"Could not compute relative path: {e}")
                     
-                    # Add to history
-                    effective_history.append({
-                        "role": "assistant",
-                        "content": f"ACTION: {tool_name} with {tool_args}"
-                    })
-                    effective_history.append({
-                        "role": "system",
-                        "content": f"OBSERVATION: {result_str}"
-                    })
+                    # Add to history (записи после добавления не меняются — один dict на оба списка)
+                    action_msg = {"role": "assistant", "content": f"ACTION: {tool_name} with {tool_args}"}
+                    obs_msg = {"role": "system", "content": f"OBSERVATION: {result_str}"}
+                    effective_history.append(action_msg)
+                    effective_history.append(obs_msg)
                     if not initial_history:
-                        self.orchestrator.history.append({
-                            "role": "assistant",
-                            "content": f"ACTION: {tool_name} with {tool_args}"
-                        })
-                        self.orchestrator.history.append({
-                            "role": "system",
-                            "content": f"OBSERVATION: {result_str}"
-                        })
+                        self.orchestrator.history.append(action_msg)
+                        self.orchestrator.history.append(obs_msg)
                     
                     continue
                     
@@ -183,29 +296,32 @@ class ReActMode(BaseMode):
                     yield f"{error_msg}\n\n"
                     logger.error(error_msg)
                     
-                    effective_history.append({
-                        "role": "system",
-                        "content": f"ERROR: {str(e)}"
-                    })
+                    error_entry = {"role": "system", "content": f"ERROR: {e}"}
+                    effective_history.append(error_entry)
                     if not initial_history:
-                        self.orchestrator.history.append({
-                            "role": "system",
-                            "content": f"ERROR: {str(e)}"
-                        })
+                        self.orchestrator.history.append(error_entry)
                     
                     # Stop early on tool failure to avoid noisy iterations
                     return
             else:
-                # No action - final answer
+                # No action - final answer (уже частично отдан потоком, дописываем остаток)
                 final_answer = llm_response
+                if emitted < len(llm_response):
+                    yield _render_piece(llm_response[emitted:], prev_char, link_ids)
                 break
         
+        if final_answer and not tool_calls_made:
+            answer_cache.store(cache_vector, final_answer, cache_bucket or "")
+        
         # If exhausted iterations without final answer
         if not final_answer:
-            final_answer = "Достигнут лимит итераций. Вот что удалось выяснить:\n\n" + llm_response
+            final_answer = _ITERATION_LIMIT_NOTICE + llm_response
+            yield _ITERATION_LIMIT_STREAM_NOTE
 
         # VERIFICATION STEP: Review final answer for accuracy
-        if tool_calls_made and final_answer and len(final_answer) > 50:
+        if len(final_answer) > _VERIFY_MIN_ANSWER_LEN and any(
+            t['tool'] in _WRITE_TOOLS for t in tool_calls_made
+        ):
             verification_prompt = f"""Проверь свой ответ на точность и полноту.
 
 ИСХОДНЫЙ ЗАПРОС: {message}
@@ -220,57 +336,46 @@ class ReActMode(BaseMode):
 2. Все данные из инструментов использованы?
 3. Нет ли противоречий или пропусков?
 
-Если ответ ПОЛНЫЙ и ТОЧНЫЙ - выведи: VERIFIED: OK
+Если ответ ПОЛНЫЙ и ТОЧНЫЙ - выведи: {_VERIFIED_OK}
 Если нужны улучшения - выведи: IMPROVE: [краткое описание]
 """
 
-            verification = ""
-            async for chunk in self.orchestrator.llm.stream_chat(
+            verification_parts = []
+            stream = self.orchestrator.llm.stream_chat(
                 verification_prompt,
                 model=model_preference,
                 specific_model=specific_model
-            ):
-                verification += chunk
+            )
+            try:
+                async for chunk in stream:
+                    verification_parts.append(chunk)
+                    # Вердикт OK получен — дальше генерировать нечего ("K" есть в чанке, завершившем маркер)
+                    if "K" in chunk and _VERIFIED_OK in "".join(verification_parts):
+                        break
+            finally:
+                await stream.aclose()
+            verification = "".join(verification_parts)
 
-            # If verification suggests improvements, note it
-            if "IMPROVE:" in verification:
-                logger.info(f"ReAct verification suggests improvements: {verification}")
+            # If verification suggests improvements, note it (маркер по промпту в конце ответа)
+            improve_at = verification.rfind("IMPROVE:")
+            if improve_at >= 0:
+                logger.info(f"ReAct verification suggests improvements: {verification[improve_at:]}")
                 # Could add another iteration here if needed
 
         # Add final answer to history
-        effective_history.append({"role": "assistant", "content": final_answer})
+        answer_msg = {"role": "assistant", "content": final_answer}
+        effective_history.append(answer_msg)
         if not initial_history:
-            self.orchestrator.history.append({"role": "assistant", "content": final_answer})
+            self.orchestrator.history.append(answer_msg)
         
-        # Add to RAG
-        if len(final_answer) > 100 and user_id is not None:
-            try:
-                await asyncio.to_thread(
-                    self.orchestrator.rag.add_text,
-                    f"Q: {message}\nA: {final_answer}",
-                    "conversation",
-                    user_id,
-                )
-            except Exception as e:
-                logger.warning(f"Failed to add to RAG: {e}")
+        # Add to RAG: в фоновую очередь, ответ не ждёт эмбеддинга и записи
+        if len(final_answer) > 100 and user_id is not None and self.orchestrator.rag.available:
+            self.orchestrator.queue_rag_write(f"Q: {message}\nA: {final_answer}", "conversation", user_id)
         
-        # Post-processing: конвертируем #ID в кликабельные ссылки
-        if tool_calls_made:
-            # Проверяем были ли вызовы tasks_list или task_detail
-            task_tools_used = any(t['tool'] in ('tasks_list', 'task_detail') for t in tool_calls_made)
-            if task_tools_used:
-                import re
-                def make_task_link(m):
-                    task_id = m.group(1)
-                    return f"**[#{task_id}](task:{task_id})**"
-                final_answer = re.sub(r'(?<!\[)#(\d+)(?!\])', make_task_link, final_answer)
-
+        # Ответ уже отдан потоком (#ID -> ссылки по ходу); в конце — только task board payload
         if task_board_payload:
-            payload_json = json.dumps(task_board_payload, ensure_ascii=False, separators=(",", ":"))
+            payload_json = fast_json.dumps(task_board_payload)
             if final_answer.strip():
-                final_answer = f"{final_answer.rstrip()}\n\nWEU_TASKS_JSON:{payload_json}"
+                yield f"\n\nWEU_TASKS_JSON:{payload_json}"
             else:
-                final_answer = f"WEU_TASKS_JSON:{payload_json}"
-
-        # Stream final answer
-        yield final_answer
+                yield f"WEU_TASKS_JSON:{payload_json}"
@@ -25,11 +25,14 @@ import asyncio
 import re
 import json
 import os
-from typing import AsyncGenerator, List, Dict, Any
+from collections import deque
+from itertools import islice
+from typing import AsyncGenerator, Deque, List, Dict, Any
 
 
 # Re-export AGENT_SYSTEM_RULES_RU from unified_orchestrator for backward compatibility
 from app.core.unified_orchestrator import AGENT_SYSTEM_RULES_RU
+from app.core.modes.base import HISTORY_MAX_MESSAGES, BaseMode
 
 
 class Orchestrator:
@@ -49,7 +52,7 @@ class Orchestrator:
         self.llm = LLMProvider()
         self.rag = RAGEngine()
         self.tool_manager = get_tool_manager()
-        self.history: List[Dict[str, str]] = []
+        self.history: Deque[Dict[str, str]] = deque(maxlen=HISTORY_MAX_MESSAGES)
         self.max_iterations = 5  # Max ReAct loop iterations
         
     async def initialize(self):
@@ -88,7 +91,10 @@ class Orchestrator:
         If initial_history is provided, it is used for context instead of self.history
         and self.history is not mutated (для поточных запросов с chat_id).
         """
-        effective_history = list(initial_history) if initial_history else list(self.history)
+        # Последние сообщения источника + текущее; self.history — deque(maxlen), обрезать не нужно
+        effective_history = BaseMode._recent_history(
+            initial_history or self.history, HISTORY_MAX_MESSAGES - 1
+        )
         effective_history.append({"role": "user", "content": message})
         if not initial_history:
             self.history.append({"role": "user", "content": message})
@@ -98,12 +104,6 @@ class Orchestrator:
             from app.core.model_config import model_manager
             model_preference = model_manager.config.default_provider
         
-        # Limit history to last 10 messages (for prompt)
-        if len(effective_history) > 10:
-            effective_history = effective_history[-10:]
-        if not initial_history and len(self.history) > 10:
-            self.history = self.history[-10:]
-        
         # Step 1: Retrieve RAG context (RAG.query — sync, вызываем в thread)
         rag_context = ""
         if use_rag and self.rag.available and user_id is not None:
@@ -114,7 +114,7 @@ class Orchestrator:
                 if results.get('documents') and results['documents'][0]:
                     docs = results['documents'][0]
                     if docs:
-                        rag_context = "\n".join([f"📚 {doc}" for doc in docs])
+                        rag_context = "📚 " + "\n📚 ".join(docs)
                         logger.info(f"Retrieved {len(docs)} documents from RAG")
             except Exception as e:
                 logger.warning(f"RAG query failed: {e}")
@@ -137,16 +137,16 @@ class Orchestrator:
             )
             
             # Get LLM response
-            llm_response = ""
+            llm_response_parts = []
             async for chunk in self.llm.stream_chat(
                 system_prompt, 
                 model=model_preference,
                 specific_model=specific_model
             ):
-                llm_response += chunk
-                # Stream thinking process to user (optional - can be disabled for cleaner UX)
-                if iteration == 1:  # Only show first iteration thinking
-                    yield chunk
+                llm_response_parts.append(chunk)
+                # Каждая итерация стримится сразу — финальный ответ не повторяется в конце
+                yield chunk
+            llm_response = "".join(llm_response_parts)
             
             # Parse response for actions
             action_match = self._parse_action(llm_response)
@@ -255,6 +255,8 @@ class Orchestrator:
         # If we exhausted iterations without final answer, use last response
         if not final_answer:
             final_answer = "Достигнут лимит итераций. Вот что удалось выяснить:\n\n" + llm_response
+            # Последний ответ уже отстримлен — пользователю уходит замыкающая пометка, а не заголовок
+            yield "\n\n⚠️ Достигнут лимит итераций — ответ выше может быть неполным."
         
         # Add final answer to history
         effective_history.append({"role": "assistant", "content": final_answer})
@@ -272,10 +274,6 @@ class Orchestrator:
                 )
             except Exception as e:
                 logger.warning(f"Failed to add to RAG: {e}")
-        
-        # If we already streamed the answer (iteration 1), don't stream again
-        if iteration > 1:
-            yield f"\n\n{final_answer}"
     
     def _build_system_prompt(
         self,
@@ -290,9 +288,8 @@ class Orchestrator:
 
         history_text = ""
         if len(history_source) > 1:
-            recent = history_source[-6:]
             history_lines = []
-            for msg in recent[:-1]:
+            for msg in islice(history_source, max(0, len(history_source) - 6), len(history_source) - 1):
                 content = msg['content']
                 # OBSERVATION (результаты инструментов) - больше лимит для полных данных
                 if msg['role'] == 'system' and content.startswith('OBSERVATION:'):
@@ -482,7 +479,7 @@ class Orchestrator:
     
     def clear_history(self):
         """Clear conversation history"""
-        self.history = []
+        self.history.clear()
         logger.info("Conversation history cleared")
     
     async def add_to_knowledge_base(self, text: str, source: str = "manual", user_id=None):
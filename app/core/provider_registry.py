@@ -3,6 +3,7 @@ Provider Registry - централизованное управление все
 """
 import os
 import shutil
+import threading
 from pathlib import Path
 from typing import Dict, List, Optional, Any
 from loguru import logger
@@ -246,11 +247,14 @@ class ProviderRegistry:
 
 # Global registry instance
 _provider_registry = None
+_provider_registry_lock = threading.Lock()
 
 
 def get_provider_registry() -> ProviderRegistry:
     """Get or create global provider registry instance"""
     global _provider_registry
     if _provider_registry is None:
-        _provider_registry = ProviderRegistry()
+        with _provider_registry_lock:
+            if _provider_registry is None:
+                _provider_registry = ProviderRegistry()
     return _provider_registry
@@ -4,6 +4,7 @@ Smart Task Router - автоматический выбор оптимально
 import asyncio
 import re
 import json
+import threading
 from typing import Dict, Any, Optional
 from loguru import logger
 from app.core.llm import LLMProvider
@@ -303,11 +304,14 @@ Return JSON ONLY (no markdown):
 
 # Global router instance
 _smart_router = None
+_smart_router_lock = threading.Lock()
 
 
 def get_smart_router() -> SmartTaskRouter:
     """Get or create global smart router instance"""
     global _smart_router
     if _smart_router is None:
-        _smart_router = SmartTaskRouter()
+        with _smart_router_lock:
+            if _smart_router is None:
+                _smart_router = SmartTaskRouter()
     return _smart_router
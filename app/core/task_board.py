@@ -5,16 +5,19 @@ import json
 from datetime import datetime, timezone
 from typing import Any, Dict, List, Optional
 
+from app.utils import fast_json
+
 
 STATUS_ORDER = ("TODO", "IN_PROGRESS", "BLOCKED", "DONE", "CANCELLED")
 
 
 def _parse_tool_payload(tool_result: Any) -> Optional[Dict[str, Any]]:
+    # Сырой результат инструмента (dict) используется как есть — без повторного json.loads
     if isinstance(tool_result, dict):
         return tool_result
     if isinstance(tool_result, str):
         try:
-            parsed = json.loads(tool_result)
+            parsed = fast_json.loads(tool_result)
         except json.JSONDecodeError:
             return None
         return parsed if isinstance(parsed, dict) else None
@@ -1,13 +1,26 @@
 """
 Unified Orchestrator - единый оркестратор с поддержкой нескольких режимов
 """
-from typing import AsyncGenerator, List, Dict, Any, Optional
+import asyncio
+import json
+import re
+from collections import deque
+from itertools import islice
+from typing import AsyncGenerator, Deque, List, Dict, Any, Optional, Tuple
 from loguru import logger
 from app.core.llm import LLMProvider
 from app.rag.engine import RAGEngine
 from app.tools.manager import get_tool_manager
 from app.core.model_config import model_manager
 from app.core.modes import ReActMode, RalphInternalMode, ChatMode
+from app.core.modes.base import HISTORY_MAX_MESSAGES, BaseMode
+
+# ACTION: tool_name {json} в ответе LLM (компилируется один раз, см. _parse_action)
+_ACTION_RE = re.compile(r'ACTION:\s*([\w\-.]+)\s*(\{.*?\})', re.DOTALL)
+
+# Фоновая запись диалогов в RAG (см. queue_rag_write): размер пакета add_texts и предел очереди
+RAG_WRITE_BATCH = 16
+RAG_WRITE_QUEUE_SIZE = 1024
 
 
 # Инструкции и ограничения агента: язык и безопасность
@@ -88,7 +101,12 @@ class UnifiedOrchestrator:
         self.llm = LLMProvider()
         self.rag = RAGEngine()
         self.tool_manager = get_tool_manager()
-        self.history: List[Dict[str, str]] = []
+        # Кольцевой буфер: старые сообщения вытесняются при append, без пересоздания списка
+        self.history: Deque[Dict[str, str]] = deque(maxlen=HISTORY_MAX_MESSAGES)
+        # Последний task board payload, отданный в self.history (для пагинации "ещё задачи")
+        self.last_task_payload: Optional[Dict[str, Any]] = None
+        # Очередь записей в RAG и её писатель — свои у каждого event loop
+        self._rag_writers: Dict[asyncio.AbstractEventLoop, Tuple[asyncio.Queue, asyncio.Task]] = {}
         
         # Инициализация режимов
         self._modes = {}
@@ -176,9 +194,9 @@ class UnifiedOrchestrator:
         
         history_text = ""
         if len(history_source) > 1:
-            recent = history_source[-6:]
+            # Последние 6 сообщений без текущего, без промежуточных копий истории
             history_lines = []
-            for msg in recent[:-1]:
+            for msg in islice(history_source, max(0, len(history_source) - 6), len(history_source) - 1):
                 content = msg['content']
                 # OBSERVATION (результаты инструментов) - больше лимит для полных данных
                 if msg['role'] == 'system' and content.startswith('OBSERVATION:'):
@@ -302,11 +320,10 @@ ACTION: tool_name {{"param1": "value1", "param2": "value2"}}
         Parse action from LLM response
         Returns: {"tool": "tool_name", "args": {dict}} or None
         """
-        import re
-        import json
-        
-        pattern = r'ACTION:\s*([\w\-.]+)\s*(\{.*?\})'
-        match = re.search(pattern, response, re.DOTALL)
+        # Большинство ответов без вызова инструмента — отсекаем без regex
+        if "ACTION:" not in response:
+            return None
+        match = _ACTION_RE.search(response)
         
         if match:
             tool_name = match.group(1)
@@ -323,8 +340,6 @@ ACTION: tool_name {{"param1": "value1", "param2": "value2"}}
     
     def _format_tool_result(self, result: Any) -> str:
         """Format tool execution result"""
-        import json
-        
         if isinstance(result, dict):
             return json.dumps(result, indent=2, ensure_ascii=False)
         elif isinstance(result, str):
@@ -338,9 +353,50 @@ ACTION: tool_name {{"param1": "value1", "param2": "value2"}}
     
     def clear_history(self):
         """Clear conversation history"""
-        self.history = []
+        self.history.clear()
+        self.last_task_payload = None
         logger.info("Conversation history cleared")
     
+    def queue_rag_write(self, text: str, source: str, user_id) -> bool:
+        """
+        Поставить запись в RAG в фоновую очередь текущего event loop.
+        Возвращает False, если очередь переполнена и запись отброшена.
+        """
+        loop = asyncio.get_running_loop()
+        writer = self._rag_writers.get(loop)
+        if writer is None:
+            for stale_loop in [key for key in self._rag_writers if key.is_closed()]:
+                del self._rag_writers[stale_loop]
+            queue: asyncio.Queue = asyncio.Queue(maxsize=RAG_WRITE_QUEUE_SIZE)
+            writer = self._rag_writers[loop] = (queue, loop.create_task(self._rag_writer(queue)))
+        try:
+            writer[0].put_nowait((text, source, user_id))
+        except asyncio.QueueFull:
+            logger.warning("RAG write queue is full, conversation record dropped")
+            return False
+        return True
+    
+    async def _rag_writer(self, queue: asyncio.Queue):
+        """Разбирает очередь пакетами до RAG_WRITE_BATCH записей — один add_texts на пакет"""
+        batch = []
+        try:
+            while True:
+                batch.append(await queue.get())
+                while len(batch) < RAG_WRITE_BATCH and not queue.empty():
+                    batch.append(queue.get_nowait())
+                pending, batch = batch, []
+                try:
+                    await BaseMode._run_blocking(self.rag.add_texts, pending)
+                except Exception as e:
+                    logger.warning(f"Failed to add to RAG: {e}")
+        except asyncio.CancelledError:
+            # Event loop закрывается — оставшиеся записи дописываем синхронно, чтобы не потерять
+            while not queue.empty():
+                batch.append(queue.get_nowait())
+            if batch:
+                self.rag.add_texts(batch)
+            raise
+    
     async def add_to_knowledge_base(self, text: str, source: str = "manual", user_id=None):
         """Add text to RAG knowledge base"""
         import asyncio
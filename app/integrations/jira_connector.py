@@ -2,6 +2,7 @@
 Jira Integration - автоматический импорт и синхронизация задач
 """
 import os
+import threading
 from typing import Dict, List, Any, Optional
 from loguru import logger
 from django.utils import timezone
@@ -411,11 +412,14 @@ class JiraConnector:
 
 # Global Jira connector instance
 _jira_connector = None
+_jira_connector_lock = threading.Lock()
 
 
 def get_jira_connector() -> JiraConnector:
     """Get or create global Jira connector instance"""
     global _jira_connector
     if _jira_connector is None:
-        _jira_connector = JiraConnector()
+        with _jira_connector_lock:
+            if _jira_connector is None:
+                _jira_connector = JiraConnector()
     return _jira_connector
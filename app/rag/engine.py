@@ -128,6 +128,41 @@ class RAGEngine:
             logger.error(f"Error adding to Qdrant: {e}")
             return None
 
+    def add_texts(self, records):
+        """
+        Пакетная запись [(text, source, user_id), ...]: один encode на пакет и один upsert на коллекцию.
+        Возвращает число сохранённых документов.
+        """
+        records = [record for record in records if record[2] is not None]
+        if not self.available or not records:
+            return 0
+        if self.use_inmemory:
+            return sum(
+                self.inmemory_rag.add_text(text, source, user_id=user_id) is not None
+                for text, source, user_id in records
+            )
+        try:
+            vectors = self.encoder.encode([text for text, _, _ in records])
+        except Exception as e:
+            logger.error(f"Error encoding RAG batch: {e}")
+            return 0
+        points_by_collection = {}
+        for (text, source, user_id), vector in zip(records, vectors, strict=True):
+            points_by_collection.setdefault(self._collection_for_user(user_id), []).append(
+                self._qdrant_models.PointStruct(
+                    id=str(uuid.uuid4()), vector=vector.tolist(), payload={"text": text, "source": source}
+                )
+            )
+        stored = 0
+        for coll, points in points_by_collection.items():
+            self._init_collection(coll)
+            try:
+                self.client.upsert(collection_name=coll, points=points)
+                stored += len(points)
+            except Exception as e:
+                logger.error(f"Error adding to Qdrant: {e}")
+        return stored
+
     def query(self, query_text: str, n_results: int = 3, user_id=None):
         if not self.available or user_id is None:
             return {"documents": [[]], "metadatas": [[]]}
@@ -161,7 +161,7 @@ class WorkflowService:
         parsed["script_file"] = str(file_path)
 
         with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(parsed, f, ensure_ascii=False, indent=2)
+            f.write(json.dumps(parsed, ensure_ascii=False, indent=2))
 
         # Save Ralph YAML if present
         if parsed.get("ralph_yml"):
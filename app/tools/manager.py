@@ -1,8 +1,9 @@
 """
 Tool Manager - Central registry for all agent tools
 """
-from typing import List, Dict, Any, Optional
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
 import os
+import threading
 from loguru import logger
 from app.tools.base import BaseTool
 from app.tools.ssh_tools import SSHConnectTool, SSHExecuteTool, SSHDisconnectTool
@@ -32,6 +33,8 @@ class ToolManager:
     
     def __init__(self):
         self.tools: Dict[str, BaseTool] = {}
+        # Описания инструментов для LLM по (exclude, include); сбрасываются в register_tool
+        self._desc_cache: Dict[Tuple[FrozenSet[str], Optional[FrozenSet[str]]], str] = {}
         self.mcp_client = MCPClient()
         self._mcp_tool_names = set()
         self.mcp_config, self.mcp_config_sources = load_mcp_config(settings.BASE_DIR)
@@ -72,6 +75,7 @@ class ToolManager:
         """Register a single tool"""
         name = tool._metadata.name
         self.tools[name] = tool
+        self._desc_cache.clear()
         logger.info(f"Registered tool: {name} (category: {tool._metadata.category})")
     
     async def connect_mcp_server_stdio(self, name: str, command: List[str]):
@@ -160,8 +164,12 @@ class ToolManager:
         include_tools: Optional[List[str]] = None,
     ) -> str:
         """Get formatted description of tools for the LLM. exclude_tools: skip these. include_tools: allow only these."""
-        exclude = set(exclude_tools or [])
-        include = set(include_tools or []) if include_tools else None
+        exclude = frozenset(exclude_tools or ())
+        include = frozenset(include_tools) if include_tools else None
+        cache_key = (exclude, include)
+        cached = self._desc_cache.get(cache_key)
+        if cached is not None:
+            return cached
         categories = {}
 
         for tool in self.tools.values():
@@ -174,19 +182,21 @@ class ToolManager:
                 categories[cat] = []
             categories[cat].append(tool)
         
-        description = "AVAILABLE TOOLS:\n\n"
+        parts = ["AVAILABLE TOOLS:\n\n"]
         
         for category, tools in sorted(categories.items()):
-            description += f"## {category.upper()}\n"
+            parts.append(f"## {category.upper()}\n")
             for tool in tools:
-                description += f"- **{tool._metadata.name}**: {tool._metadata.description}\n"
+                parts.append(f"- **{tool._metadata.name}**: {tool._metadata.description}\n")
                 if tool._metadata.parameters:
-                    description += "  Parameters:\n"
+                    parts.append("  Parameters:\n")
                     for param in tool._metadata.parameters:
                         req = "required" if param.required else "optional"
-                        description += f"    - {param.name} ({param.type}, {req}): {param.description}\n"
-            description += "\n"
+                        parts.append(f"    - {param.name} ({param.type}, {req}): {param.description}\n")
+            parts.append("\n")
         
+        description = "".join(parts)
+        self._desc_cache[cache_key] = description
         return description
     
     async def execute_tool(self, tool_name: str, _context: Optional[Dict[str, Any]] = None, **kwargs) -> Any:
@@ -214,11 +224,14 @@ class ToolManager:
 
 # Global tool manager instance
 _tool_manager = None
+_tool_manager_lock = threading.Lock()
 
 
 def get_tool_manager() -> ToolManager:
     """Get or create global tool manager instance"""
     global _tool_manager
     if _tool_manager is None:
-        _tool_manager = ToolManager()
+        with _tool_manager_lock:
+            if _tool_manager is None:
+                _tool_manager = ToolManager()
     return _tool_manager
@@ -0,0 +1,46 @@
+"""
+Закрытие ресурсов, привязанных к event loop (HTTP-сессии, клиенты SDK), при его остановке.
+
+asyncio.run() (и asgiref async_to_sync, который запускает loop через asyncio.run) перед закрытием
+loop вызывает shutdown_asyncgens(): незавершённые async-генераторы закрываются, их finally
+выполняется ещё на живом loop. Сторож-генератор на каждый loop использует это, чтобы закрыть
+соединения, пока это возможно: после loop.close() await на его транспортах уже не выполнить.
+"""
+import asyncio
+from typing import AsyncGenerator, Awaitable, Callable, Dict
+from loguru import logger
+
+ShutdownCallback = Callable[[], Awaitable[None]]
+
+_shutdown_callbacks: Dict[asyncio.AbstractEventLoop, Dict[str, ShutdownCallback]] = {}
+# Сильные ссылки на сторожей: loop хранит свои async-генераторы в WeakSet
+_guards: Dict[asyncio.AbstractEventLoop, AsyncGenerator[None, None]] = {}
+
+
+async def _guard(loop: asyncio.AbstractEventLoop) -> AsyncGenerator[None, None]:
+    try:
+        yield
+    finally:
+        _guards.pop(loop, None)
+        for name, callback in _shutdown_callbacks.pop(loop, {}).items():
+            try:
+                await callback()
+            except Exception as e:
+                logger.warning(f"Closing {name} on event loop shutdown failed: {e}")
+
+
+def on_loop_shutdown(name: str, callback: ShutdownCallback) -> None:
+    """
+    Выполнить await callback() при остановке текущего event loop.
+    Повторная регистрация с тем же name заменяет callback (один вызов на ресурс).
+    """
+    for stale_loop in [loop for loop in _guards if loop.is_closed()]:
+        # loop закрыт без shutdown_asyncgens (loop.close() вручную) — закрывать уже нечем
+        _guards.pop(stale_loop, None)
+        _shutdown_callbacks.pop(stale_loop, None)
+    loop = asyncio.get_running_loop()
+    _shutdown_callbacks.setdefault(loop, {})[name] = callback
+    if loop not in _guards:
+        guard = _guards[loop] = _guard(loop)
+        # Первый шаг регистрирует генератор в loop и доводит его до yield
+        asyncio.ensure_future(guard.__anext__())
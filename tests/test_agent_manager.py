@@ -0,0 +1,81 @@
+"""
+Tests for AgentManager concurrency limits (app.agents.manager).
+"""
+import asyncio
+
+from app.agents.base_agent import BaseAgent
+from app.agents.manager import AGENT_TYPE_CONCURRENCY, AgentManager
+
+
+class SlowAgent(BaseAgent):
+    """Считает максимальное число одновременных execute."""
+
+    def __init__(self, name):
+        super().__init__(name=name, description="test")
+        self.running = 0
+        self.peak = 0
+
+    async def execute(self, task, context=None):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        await asyncio.sleep(0.05)
+        self.running -= 1
+        return {'success': True, 'result': task, 'error': None, 'metadata': {}}
+
+
+def test_execute_agent_respects_per_type_limit():
+    manager = AgentManager()
+    agent = SlowAgent("Ralph Wiggum Agent")
+    manager.register_agent(agent)
+
+    async def scenario():
+        return await asyncio.gather(*(manager.execute_agent("ralph", f"t{i}") for i in range(6)))
+
+    results = asyncio.run(scenario())
+    assert [r['result'] for r in results] == [f"t{i}" for i in range(6)]
+    assert agent.peak == AGENT_TYPE_CONCURRENCY["ralph"]
+    assert manager.get_status()['active_count'] == 0
+    assert manager.get_status()['queued_count'] == 0
+
+
+def test_bypass_concurrency_skips_limits():
+    manager = AgentManager()
+    agent = SlowAgent("Ralph Wiggum Agent")
+    manager.register_agent(agent)
+
+    async def scenario():
+        await asyncio.gather(
+            *(manager.execute_agent("ralph", "t", {'bypass_concurrency': True}) for _ in range(4))
+        )
+
+    asyncio.run(scenario())
+    assert agent.peak == 4
+
+
+def test_list_agents_cache_invalidated_on_register():
+    manager = AgentManager()
+    before = manager.list_agents()
+    before[0]['name'] = 'mutated'
+    assert manager.list_agents()[0]['name'] != 'mutated'
+
+    manager.register_agent(SlowAgent("Extra Agent"))
+    names = [info['name'] for info in manager.list_agents()]
+    assert names[-1] == "Extra Agent"
+    assert len(names) == len(before) + 1
+    assert manager.get_agent_info("Extra Agent")['description'] == "test"
+    assert manager.get_agent_info("Missing Agent") is None
+
+
+def test_validate_context_shares_read_only_default():
+    agent = SlowAgent("Ctx Agent")
+    default = agent.validate_context(None)
+    assert default is agent.validate_context({})
+    assert default.get('use_rag') is True
+    try:
+        default['model'] = 'x'
+    except TypeError:
+        pass
+    else:
+        raise AssertionError("default context must be read-only")
+    passed = {'model': 'grok'}
+    assert agent.validate_context(passed) is passed
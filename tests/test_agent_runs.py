@@ -0,0 +1,49 @@
+"""
+Tests for background agent runs (agent_hub.views_legacy._execute_agent_run).
+"""
+import pytest
+from asgiref.sync import sync_to_async
+
+from agent_hub import views_legacy
+from agent_hub.models import AgentRun
+from app.agents.base_agent import BaseAgent
+from app.agents.manager import AgentManager
+
+
+class ChunkedAgent(BaseAgent):
+    """Стримит ответ по фрагментам; запоминает, что видно в БД до завершения."""
+
+    def __init__(self, run_id, chunks):
+        super().__init__(name="Simple Agent", description="test")
+        self.run_id = run_id
+        self.chunks = chunks
+        self.seen_while_running = None
+
+    async def execute(self, task, context=None):
+        raise AssertionError("internal runs must stream")
+
+    async def execute_stream(self, task, context=None):
+        for chunk in self.chunks:
+            yield {'type': 'chunk', 'data': chunk}
+        run = await sync_to_async(AgentRun.objects.get)(id=self.run_id)
+        self.seen_while_running = run.output_text
+        yield {'type': 'result', 'data': {
+            'success': True, 'result': "".join(self.chunks), 'error': None, 'metadata': {'agent_type': 'simple'}
+        }}
+
+
+@pytest.mark.django_db
+def test_internal_run_saves_partial_output_while_streaming(monkeypatch):
+    run = AgentRun.objects.create(runtime="internal", input_task="task")
+    chunks = [f"part{i} " for i in range(views_legacy._LOG_SAVE_BATCH_SIZE + 2)]
+    agent = ChunkedAgent(run.id, chunks)
+    manager = AgentManager()
+    manager.register_agent(agent)
+    monkeypatch.setattr(views_legacy, "get_agent_manager", lambda: manager)
+
+    views_legacy._execute_agent_run(run.id, "simple", "internal", "task", {})
+
+    assert agent.seen_while_running == "".join(chunks[:views_legacy._LOG_SAVE_BATCH_SIZE])
+    run.refresh_from_db()
+    assert run.status == "succeeded"
+    assert run.output_text == "".join(chunks)
@@ -1,4 +1,8 @@
+from collections import deque
+
+from app.core.modes.base import HISTORY_MAX_MESSAGES
 from app.core.modes.chat_mode import ChatMode
+from app.core.unified_orchestrator import UnifiedOrchestrator
 
 
 def test_extract_last_task_payload_from_history():
@@ -24,3 +28,318 @@ def test_task_list_request_detector():
     assert ChatMode._is_task_list_request("Дай краткую сводку по активным задачам")
     assert ChatMode._is_task_list_request("Какие просроченные задачи есть?")
     assert not ChatMode._is_task_list_request("Как выполнить эту задачу?")
+
+
+class _StubLLM:
+    def __init__(self):
+        self.prompts = []
+
+    async def stream_chat(self, prompt, model=None, specific_model=None):
+        self.prompts.append(prompt)
+        yield "ok"
+
+
+class _StubOrchestrator:
+    def __init__(self, history):
+        self.history = history
+        self.llm = _StubLLM()
+
+        class _Tools:
+            @staticmethod
+            def get_tools_description():
+                return "tools"
+
+        class _Rag:
+            available = False
+
+        self.tool_manager = _Tools()
+        self.rag = _Rag()
+        self.last_task_payload = None
+
+    @staticmethod
+    def _parse_action(text):
+        return None
+
+
+def test_execute_keeps_shared_history_bounded():
+    import asyncio
+
+    history = deque(
+        ({"role": "user", "content": f"m{i}"} for i in range(12)), maxlen=HISTORY_MAX_MESSAGES
+    )
+    orchestrator = _StubOrchestrator(history)
+    mode = ChatMode(orchestrator)
+
+    async def run():
+        return [chunk async for chunk in mode.execute("новый вопрос", use_rag=False)]
+
+    assert asyncio.run(run()) == ["ok"]
+    assert orchestrator.history is history
+    assert len(history) == HISTORY_MAX_MESSAGES
+    assert history[-2]["content"] == "новый вопрос"
+    assert history[-1] == {"role": "assistant", "content": "ok"}
+    # В промпт попали только последние сообщения, без вытесненных
+    prompt = orchestrator.llm.prompts[0]
+    assert "m2" not in prompt and "m11" in prompt
+
+
+def test_execute_streams_plain_answer_in_chunks():
+    import asyncio
+
+    orchestrator = _StubOrchestrator([])
+    chunks = ["Привет, ", "это обычный ", "ответ без ACT", "ION-маркера"]
+
+    async def stream_chat(prompt, model=None, specific_model=None):
+        for chunk in chunks:
+            yield chunk
+
+    orchestrator.llm.stream_chat = stream_chat
+    mode = ChatMode(orchestrator)
+
+    async def run():
+        return [chunk async for chunk in mode.execute("вопрос", use_rag=False)]
+
+    out = asyncio.run(run())
+    assert len(out) > 1
+    assert "".join(out) == "".join(chunks)
+    assert orchestrator.history[-1]["content"] == "".join(chunks)
+
+
+def test_execute_malformed_action_falls_back_to_full_text():
+    import asyncio
+
+    orchestrator = _StubOrchestrator([])
+    chunks = ["Сейчас проверю. AC", "TION: tasks_list {bad json", "} конец"]
+
+    async def stream_chat(prompt, model=None, specific_model=None):
+        for chunk in chunks:
+            yield chunk
+
+    orchestrator.llm.stream_chat = stream_chat
+    mode = ChatMode(orchestrator)
+
+    async def run():
+        return [chunk async for chunk in mode.execute("вопрос", use_rag=False)]
+
+    assert "".join(asyncio.run(run())) == "".join(chunks)
+
+
+def test_extract_last_task_payload_skips_invalid_and_inline_markers():
+    valid = '{"type":"task_board","summary":{"offset":0}}'
+    history = [
+        {"role": "assistant", "content": f"WEU_TASKS_JSON:{valid}\nтекст"},
+        {"role": "user", "content": f"WEU_TASKS_JSON:{valid}"},
+        {
+            "role": "assistant",
+            "content": 'см. WEU_TASKS_JSON:{"type":"task_board","inline":true}\n  WEU_TASKS_JSON:{broken',
+        },
+    ]
+    payload = ChatMode._extract_last_task_payload(history)
+    assert payload == {"type": "task_board", "summary": {"offset": 0}}
+    assert ChatMode._extract_last_task_payload([{"role": "assistant", "content": "WEU_TASKS_JSON:"}]) == {}
+
+
+def test_run_blocking_preserves_context_vars():
+    import asyncio
+    import contextvars
+
+    var = contextvars.ContextVar("request_id", default=None)
+
+    async def run():
+        plain = await ChatMode._run_blocking(lambda a, b: a + b, 2, 3)
+        var.set("req-1")
+        seen = await ChatMode._run_blocking(var.get)
+        return plain, seen
+
+    assert asyncio.run(run()) == (5, "req-1")
+
+
+def test_execute_uses_rag_started_before_prompt():
+    import asyncio
+
+    class _Rag:
+        available = True
+
+        def __init__(self):
+            self.calls = []
+
+        def query(self, text, k, user_id):
+            self.calls.append((text, k, user_id))
+            return {"documents": [["заметка из базы знаний"]]}
+
+    orchestrator = _StubOrchestrator([])
+    orchestrator.rag = _Rag()
+    mode = ChatMode(orchestrator)
+
+    async def run():
+        return [chunk async for chunk in mode.execute("вопрос", user_id=7)]
+
+    assert asyncio.run(run()) == ["ok"]
+    assert orchestrator.rag.calls == [("вопрос", 2, 7)]
+    assert "заметка из базы знаний" in orchestrator.llm.prompts[0]
+
+
+def test_build_chat_prompt_rebuilds_preamble_when_tools_change():
+    orchestrator = _StubOrchestrator([])
+    descriptions = iter(["TOOLS-A", "TOOLS-A", "TOOLS-B"])
+    orchestrator.tool_manager.get_tools_description = lambda: next(descriptions)
+    mode = ChatMode(orchestrator)
+    history = [{"role": "user", "content": "q"}]
+
+    first = mode._build_chat_prompt("q", "", history)
+    assert "TOOLS-A" in first
+    assert mode._build_chat_prompt("q", "", history) == first
+    assert "TOOLS-B" in mode._build_chat_prompt("q", "", history)
+
+
+def test_execute_more_tasks_uses_cached_payload():
+    import asyncio
+
+    calls = []
+
+    async def execute_tool(name, _context=None, **kwargs):
+        calls.append((name, _context, kwargs))
+        return {
+            "total_count": 21,
+            "has_more": False,
+            "offset": 20,
+            "limit": 20,
+            "tasks": [{"id": 21, "title": "Последняя", "status": "TODO", "priority": "LOW"}],
+        }
+
+    orchestrator = _StubOrchestrator(deque(maxlen=HISTORY_MAX_MESSAGES))
+    orchestrator.tool_manager.execute_tool = execute_tool
+    orchestrator._format_tool_result = str
+    orchestrator.last_task_payload = {
+        "source_tool": "tasks_list",
+        "summary": {"has_more": True, "offset": 0, "returned": 20, "limit": 20},
+        "query_params": {"status": "TODO"},
+    }
+    mode = ChatMode(orchestrator)
+
+    async def run():
+        return [
+            chunk
+            async for chunk in mode.execute(
+                "покажи еще", use_rag=False, execution_context={"user_id": 1}
+            )
+        ]
+
+    chunks = asyncio.run(run())
+    assert calls == [("tasks_list", {"user_id": 1}, {"status": "TODO", "offset": 20, "limit": 20})]
+    assert len(chunks) == 1 and chunks[0].startswith("WEU_TASKS_JSON:")
+    assert orchestrator.llm.prompts == []
+    assert orchestrator.last_task_payload["summary"]["offset"] == 20
+    assert orchestrator.history[-1]["content"] == chunks[0]
+
+
+def test_execute_streams_tool_answer_chunks():
+    import asyncio
+
+    class _ToolLLM:
+        def __init__(self):
+            self.prompts = []
+
+        async def stream_chat(self, prompt, model=None, specific_model=None):
+            self.prompts.append(prompt)
+            if len(self.prompts) == 1:
+                yield 'ACTION: web_search {"query": "x"}'
+            else:
+                for part in ("Найдено", ": ", "ответ"):
+                    yield part
+
+    async def execute_tool(name, _context=None, **kwargs):
+        return {"results": [kwargs["query"]]}
+
+    orchestrator = _StubOrchestrator([])
+    orchestrator.llm = _ToolLLM()
+    orchestrator.tool_manager.execute_tool = execute_tool
+    orchestrator._parse_action = lambda text: {"tool": "web_search", "args": {"query": "x"}}
+    orchestrator._format_tool_result = lambda result: f"RESULT={result}"
+    mode = ChatMode(orchestrator)
+
+    async def run():
+        return [chunk async for chunk in mode.execute("найди", use_rag=False)]
+
+    assert asyncio.run(run()) == ["Найдено", ": ", "ответ"]
+    assert "RESULT={'results': ['x']}" in orchestrator.llm.prompts[1]
+    assert orchestrator.history[-1] == {"role": "assistant", "content": "Найдено: ответ"}
+
+
+
+def _preamble_orchestrator(first_chunks, final_chunks, tool_result):
+    class _ToolLLM:
+        def __init__(self):
+            self.prompts = []
+
+        async def stream_chat(self, prompt, model=None, specific_model=None):
+            self.prompts.append(prompt)
+            for part in first_chunks if len(self.prompts) == 1 else final_chunks:
+                yield part
+
+    async def execute_tool(name, _context=None, **kwargs):
+        return tool_result
+
+    orchestrator = _StubOrchestrator(deque(maxlen=HISTORY_MAX_MESSAGES))
+    orchestrator.llm = _ToolLLM()
+    orchestrator.tool_manager.execute_tool = execute_tool
+    orchestrator._parse_action = UnifiedOrchestrator._parse_action.__get__(orchestrator)
+    orchestrator._format_tool_result = str
+    return orchestrator
+
+
+def test_execute_keeps_preamble_before_task_board_payload():
+    import asyncio
+
+    orchestrator = _preamble_orchestrator(
+        ["Сейчас посмотрю активные задачи. ", "ACTION: tasks_list {}"],
+        [],
+        {
+            "total_count": 1,
+            "has_more": False,
+            "offset": 0,
+            "limit": 20,
+            "tasks": [{"id": 7, "title": "Задача", "status": "TODO", "priority": "LOW"}],
+        },
+    )
+    mode = ChatMode(orchestrator)
+
+    async def run():
+        return [chunk async for chunk in mode.execute("Дай краткую сводку по активным задачам", use_rag=False)]
+
+    out = asyncio.run(run())
+    assert "".join(out[:-1]) == "Сейчас посмотрю активные задачи. \n\n"
+    assert out[-1].startswith("WEU_TASKS_JSON:")
+    assert orchestrator.history[-1]["content"] == "".join(out)
+    assert ChatMode._extract_last_task_payload(list(orchestrator.history)).get("type") == "task_board"
+
+
+def test_execute_separates_preamble_from_tool_answer():
+    import asyncio
+
+    orchestrator = _preamble_orchestrator(
+        ["Поищу в сети. ", 'ACTION: web_search {"query": "x"}'],
+        ["Найдено", ": ответ"],
+        {"results": ["x"]},
+    )
+    mode = ChatMode(orchestrator)
+
+    async def run():
+        return [chunk async for chunk in mode.execute("найди", use_rag=False)]
+
+    out = asyncio.run(run())
+    assert "".join(out) == "Поищу в сети. \n\nНайдено: ответ"
+    assert orchestrator.history[-1]["content"] == "".join(out)
+
+
+def test_chat_prompt_static_prefix_precedes_user_context():
+    mode = ChatMode(_StubOrchestrator([]))
+    history = [{"role": "user", "content": "q"}]
+
+    first = mode._build_chat_prompt("первый", "", history, {"user_id": 1})
+    second = mode._build_chat_prompt("второй", "rag", history, {"user_id": 2})
+
+    prefix = first[: first.index("КОНТЕКСТ: ")]
+    assert second.startswith(prefix)
+    assert prefix.endswith("- Если данные не нужны, сразу отвечай пользователю.\n\n")
+    assert second.endswith("\nЗАПРОС: второй\n\nТвой ответ:")
@@ -0,0 +1,193 @@
+"""
+Tests for CLI runtime helpers (app.agents.cli_runtime).
+
+Uses a tiny Python echo-process instead of real cursor/claude binaries.
+"""
+import asyncio
+import sys
+
+from app.agents.cli_runtime import CliRunResult, CliRuntimeManager
+
+
+def test_has_completion_promise_normalizes_whitespace():
+    assert CliRuntimeManager._has_completion_promise("done <promise> ALL  DONE </promise>", "ALL DONE")
+    assert not CliRuntimeManager._has_completion_promise("<promise>NOPE</promise>", "COMPLETE")
+    assert not CliRuntimeManager._has_completion_promise("no tag here", "COMPLETE")
+    assert CliRuntimeManager._has_completion_promise(b"x <PROMISE>COMPLETE</PROMISE>", "COMPLETE")
+    assert not CliRuntimeManager._has_completion_promise(b"no tag here", "COMPLETE")
+
+
+def test_run_result_decodes_lazily_and_supports_dict_access():
+    result = CliRunResult(success=True, meta={"exit_code": 0}, output_bytes=b"  hello \n")
+    assert result._output is None
+    assert result["output"] == "hello"
+    assert result.output is result._output
+    assert result.get("logs") == ""
+    assert result.get("missing", "default") == "default"
+    assert {**result}["meta"] == {"exit_code": 0}
+
+
+# Печатает argv; на --continue отвечает completion promise
+ARGV_SCRIPT = (
+    "import sys\n"
+    "print('ARGS:' + '|'.join(sys.argv[1:]))\n"
+    "if '--continue' in sys.argv:\n"
+    "    print('<promise>COMPLETE</promise>')\n"
+)
+
+
+def _argv_manager(**runtime_overrides):
+    manager = CliRuntimeManager()
+    manager.config = {
+        "fake": {
+            "command": sys.executable,
+            "args": ["-c", ARGV_SCRIPT],
+            "prompt_style": "positional",
+            "allowed_args": ["continue"],
+            **runtime_overrides,
+        }
+    }
+    return manager
+
+
+def test_ralph_loop_uses_continue_delta_when_supported():
+    manager = _argv_manager(supports_continue=True)
+    result = asyncio.run(
+        manager.run("fake", "Build the thing", {"use_ralph_loop": True, "max_iterations": 3, "completion_promise": "COMPLETE"})
+    )
+    assert result["meta"] == {"iterations": 2, "completed": True}
+    first, second = result["output"].split("\n\nIteration 2:\n")
+    assert "Build the thing" in first
+    assert "--continue" in second
+    assert "Build the thing" not in second
+
+
+def test_identical_one_shot_runs_are_served_from_cache():
+    from app.agents import cli_runtime
+
+    cli_runtime._response_cache.clear()
+    manager = _argv_manager(response_cache=True)
+    first = asyncio.run(manager.run("fake", "same task", {}))
+    second = asyncio.run(manager.run("fake", "same task", {}))
+    assert "cached" not in first["meta"]
+    assert second["meta"]["cached"] is True
+    assert second["output"] == first["output"]
+
+    # По умолчанию кэш выключен: CLI-агенты меняют файлы, повтор должен реально выполняться
+    uncached = _argv_manager()
+    third = asyncio.run(uncached.run("fake", "other task", {}))
+    fourth = asyncio.run(uncached.run("fake", "other task", {}))
+    assert "cached" not in third["meta"] and "cached" not in fourth["meta"]
+
+
+def test_failed_one_shot_runs_are_not_cached():
+    from app.agents import cli_runtime
+
+    cli_runtime._response_cache.clear()
+    manager = CliRuntimeManager()
+    manager.config = {
+        "failing": {
+            "command": sys.executable,
+            "args": ["-c", "import sys; print('partial'); sys.exit(3)"],
+            "prompt_style": "positional",
+            "response_cache": True,
+        }
+    }
+    first = asyncio.run(manager.run("failing", "task", {}))
+    second = asyncio.run(manager.run("failing", "task", {}))
+    assert first["meta"]["exit_code"] == 3
+    assert "cached" not in second["meta"]
+    assert cli_runtime._response_cache == {}
+
+
+def test_timeout_terminates_process():
+    manager = CliRuntimeManager()
+    manager.config = {
+        "slow": {
+            "command": sys.executable,
+            "args": ["-c", "import time; time.sleep(30)"],
+            "prompt_style": "positional",
+            "timeout_seconds": 0.5,
+            "response_cache": False,
+        }
+    }
+    result = asyncio.run(manager.run("slow", "task", {}))
+    assert result["success"] is False
+    assert result["meta"]["timeout"] is True
+
+
+def test_ralph_iteration_stops_as_soon_as_promise_is_printed():
+    manager = CliRuntimeManager()
+    manager.config = {
+        "early": {
+            "command": sys.executable,
+            "args": ["-c", "import time; print('<promise>COMPLETE</promise>', flush=True); time.sleep(30)"],
+            "prompt_style": "positional",
+            "timeout_seconds": 20,
+        }
+    }
+    result = asyncio.run(
+        manager.run("early", "task", {"use_ralph_loop": True, "max_iterations": 2, "completion_promise": "COMPLETE"})
+    )
+    assert result["meta"] == {"iterations": 1, "completed": True}
+    assert "<promise>COMPLETE</promise>" in result["output"]
+
+
+def test_independent_iterations_run_in_parallel_and_stop_on_promise():
+    manager = CliRuntimeManager()
+    manager.config = {
+        "parallel": {
+            "command": sys.executable,
+            "args": ["-c", "import time; time.sleep(0.3); print('<promise>COMPLETE</promise>')"],
+            "prompt_style": "positional",
+            "timeout_seconds": 20,
+        }
+    }
+    config = {
+        "use_ralph_loop": True,
+        "max_iterations": 8,
+        "completion_promise": "COMPLETE",
+        "loop_include_previous": False,
+        "ralph_concurrency": 4,
+    }
+    result = asyncio.run(manager.run("parallel", "task", config))
+    assert result["meta"]["completed"] is True
+    assert result["meta"]["parallel"] is True
+    assert 1 <= result["meta"]["iterations"] < 8
+
+
+def test_mcp_config_file_is_written_once_per_config():
+    from app.core import mcp_manager
+
+    mcp_config = {"fs": {"command": "npx", "args": ["server-filesystem"]}}
+    first = CliRuntimeManager._get_mcp_config_file(mcp_config)
+    second = CliRuntimeManager._get_mcp_config_file(dict(mcp_config))
+    try:
+        assert first and first == second
+    finally:
+        mcp_manager._cleanup_mcp_config_files()
+    assert not mcp_manager._created_config_files
+
+
+def test_uvloop_policy_is_installed_only_when_enabled(monkeypatch):
+    from types import SimpleNamespace
+
+    from django.conf import settings
+
+    from app.agents import cli_runtime
+
+    class FakeUvloopPolicy(asyncio.DefaultEventLoopPolicy):
+        pass
+
+    original_policy = asyncio.get_event_loop_policy()
+    monkeypatch.setattr(cli_runtime, "uvloop", SimpleNamespace(EventLoopPolicy=FakeUvloopPolicy))
+    try:
+        monkeypatch.setattr(settings, "USE_UVLOOP", False, raising=False)
+        assert not cli_runtime.install_uvloop_policy()
+        assert asyncio.get_event_loop_policy() is original_policy
+
+        monkeypatch.setattr(settings, "USE_UVLOOP", True, raising=False)
+        assert cli_runtime.install_uvloop_policy()
+        assert isinstance(asyncio.get_event_loop_policy(), FakeUvloopPolicy)
+    finally:
+        asyncio.set_event_loop_policy(original_policy)
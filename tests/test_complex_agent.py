@@ -0,0 +1,105 @@
+"""
+Tests for ComplexAgent plan execution (app.agents.complex_agent).
+"""
+import asyncio
+
+from app.agents.complex_agent import ComplexAgent
+
+
+class FakeLLMProvider:
+    """Отдаёт заранее заданные ответы и запоминает промпты."""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.prompts = []
+
+    async def stream_chat(self, prompt, model=None, specific_model=None):
+        self.prompts.append(prompt)
+        yield self.responses.pop(0) if self.responses else "ok"
+
+
+def test_build_waves_groups_independent_steps():
+    assert ComplexAgent._build_waves([[], [0], [], [1, 2]]) == [[0, 2], [1], [3]]
+    assert ComplexAgent._build_waves([[], [], []]) == [[0, 1, 2]]
+
+
+def test_infer_dependencies_falls_back_to_sequential():
+    agent = ComplexAgent()
+    agent._llm_provider = FakeLLMProvider(["not json at all"])
+    deps = asyncio.run(agent._infer_dependencies(["a", "b", "c"], "grok", None))
+    assert deps == [[], [0], [1]]
+
+
+def test_infer_dependencies_ignores_forward_references():
+    agent = ComplexAgent()
+    agent._llm_provider = FakeLLMProvider(["[[], [3], [1, 2]]"])
+    deps = asyncio.run(agent._infer_dependencies(["a", "b", "c"], "grok", None))
+    assert deps == [[], [], [0, 1]]
+
+
+def test_execute_plan_passes_dependency_results():
+    agent = ComplexAgent()
+    agent._llm_provider = FakeLLMProvider(["[[], [1]]", "first result", "second result"])
+    result = asyncio.run(
+        agent._execute_plan(["step A", "step B"], "task", "grok", None, use_rag=False, parallel_steps=True)
+    )
+    assert "**Step 1: step A**\nfirst result" in result
+    assert "**Step 2: step B**\nsecond result" in result
+    assert "Result of step 1:\nfirst result" in agent._llm_provider.prompts[-1]
+
+
+def test_execute_plan_skips_dependency_inference_by_default():
+    agent = ComplexAgent()
+    agent._llm_provider = FakeLLMProvider(["first result", "second result"])
+    result = asyncio.run(agent._execute_plan(["step A", "step B"], "task", "grok", None, use_rag=False))
+    assert len(agent._llm_provider.prompts) == 2
+    assert not any("Dependencies:" in prompt for prompt in agent._llm_provider.prompts)
+    assert "**Step 2: step B**\nsecond result" in result
+    assert agent._llm_provider.prompts[-1] == (
+        "Step 2 of 2: step B\n\nOriginal task: task\n\n"
+        "Execute this step. If you need to use tools, use them. Provide a clear result."
+    )
+
+
+class CountingRAG:
+    available = True
+
+    def __init__(self):
+        self.calls = 0
+
+    def query(self, text, n_results=3):
+        self.calls += 1
+        return {"documents": [["doc about " + text]]}
+
+
+def test_rag_context_is_cached_per_normalized_task():
+    from app.agents import base_agent
+
+    base_agent._rag_context_cache.clear()
+    agent = ComplexAgent()
+    agent._rag_engine = CountingRAG()
+    first = agent._get_rag_context("Deploy nginx")
+    second = agent._get_rag_context("  deploy NGINX ")
+    assert first == second == "📚 doc about Deploy nginx"
+    assert agent._rag_engine.calls == 1
+
+
+def test_extract_json_list_handles_brackets_inside_steps():
+    text = 'Here is the plan:\n["Check [nginx] config", "Reload service"]\nDone.'
+    assert ComplexAgent._extract_json_list(text) == ["Check [nginx] config", "Reload service"]
+    assert ComplexAgent._extract_json_list('Note [1]: see below\n["a", "b"]') == ["a", "b"]
+    assert ComplexAgent._extract_json_list("no json here") is None
+
+
+def test_rag_context_reuses_formatted_string_for_same_documents():
+    from app.agents import base_agent
+
+    base_agent._rag_context_cache.clear()
+    base_agent._rag_format_cache.clear()
+    agent = ComplexAgent()
+    agent._rag_engine = CountingRAG()
+    first = agent._get_rag_context("Check disk")
+    base_agent._rag_context_cache.clear()  # имитация истечения TTL
+    second = agent._get_rag_context("Check disk")
+    assert agent._rag_engine.calls == 2
+    assert second is first
@@ -0,0 +1,13 @@
+import json
+
+from app.utils import fast_json
+
+
+def test_dumps_is_compact_and_keeps_non_ascii():
+    payload = {"title": "Задача", "tags": [1, 2], "meta": {"ok": True}}
+
+    dumped = fast_json.dumps(payload)
+
+    assert dumped == json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+    assert fast_json.loads(dumped) == payload
+    assert fast_json.loads(fast_json.dumps_bytes(payload, indent=True)) == payload
@@ -0,0 +1,182 @@
+"""
+Tests for LLM provider helpers (app.core.llm).
+"""
+import asyncio
+
+from app.core import llm
+
+
+def test_grok_session_is_shared_within_event_loop():
+    async def scenario():
+        first = llm._get_grok_session()
+        second = llm._get_grok_session()
+        await llm.LLMProvider().aclose()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first is second
+    assert first.closed
+
+    other, _ = asyncio.run(scenario())
+    assert other is not first
+
+
+def test_grok_session_is_closed_when_its_event_loop_shuts_down():
+    async def scenario():
+        return llm._get_grok_session()
+
+    session = asyncio.run(scenario())
+    assert session.closed
+    assert session not in llm._grok_sessions.values()
+
+
+
+def test_gemini_client_is_shared_within_event_loop():
+    async def scenario():
+        first = llm._get_gemini_client_for_loop("test-key")
+        second = llm._get_gemini_client_for_loop("test-key")
+        other_key = llm._get_gemini_client_for_loop("other-key")
+        await llm.LLMProvider().aclose()
+        return first, second, other_key
+
+    first, second, other_key = asyncio.run(scenario())
+    assert first is second
+    assert other_key is not first
+    assert not llm._gemini_clients
+
+    next_loop, _, _ = asyncio.run(scenario())
+    assert next_loop is not first
+
+
+def test_gemini_clients_are_closed_when_their_event_loop_shuts_down():
+    closed = []
+
+    async def scenario():
+        client = llm._get_gemini_client_for_loop("test-key")
+        original = client.aio.aclose
+
+        async def aclose():
+            closed.append(client)
+            await original()
+
+        client.aio.aclose = aclose
+        return client
+
+    client = asyncio.run(scenario())
+    assert closed == [client]
+    assert not llm._gemini_clients
+
+
+class FakeContent:
+    def __init__(self, pieces):
+        self.pieces = pieces
+
+    async def iter_any(self):
+        for piece in self.pieces:
+            yield piece
+
+
+def test_iter_sse_data_splits_frames_across_reads():
+    content = FakeContent([b'data: {"a"', b': 1}\n\ndata: [DO', b"NE]\n", b": keep-alive\ndata: tail"])
+
+    async def collect():
+        return [payload async for payload in llm._iter_sse_data(content)]
+
+    assert asyncio.run(collect()) == [b'{"a": 1}', b"[DONE]", b"tail"]
+
+
+def test_iter_with_idle_times_out_only_on_stalled_gap():
+    async def slow_but_steady():
+        for i in range(4):
+            await asyncio.sleep(0.05)
+            yield i
+
+    async def stalls():
+        yield "first"
+        await asyncio.sleep(1)
+        yield "never"
+
+    async def collect(agen):
+        return [item async for item in llm._iter_with_idle(agen, 0.1)]
+
+    assert asyncio.run(collect(slow_but_steady())) == [0, 1, 2, 3]
+
+    received = []
+
+    async def consume_stalled():
+        async for item in llm._iter_with_idle(stalls(), 0.1):
+            received.append(item)
+
+    try:
+        asyncio.run(consume_stalled())
+    except asyncio.TimeoutError:
+        pass
+    else:
+        raise AssertionError("stalled stream did not time out")
+    assert received == ["first"]
+
+
+def test_retry_delay_uses_jitter_and_retry_after():
+    delays = {llm._retry_delay(2) for _ in range(20)}
+    assert all(0.5 <= d <= 4.0 for d in delays)
+    assert len(delays) > 1
+    assert llm._retry_delay(0, "3") == 3.0
+    assert llm._retry_delay(0, "9999") == llm.RETRY_AFTER_MAX
+    assert 0.5 <= llm._retry_delay(0, "Wed, 21 Oct 2015 07:28:00 GMT") <= 1.0
+
+
+def test_token_bucket_spaces_out_bursts():
+    bucket = llm.TokenBucket(rate=20, capacity=2)
+
+    async def burst():
+        start = asyncio.get_running_loop().time()
+        for _ in range(4):
+            await bucket.acquire()
+        return asyncio.get_running_loop().time() - start
+
+    # 2 токена сразу, ещё 2 — по 1/20 с
+    assert 0.08 <= asyncio.run(burst()) < 0.5
+
+
+def test_chat_model_cache_follows_config_updates():
+    from app.core.model_config import model_manager
+
+    provider = llm.LLMProvider()
+    original = model_manager.config.chat_model_grok
+    try:
+        assert provider._get_chat_model("grok") == original
+        model_manager.update_config(chat_model_grok="grok-test-model")
+        assert provider._get_chat_model("grok") == "grok-test-model"
+    finally:
+        model_manager.update_config(chat_model_grok=original)
+    assert provider._get_chat_model("grok") == original
+
+
+def test_stream_chat_dispatches_to_registered_provider():
+    provider = llm.LLMProvider()
+
+    async def echo(prompt, specific_model):
+        yield f"{specific_model}:{prompt}"
+
+    provider.register_provider("echo", echo)
+
+    async def collect(model):
+        return [chunk async for chunk in provider.stream_chat("hi", model=model, specific_model="m1")]
+
+    assert asyncio.run(collect("echo")) == ["m1:hi"]
+    assert asyncio.run(collect("nope")) == ["Unknown model: nope"]
+
+
+def test_is_retryable_error():
+    class StatusError(Exception):
+        def __init__(self, status_code):
+            super().__init__("")
+            self.status_code = status_code
+
+    assert llm._is_retryable_error(StatusError(429))
+    assert llm._is_retryable_error(StatusError(503))
+    assert not llm._is_retryable_error(StatusError(400))
+    assert llm._is_retryable_error(Exception("RESOURCE EXHAUSTED: quota"))
+    assert llm._is_retryable_error(Exception("HTTP 502 Bad Gateway"))
+    assert not llm._is_retryable_error(Exception("invalid api key"))
+    assert not llm._is_retryable_error(Exception())
@@ -0,0 +1,38 @@
+"""
+Tests for per-event-loop resource cleanup (app.utils.loop_resources).
+"""
+import asyncio
+
+from app.utils.loop_resources import on_loop_shutdown
+
+
+def test_callbacks_run_on_loop_shutdown_once_per_name():
+    closed = []
+
+    async def close(tag):
+        closed.append(tag)
+
+    async def scenario():
+        on_loop_shutdown("client", lambda: close("first"))
+        on_loop_shutdown("client", lambda: close("second"))
+        on_loop_shutdown("other", lambda: close("other"))
+        await asyncio.sleep(0)
+        assert closed == []
+
+    asyncio.run(scenario())
+    assert sorted(closed) == ["other", "second"]
+
+
+def test_callbacks_run_for_async_to_sync():
+    from asgiref.sync import async_to_sync
+
+    closed = []
+
+    async def scenario():
+        async def close():
+            closed.append(True)
+
+        on_loop_shutdown("client", close)
+
+    async_to_sync(scenario)()
+    assert closed == [True]
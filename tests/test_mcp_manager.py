@@ -0,0 +1,74 @@
+"""
+Tests for MCPManager config helpers (app.core.mcp_manager).
+"""
+import json
+import os
+
+from app.core.mcp_manager import MCPManager
+
+SERVERS = {
+    "fs": {"command": "npx", "args": ["-y", "server-fs"], "description": "Файлы", "allowed_tools": ["read_file"]},
+    "off": {"enabled": False, "command": "npx", "args": ["x"]},
+}
+
+
+def test_create_mcp_config_file_writes_enabled_servers():
+    path = MCPManager().create_mcp_config_file(SERVERS)
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+    finally:
+        os.remove(path)
+    assert data == {"mcpServers": {"fs": {"command": "npx", "args": ["-y", "server-fs"], "description": "Файлы"}}}
+
+
+def test_parse_results_are_cached_and_copied():
+    manager = MCPManager()
+    commands = manager.parse_mcp_servers(SERVERS)
+    assert commands == ["claude mcp add fs npx -y server-fs"]
+    commands.append("mutated")
+    assert manager.parse_mcp_servers(SERVERS) == ["claude mcp add fs npx -y server-fs"]
+    assert manager.get_allowed_tools(SERVERS) == ["fs_read_file"]
+    assert manager.validate_mcp_config(SERVERS) == {'valid': True, 'errors': []}
+    assert len(manager._parse_cache) == 1
+
+    manager.invalidate_cache()
+    assert not manager._parse_cache
+    assert manager.validate_mcp_config({"bad": {"type": "ws"}})['errors'] == [
+        "Server 'bad': missing 'command'",
+        "Server 'bad': invalid type 'ws'",
+    ]
+
+
+def test_default_mcp_servers_copy_and_view():
+    manager = MCPManager()
+    servers = manager.get_default_mcp_servers()
+    servers["filesystem"]["enabled"] = True
+    assert manager.get_default_mcp_servers()["filesystem"]["enabled"] is False
+
+    view = manager.get_default_mcp_servers(mutable=False)
+    assert view is manager.get_default_mcp_servers(mutable=False)
+    assert set(view) == {"filesystem", "github", "postgres"}
+
+
+def test_get_mcp_manager_returns_single_instance_across_threads():
+    from concurrent.futures import ThreadPoolExecutor
+    from app.core import mcp_manager
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        instances = list(pool.map(lambda _: mcp_manager.get_mcp_manager(), range(32)))
+    assert all(instance is instances[0] for instance in instances)
+
+
+def test_config_file_rewritten_after_removal():
+    from app.core import mcp_manager
+
+    manager = MCPManager()
+    first = manager.create_mcp_config_file(SERVERS)
+    assert manager.create_mcp_config_file(dict(SERVERS)) == first
+    os.remove(first)
+    second = manager.create_mcp_config_file(SERVERS)
+    try:
+        assert second and os.path.exists(second)
+    finally:
+        mcp_manager._cleanup_mcp_config_files()
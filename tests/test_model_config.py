@@ -0,0 +1,77 @@
+"""
+Tests for ModelManager (app.core.model_config).
+"""
+import asyncio
+
+from app.core.model_config import ModelManager
+
+
+def test_http_client_is_reused_within_event_loop():
+    manager = ModelManager()
+
+    async def run():
+        first = manager._get_http()
+        assert manager._get_http() is first
+        await manager.aclose()
+        assert first.is_closed
+        assert manager._get_http() is not first
+        await manager.aclose()
+
+    asyncio.run(run())
+    asyncio.run(run())
+
+
+def test_http_client_is_closed_when_its_event_loop_shuts_down():
+    manager = ModelManager()
+
+    async def run():
+        return manager._get_http()
+
+    client = asyncio.run(run())
+    assert client.is_closed
+    assert not manager._http_clients
+
+
+def test_refresh_models_fetches_providers_concurrently():
+    manager = ModelManager()
+    manager.set_api_keys(gemini_key="g", grok_key="x")
+    running = []
+    peak = []
+
+    def make_fetch(name):
+        async def fetch():
+            running.append(name)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.remove(name)
+            return [name]
+        return fetch
+
+    manager.fetch_available_gemini_models = make_fetch("gemini")
+    manager.fetch_available_grok_models = make_fetch("grok")
+    asyncio.run(manager.refresh_models())
+    assert max(peak) == 2
+
+
+def test_gemini_listing_runs_off_event_loop(monkeypatch):
+    import threading
+    from types import SimpleNamespace
+    from app.core import model_config
+
+    listed_in = []
+
+    class FakeModels:
+        def list(self):
+            listed_in.append(threading.current_thread())
+            return [
+                SimpleNamespace(name="models/chat", supported_actions=["generateContent"]),
+                SimpleNamespace(name="models/embed", supported_actions=["embedContent"]),
+                SimpleNamespace(name="models/bare"),
+            ]
+
+    monkeypatch.setattr(model_config.genai, "Client", lambda api_key: SimpleNamespace(models=FakeModels()))
+    manager = ModelManager()
+    manager.set_api_keys(gemini_key="g")
+
+    assert asyncio.run(manager.fetch_available_gemini_models()) == ["models/chat"]
+    assert listed_in and listed_in[0] is not threading.main_thread()
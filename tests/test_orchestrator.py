@@ -0,0 +1,47 @@
+import asyncio
+import warnings
+from collections import deque
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore", DeprecationWarning)
+    from app.core.orchestrator import Orchestrator
+
+
+class _ActionOnlyLLM:
+    """Каждая итерация просит инструмент — финального ответа нет."""
+
+    async def stream_chat(self, prompt, model=None, specific_model=None):
+        yield 'ACTION: web_search {"query": "x"}'
+
+
+class _Tools:
+    async def execute_tool(self, name, _context=None, **kwargs):
+        return {"ok": True}
+
+
+class _Rag:
+    available = False
+
+
+def _orchestrator(max_iterations):
+    orchestrator = Orchestrator.__new__(Orchestrator)
+    orchestrator.llm = _ActionOnlyLLM()
+    orchestrator.rag = _Rag()
+    orchestrator.tool_manager = _Tools()
+    orchestrator.history = deque()
+    orchestrator.max_iterations = max_iterations
+    orchestrator._build_system_prompt = lambda **kwargs: "prompt"
+    return orchestrator
+
+
+def test_iteration_limit_notice_closes_the_stream():
+    orchestrator = _orchestrator(max_iterations=2)
+
+    async def run():
+        return [chunk async for chunk in orchestrator.process_user_message("q", model_preference="gemini")]
+
+    chunks = asyncio.run(run())
+    assert chunks[-1] == "\n\n⚠️ Достигнут лимит итераций — ответ выше может быть неполным."
+    assert not chunks[-1].rstrip().endswith(":")
+    final = orchestrator.history[-1]["content"]
+    assert final.startswith("Достигнут лимит итераций. Вот что удалось выяснить:\n\nACTION: web_search")
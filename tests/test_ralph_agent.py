@@ -0,0 +1,40 @@
+"""
+Tests for RalphWiggumAgent completion detection (app.agents.ralph_agent).
+"""
+import asyncio
+
+from app.agents.ralph_agent import RalphWiggumAgent
+
+
+class ScriptedLLMProvider:
+    """Отдаёт чанки по одному и запоминает, сколько было прочитано."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.consumed = 0
+        self.closed = False
+
+    async def stream_chat(self, prompt, model=None, specific_model=None):
+        try:
+            for chunk in self.chunks:
+                self.consumed += 1
+                yield chunk
+        finally:
+            self.closed = True
+
+
+def test_stream_stops_once_promise_is_printed():
+    agent = RalphWiggumAgent()
+    agent._llm_provider = ScriptedLLMProvider(
+        ["x" * 5000, "done <prom", "ise>COMPLETE</promise>", "trailing", "tokens"]
+    )
+    result = asyncio.run(agent.execute("task", {"use_rag": False, "model": "grok"}))
+    assert result["metadata"]["completed"] is True
+    assert result["metadata"]["iterations"] == 1
+    assert agent._llm_provider.consumed == 3
+    assert agent._llm_provider.closed
+
+
+def test_completion_promise_is_matched_in_output_tail_only():
+    assert RalphWiggumAgent._has_completion_promise("x" * 10000 + "<promise> ALL\n DONE </promise>", "ALL DONE")
+    assert not RalphWiggumAgent._matches_promise("<promise>COMPLETE</promise>" + "y" * 3000, "COMPLETE")
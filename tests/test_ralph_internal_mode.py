@@ -0,0 +1,65 @@
+import asyncio
+
+from app.core.modes.ralph_internal_mode import RALPH_KEEP_ITERATIONS, RalphInternalMode
+
+
+class _StubLLM:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.prompts = []
+
+    async def stream_chat(self, prompt, model=None, specific_model=None):
+        self.prompts.append(prompt)
+        yield self.responses.pop(0)
+
+
+class _StubOrchestrator:
+    def __init__(self, responses):
+        self.history = []
+        self.llm = _StubLLM(responses)
+
+        class _Rag:
+            available = False
+
+        self.rag = _Rag()
+
+
+def _run(mode, message, **kwargs):
+    async def run():
+        return [chunk async for chunk in mode.execute(message, use_rag=False, **kwargs)]
+
+    return asyncio.run(run())
+
+
+def test_max_iterations_keeps_only_recent_iterations():
+    orchestrator = _StubOrchestrator([f"result-{i}" for i in range(1, 6)])
+    mode = RalphInternalMode(orchestrator)
+
+    _run(mode, "задача", execution_context={"max_iterations": 5, "completion_promise": "DONE"})
+
+    final_answer = orchestrator.history[-1]["content"]
+    assert "result-1" not in final_answer
+    for i in range(6 - RALPH_KEEP_ITERATIONS, 6):
+        assert f"**Iteration {i}:**\nresult-{i}" in final_answer
+    assert "Достигнут лимит итераций (5)" in final_answer
+
+
+def test_continue_prompt_carries_previous_result_and_promise():
+    orchestrator = _StubOrchestrator(["черновик {x}", "готово <promise>DONE</promise>"])
+    mode = RalphInternalMode(orchestrator)
+
+    _run(mode, "задача", execution_context={"max_iterations": 5, "completion_promise": "DONE"})
+
+    first, second = orchestrator.llm.prompts
+    assert first.startswith("You are working on the following task.")
+    assert first.endswith("Begin working:")
+    assert second.startswith("Continue working on this task. You've completed 1 iteration(s).")
+    assert "Previous Results:\nчерновик {x}\n" in second
+    assert "output exactly: <promise>DONE</promise>" in second
+    assert second.endswith("Continue:")
+
+
+def test_has_completion_promise_normalizes_and_ignores_case_of_tag():
+    assert RalphInternalMode._has_completion_promise("x <PROMISE> ALL\n DONE </Promise>", "ALL DONE")
+    assert not RalphInternalMode._has_completion_promise("<promise>NOPE</promise>", "ALL DONE")
+    assert not RalphInternalMode._has_completion_promise("no tag here", "ALL DONE")
@@ -0,0 +1,35 @@
+"""
+Tests for ReActAgent orchestrator initialization (app.agents.react_agent).
+"""
+import asyncio
+
+from app.agents.react_agent import ReActAgent
+
+
+class CountingOrchestrator:
+    """Считает вызовы initialize и отдаёт задачу одним чанком."""
+
+    def __init__(self):
+        self.init_calls = 0
+
+    async def initialize(self):
+        self.init_calls += 1
+        await asyncio.sleep(0.01)
+
+    async def process_user_message(self, message, **kwargs):
+        yield message
+
+
+def test_concurrent_executes_initialize_orchestrator_once():
+    agent = ReActAgent()
+    orchestrator = agent._orchestrator = CountingOrchestrator()
+
+    async def run():
+        return await asyncio.gather(*(agent.execute(f"task {i}", {'use_rag': False}) for i in range(5)))
+
+    results = asyncio.run(run())
+    assert [r['result'] for r in results] == [f"task {i}" for i in range(5)]
+    assert orchestrator.init_calls == 1
+
+    asyncio.run(agent.execute("again", {'use_rag': False}))
+    assert orchestrator.init_calls == 1
@@ -0,0 +1,250 @@
+import asyncio
+
+from app.core.modes.react_mode import ReActMode
+from app.core.unified_orchestrator import UnifiedOrchestrator
+
+
+class _ScriptedLLM:
+    """Каждый вызов stream_chat отдаёт следующий сценарий чанками; фиксирует, сколько прочитано."""
+
+    def __init__(self, scripts):
+        self.scripts = list(scripts)
+        self.consumed = []
+        self.closed = []
+
+    async def stream_chat(self, prompt, model=None, specific_model=None):
+        chunks = self.scripts.pop(0)
+        read = []
+        self.consumed.append(read)
+        try:
+            for chunk in chunks:
+                read.append(chunk)
+                yield chunk
+        finally:
+            self.closed.append(len(read) < len(chunks))
+
+
+class _StubOrchestrator:
+    def __init__(self, scripts, tool_result):
+        self.history = []
+        self.llm = _ScriptedLLM(scripts)
+        self.tool_calls = []
+
+        async def execute_tool(name, _context=None, **kwargs):
+            self.tool_calls.append((name, kwargs))
+            return tool_result
+
+        class _Tools:
+            pass
+
+        class _Rag:
+            available = False
+
+        self.tool_manager = _Tools()
+        self.tool_manager.execute_tool = execute_tool
+        self.rag = _Rag()
+
+    def _build_system_prompt(self, **kwargs):
+        return "prompt"
+
+    _parse_action = UnifiedOrchestrator._parse_action
+
+    @staticmethod
+    def _format_tool_result(result):
+        return str(result)
+
+
+def _run(mode, message):
+    async def run():
+        return [chunk async for chunk in mode.execute(message, use_rag=False)]
+
+    return asyncio.run(run())
+
+
+def test_streams_thoughts_and_stops_generation_after_action():
+    orchestrator = _StubOrchestrator(
+        [
+            ["Смотрю ", "задачи.\nACT", 'ION: web_search {"query": "x"}', " лишний хвост", " ещё"],
+            ["Готово: ", "ответ"],
+        ],
+        tool_result={"ok": True},
+    )
+
+    chunks = _run(ReActMode(orchestrator), "найди")
+
+    assert orchestrator.tool_calls == [("web_search", {"query": "x"})]
+    # Генерация после разобранного ACTION закрыта, хвост не читался
+    assert orchestrator.llm.consumed[0][-1] == 'ION: web_search {"query": "x"}'
+    assert orchestrator.llm.closed == [True, False]
+    assert "".join(chunks) == "Смотрю задачи.\n\n\nГотово: ответ"
+    assert orchestrator.history[-1] == {"role": "assistant", "content": "Готово: ответ"}
+
+
+def test_streamed_answer_links_task_ids_split_across_chunks():
+    orchestrator = _StubOrchestrator(
+        [
+            ['ACTION: tasks_list {"status": "TODO"}'],
+            ["Задача #1", "2 и [#7] в работе, см. #3"],
+        ],
+        tool_result={"tasks": []},
+    )
+
+    chunks = _run(ReActMode(orchestrator), "что по задачам")
+
+    answer, payload = "".join(chunks).split("\n\nWEU_TASKS_JSON:")
+    assert answer == "Задача **[#12](task:12)** и [#7] в работе, см. **[#3](task:3)**"
+    assert '"source_tool":"tasks_list"' in payload
+    assert orchestrator.history[-1]["content"] == "Задача #12 и [#7] в работе, см. #3"
+
+
+class _KeywordEncoder:
+    """Эмбеддинг по ключевым словам: перефразы с теми же словами совпадают."""
+
+    VOCAB = ("nginx", "restart", "tasks")
+
+    def encode(self, text):
+        words = text.lower().replace("?", "").split()
+        return [float(sum(word.startswith(key) for word in words)) for key in self.VOCAB]
+
+
+def test_semantic_cache_answers_paraphrase_without_llm(monkeypatch):
+    from app.agents.semantic_cache import SemanticCache
+    from app.core.modes import react_mode
+
+    monkeypatch.setattr(
+        react_mode, "_answer_cache", SemanticCache(capacity=4, encoder=_KeywordEncoder())
+    )
+    orchestrator = _StubOrchestrator(
+        [
+            ["Перезапусти ", "nginx."],
+            ['ACTION: tasks_list {"status": "TODO"}'],
+            ["Задач нет"],
+            ["Задач всё ещё нет"],
+        ],
+        tool_result={"tasks": []},
+    )
+    mode = ReActMode(orchestrator)
+
+    assert "".join(_run(mode, "restart nginx")) == "Перезапусти nginx."
+    orchestrator.history.clear()
+    assert _run(mode, "Restarting NGINX?") == ["Перезапусти nginx."]
+    assert orchestrator.history[-1] == {"role": "assistant", "content": "Перезапусти nginx."}
+
+    # Ответы по данным инструментов в кэш не попадают
+    orchestrator.history.clear()
+    _run(mode, "tasks")
+    orchestrator.history.clear()
+    assert "".join(_run(mode, "tasks?")) == "Задач всё ещё нет"
+    assert orchestrator.llm.scripts == []
+
+
+def test_semantic_cache_is_scoped_to_conversation_history(monkeypatch):
+    from app.agents.semantic_cache import SemanticCache
+    from app.core.modes import react_mode
+
+    monkeypatch.setattr(
+        react_mode, "_answer_cache", SemanticCache(capacity=4, encoder=_KeywordEncoder())
+    )
+    orchestrator = _StubOrchestrator([["Про nginx"], ["Про nginx в другом разговоре"]], tool_result=None)
+    mode = ReActMode(orchestrator)
+
+    _run(mode, "restart nginx")
+    # Тот же вопрос, но после другой истории — промпт другой, кэш не используется
+    orchestrator.history[:] = [
+        {"role": "user", "content": "какие серверы есть?"},
+        {"role": "assistant", "content": "web-1 и web-2"},
+    ]
+    assert "".join(_run(mode, "restart nginx")) == "Про nginx в другом разговоре"
+    assert orchestrator.llm.scripts == []
+
+
+def test_rag_context_reaches_first_prompt():
+    class _Rag:
+        available = True
+
+        def __init__(self):
+            self.calls = []
+
+        def query(self, text, k, user_id):
+            self.calls.append((text, k, user_id))
+            return {"documents": [["заметка из базы знаний"]]}
+
+        def add_text(self, *args):
+            pass
+
+    orchestrator = _StubOrchestrator([["Ответ"]], tool_result=None)
+    orchestrator.rag = _Rag()
+    prompts = []
+    orchestrator._build_system_prompt = lambda **kwargs: prompts.append(kwargs) or "prompt"
+
+    async def run():
+        return [chunk async for chunk in ReActMode(orchestrator).execute("вопрос", user_id=7)]
+
+    assert asyncio.run(run()) == ["Ответ"]
+    assert orchestrator.rag.calls == [("вопрос", 3, 7)]
+    assert prompts[0]["rag_context"] == "📚 заметка из базы знаний"
+
+
+def test_verification_runs_only_after_write_tools():
+    long_answer = "Готово. " * 40
+
+    readonly = _StubOrchestrator(
+        [['ACTION: web_search {"query": "x"}'], [long_answer]], tool_result={"ok": True}
+    )
+    assert "".join(_run(ReActMode(readonly), "найди")) == long_answer
+    assert len(readonly.llm.consumed) == 2
+
+    writing = _StubOrchestrator(
+        [['ACTION: task_create {"title": "x"}'], [long_answer], ["VERIFIED: O", "K", "\nлишнее"]],
+        tool_result={"id": 1},
+    )
+    assert "".join(_run(ReActMode(writing), "создай задачу")) == long_answer
+    assert writing.llm.scripts == []
+    # Вердикт OK дочитан — хвост проверки не генерируется
+    assert writing.llm.consumed[-1] == ["VERIFIED: O", "K"]
+
+
+def test_workspace_relative_path():
+    from app.core.modes.react_mode import _workspace_relative_path
+
+    assert _workspace_relative_path("/ws/src/app.py", "/ws") == "src/app.py"
+    assert _workspace_relative_path("/ws/./src//app.py", "/ws/") == "src/app.py"
+    assert _workspace_relative_path("/ws2/app.py", "/ws") == "/ws2/app.py"
+    assert _workspace_relative_path("src\\app.py", "/ws") == "src/app.py"
+
+
+def test_tool_context_built_once_from_execution_context():
+    orchestrator = _StubOrchestrator(
+        [['ACTION: web_search {"query": "a"}'], ['ACTION: web_search {"query": "b"}'], ["Готово"]],
+        tool_result={"ok": True},
+    )
+    contexts = []
+
+    async def execute_tool(name, _context=None, **kwargs):
+        contexts.append(_context)
+        return {"ok": True}
+
+    orchestrator.tool_manager.execute_tool = execute_tool
+    execution_context = {"user_id": 5, "master_password": "pw", "from_ide": True, "allowed_tools": None}
+
+    async def run():
+        mode = ReActMode(orchestrator)
+        return [c async for c in mode.execute("q", use_rag=False, execution_context=execution_context)]
+
+    asyncio.run(run())
+    assert contexts == [{"user_id": 5, "master_password": "pw"}] * 2
+    assert contexts[0] is contexts[1]
+    assert execution_context == {"user_id": 5, "master_password": "pw", "from_ide": True, "allowed_tools": None}
+
+
+def test_iteration_limit_note_closes_the_stream():
+    orchestrator = _StubOrchestrator(
+        [[f'ACTION: web_search {{"query": "{i}"}}'] for i in range(7)],
+        tool_result={"ok": True},
+    )
+
+    chunks = _run(ReActMode(orchestrator), "q")
+
+    assert len(orchestrator.tool_calls) == 7
+    assert chunks[-1] == "\n\n⚠️ Достигнут лимит итераций — ответ выше может быть неполным."
+    assert orchestrator.history[-1]["content"].startswith("Достигнут лимит итераций. Вот что удалось выяснить:\n\n")
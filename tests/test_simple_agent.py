@@ -0,0 +1,132 @@
+"""
+Tests for SimpleAgent response cache (app.agents.simple_agent).
+"""
+import asyncio
+
+from app.agents.simple_agent import SimpleAgent
+
+
+class CountingLLMProvider:
+    def __init__(self):
+        self.calls = 0
+
+    async def stream_chat(self, prompt, model=None, specific_model=None):
+        self.calls += 1
+        yield f"answer {self.calls}"
+
+
+def test_repeated_task_is_served_from_cache():
+    SimpleAgent.clear_cache()
+    agent = SimpleAgent()
+    agent._llm_provider = CountingLLMProvider()
+    context = {"model": "grok"}
+
+    first = asyncio.run(agent.execute("What is nginx?", context))
+    second = asyncio.run(agent.execute("What is nginx?", context))
+    other = asyncio.run(agent.execute("What is nginx?", {"model": "gemini"}))
+
+    assert second["result"] == first["result"] == "answer 1"
+    assert second["metadata"]["cache"] == "hit"
+    assert "cache" not in first["metadata"]
+    assert other["result"] == "answer 2"
+    assert agent._llm_provider.calls == 2
+
+
+class FailingOnceLLMProvider:
+    """Первый вызов — сбой провайдера (как в LLMProvider: текст ошибки в потоке), дальше — ответ"""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def stream_chat(self, prompt, model=None, specific_model=None):
+        self.calls += 1
+        if self.calls == 1:
+            yield "Error: Timeout (Gemini stream)."
+        else:
+            yield "real answer"
+
+
+def test_failed_llm_call_is_not_cached():
+    SimpleAgent.clear_cache()
+    agent = SimpleAgent()
+    agent._llm_provider = FailingOnceLLMProvider()
+    context = {"model": "gemini"}
+
+    failed = asyncio.run(agent.execute("What is nginx?", context))
+    retried = asyncio.run(agent.execute("What is nginx?", context))
+
+    assert failed["result"] == "Error: Timeout (Gemini stream)."
+    assert retried["result"] == "real answer"
+    assert "cache" not in retried["metadata"]
+    assert agent._llm_provider.calls == 2
+
+
+def test_stream_agent_forwards_chunks_before_result():
+    from app.agents.manager import AgentManager
+
+    SimpleAgent.clear_cache()
+    manager = AgentManager()
+    agent = manager.get_agent("Simple Agent")
+    agent._llm_provider = CountingLLMProvider()
+
+    async def collect():
+        return [event async for event in manager.stream_agent("simple", "Explain DNS", {"model": "grok"})]
+
+    events = asyncio.run(collect())
+    assert [event["type"] for event in events] == ["chunk", "result"]
+    assert events[0]["data"] == "answer 1"
+    assert events[-1]["data"]["result"] == "answer 1"
+
+
+class KeywordEncoder:
+    """Эмбеддинг по ключевым словам: перефразы с теми же словами совпадают."""
+
+    VOCAB = ("nginx", "restart", "dns", "explain")
+
+    def encode(self, text):
+        words = text.lower().replace("?", "").split()
+        return [float(sum(word.startswith(key) for word in words)) for key in self.VOCAB]
+
+
+def test_semantic_cache_matches_paraphrase_within_bucket():
+    from app.agents.semantic_cache import SemanticCache
+
+    cache = SemanticCache(capacity=2, threshold=0.9, encoder=KeywordEncoder())
+    cache.store(cache.embed("restart nginx"), "sudo systemctl restart nginx", "grok")
+
+    hit = cache.lookup(cache.embed("Restarting NGINX?"), "grok")
+    assert hit is not None and hit[0] == "sudo systemctl restart nginx" and hit[1] > 0.99
+    assert cache.lookup(cache.embed("restart nginx"), "gemini") is None
+    assert cache.lookup(cache.embed("explain dns"), "grok") is None
+
+    # Ёмкость 2: третья запись вытесняет давно не использованную
+    cache.store(cache.embed("explain dns"), "dns answer", "grok")
+    cache.lookup(cache.embed("restart nginx"), "grok")
+    cache.store(cache.embed("explain nginx"), "nginx answer", "grok")
+    assert cache.lookup(cache.embed("explain dns"), "grok") is None
+    assert cache.lookup(cache.embed("restart nginx"), "grok") is not None
+
+
+def test_semantic_cache_embeds_off_the_event_loop(monkeypatch):
+    import threading
+
+    from app.agents import simple_agent
+    from app.agents.semantic_cache import SemanticCache
+
+    threads = []
+
+    class RecordingEncoder(KeywordEncoder):
+        def encode(self, text):
+            threads.append(threading.get_ident())
+            return super().encode(text)
+
+    monkeypatch.setattr(simple_agent, "_semantic_cache", SemanticCache(capacity=4, encoder=RecordingEncoder()))
+    SimpleAgent.clear_cache()
+    agent = SimpleAgent()
+    agent._llm_provider = CountingLLMProvider()
+
+    first = asyncio.run(agent.execute("restart nginx", {"model": "grok"}))
+    second = asyncio.run(agent.execute("Restarting NGINX?", {"model": "grok"}))
+
+    assert second["result"] == first["result"] == "answer 1"
+    assert threads and threading.get_ident() not in threads
@@ -0,0 +1,26 @@
+"""
+Tests for ToolManager tool descriptions (app.tools.manager).
+"""
+from app.tools.base import BaseTool, ToolMetadata
+from app.tools.manager import ToolManager
+
+
+class EchoTool(BaseTool):
+    def get_metadata(self):
+        return ToolMetadata(name="echo_tool", description="Echo input", category="test", parameters=[])
+
+    async def execute(self, **kwargs):
+        return kwargs
+
+
+def test_tools_description_cached_until_register():
+    manager = ToolManager()
+    first = manager.get_tools_description()
+    assert manager.get_tools_description() is first
+    assert "echo_tool" not in first
+
+    manager.register_tool(EchoTool())
+    updated = manager.get_tools_description()
+    assert "- **echo_tool**: Echo input" in updated
+    assert "echo_tool" not in manager.get_tools_description(exclude_tools=["echo_tool"])
+    assert manager.get_tools_description(include_tools=["echo_tool"]).startswith("AVAILABLE TOOLS:\n\n## TEST\n")
@@ -0,0 +1,41 @@
+from app.core.unified_orchestrator import UnifiedOrchestrator
+
+
+def test_parse_action_extracts_tool_and_args():
+    parse = UnifiedOrchestrator._parse_action
+
+    assert parse(None, 'Сейчас проверю.\nACTION: tasks_list {"status": "TODO"}') == {
+        "tool": "tasks_list",
+        "args": {"status": "TODO"},
+    }
+    assert parse(None, "Просто ответ без инструмента") is None
+    assert parse(None, "ACTION: tasks_list {broken") is None
+
+
+def test_queue_rag_write_batches_records_off_the_request_path():
+    import asyncio
+
+    class _Rag:
+        def __init__(self):
+            self.batches = []
+
+        def add_texts(self, records):
+            self.batches.append(list(records))
+            return len(records)
+
+    orchestrator = UnifiedOrchestrator.__new__(UnifiedOrchestrator)
+    orchestrator.rag = _Rag()
+    orchestrator._rag_writers = {}
+
+    async def run():
+        for i in range(3):
+            assert orchestrator.queue_rag_write(f"Q{i}", "conversation", 1)
+        assert orchestrator.rag.batches == []  # запись не блокирует вызывающего
+        await asyncio.sleep(0.05)
+        # Закрытие loop: недописанное дописывается при отмене писателя
+        orchestrator.queue_rag_write("Q3", "conversation", 1)
+
+    asyncio.run(run())
+    records = [record for batch in orchestrator.rag.batches for record in batch]
+    assert orchestrator.rag.batches[0] == [(f"Q{i}", "conversation", 1) for i in range(3)]
+    assert records[-1] == ("Q3", "conversation", 1)
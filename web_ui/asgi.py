@@ -18,6 +18,9 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'web_ui.settings')
 django_asgi_app = get_asgi_application()
 
 import web_ui.routing  # noqa: E402
+from app.agents.cli_runtime import install_uvloop_policy  # noqa: E402
+
+install_uvloop_policy()
 
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
@@ -245,6 +245,10 @@ DATA_UPLOAD_MAX_MEMORY_SIZE = 50 * 1024 * 1024  # 50MB
 # CLI runtime timeout (РѕР±С‰РёР№ Р»РёРјРёС‚ РІСЂРµРјРµРЅРё СЂР°Р±РѕС‚С‹ РїСЂРѕС†РµСЃСЃР°)
 CLI_RUNTIME_TIMEOUT_SECONDS = int(os.getenv("CLI_RUNTIME_TIMEOUT_SECONDS", "600"))
 
+# uvloop для event loop'ов процесса (быстрее subprocess-пайпы CLI runtime). Политика глобальная,
+# поэтому только явно: USE_UVLOOP=1; ставится на старте в web_ui/asgi.py и web_ui/wsgi.py
+USE_UVLOOP = os.getenv("USE_UVLOOP", "").lower() in ("true", "1", "yes")
+
 # РўР°Р№РјР°СѓС‚ В«РїРµСЂРІРѕРіРѕ РІС‹РІРѕРґР°В»: РµСЃР»Рё Claude РЅРµ РІС‹РІРµР» РЅРё РѕРґРЅРѕР№ СЃС‚СЂРѕРєРё Р·Р° СЌС‚Рѕ РІСЂРµРјСЏ вЂ” РїСЂРµСЂРІР°С‚СЊ.
 # РћР±С‹С‡РЅРѕ РѕР·РЅР°С‡Р°РµС‚, С‡С‚Рѕ Claude Р¶РґС‘С‚ MCP-СЃРµСЂРІРµСЂ, РєРѕС‚РѕСЂС‹Р№ РЅРµ Р·Р°РїСѓСЃС‚РёР»СЃСЏ РёР»Рё Р·Р°РІРёСЃ РїСЂРё СЃС‚Р°СЂС‚Рµ Django.
 CLI_FIRST_OUTPUT_TIMEOUT_SECONDS = int(os.getenv("CLI_FIRST_OUTPUT_TIMEOUT_SECONDS", "120"))
@@ -358,9 +362,12 @@ CLI_RUNTIME_CONFIG = {
             "mcp-config",       # РџСѓС‚СЊ Рє MCP РєРѕРЅС„РёРіСѓ (РґР»СЏ server_execute Рё РґСЂ.)
             "allowedTools",     # Р Р°Р·СЂРµС€С‘РЅРЅС‹Рµ РёРЅСЃС‚СЂСѓРјРµРЅС‚С‹
             "agent",            # РљР°СЃС‚РѕРјРЅС‹Р№ Р°РіРµРЅС‚
+            "append-system-prompt",  # Стабильный контекст агента (кэшируемый префикс)
             "continue",         # -c РґР»СЏ РїСЂРѕРґРѕР»Р¶РµРЅРёСЏ СЃРµСЃСЃРёРё
         ],
         "timeout_seconds": 1800,  # 30 РјРёРЅСѓС‚ РґР»СЏ РіР»СѓР±РѕРєРёС… РѕРїРµСЂР°С†РёР№
+        # Ralph-цикл: итерации 2..N идут через --continue с короткой дельтой вместо полного промпта
+        "supports_continue": True,
     },
     # Codex (OpenAI): codex exec для headless, требует CODEX_API_KEY или OPENAI_API_KEY
     # Документация: https://developers.openai.com/codex
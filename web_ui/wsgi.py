@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'web_ui.settings')
 
 application = get_wsgi_application()
+
+from app.agents.cli_runtime import install_uvloop_policy  # noqa: E402
+
+install_uvloop_policy()